@@ -1,67 +1,984 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, g, has_app_context, Response
+from flask.sessions import SessionInterface, SessionMixin
 from flask_cors import CORS
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, File, Data, Epilogue
+from markupsafe import Markup
+from jinja2 import Template
+import atexit
+import contextvars
 import json
+import csv
+import io
 import uuid
 import os
-from datetime import datetime
+import socket
+import sys
+from datetime import datetime, timedelta
 import hashlib
+import hmac
+import base64
+import secrets
+import time
 import sqlite3
-from functools import wraps
-from pymongo import MongoClient
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+import heapq
+import bisect
+import re
+import itertools
+import math
+from collections import defaultdict, deque, OrderedDict
+from functools import lru_cache, wraps
+import click
+from pymongo import MongoClient, ASCENDING, DESCENDING, IndexModel, ReplaceOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from bson import ObjectId
 import logging
+import logging.handlers
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
 app.secret_key = 'caresync_secret_key'  # For session management
+app.config.setdefault('DATABASE', 'caresync.db')
+app.config.setdefault('SQLITE_POOL_SIZE', 8)
+app.config.setdefault('JOURNAL_COMPACT_EVERY', 500)
+app.config.setdefault('SESSION_CACHE_SIZE', 4096)
+app.config.setdefault('BED_RESERVATION_TTL', 15 * 60)
+app.config.setdefault('AMBULANCE_GRID_DEGREES', 0.05)
+app.config.setdefault('AMBULANCE_REFRESH_SECONDS', 1.0)
+app.config.setdefault('IMPORT_BATCH_SIZE', 500)
+app.config.setdefault('IMPORT_MAX_ERRORS', 1000)
+app.config.setdefault('EXPORT_BATCH_SIZE', 1000)
+app.config.setdefault('SSE_HEARTBEAT_SECONDS', 15)
+app.config.setdefault('SSE_QUEUE_SIZE', 256)
+app.config.setdefault('DASHBOARD_PAGE_SIZE', 25)
+app.config.setdefault('DASHBOARD_MAX_PAGE_SIZE', 200)
+# 'per_clinic' keeps one collection per clinic; 'consolidated' uses a single
+# patients collection (see the migrate-patients command)
+app.config.setdefault('PATIENT_STORAGE', os.environ.get('CARESYNC_PATIENT_STORAGE', 'per_clinic'))
+app.config.setdefault('FAN_OUT_WORKERS', 16)
+app.config.setdefault('RESPONSE_CACHE_BYTES', 4 * 1024 * 1024)
+app.config.setdefault('FRAGMENT_CACHE_SIZE', 512)
+app.config.setdefault('SEARCH_REFRESH_SECONDS', 1.0)
+app.config.setdefault('HOSPITAL_REFRESH_SECONDS', 1.0)
+app.config.setdefault('DISPATCH_WORKERS', 2)
+app.config.setdefault('DISPATCH_POLL_SECONDS', 1.0)
+app.config.setdefault('DISPATCH_VISIBILITY_TIMEOUT', 30)
+app.config.setdefault('DISPATCH_MAX_ATTEMPTS', 5)
+app.config.setdefault('DISPATCH_NO_AMBULANCE_RETRY_SECONDS', 15)
+app.config.setdefault('MONGO_URI', os.environ.get('CARESYNC_MONGO_URI', 'mongodb://localhost:27017/'))
+app.config.setdefault('MONGO_DATABASE', 'caresync_db')
+app.config.setdefault('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)
+app.config.setdefault('METRICS_ENABLED', True)
+# /metrics needs this bearer token or an admin session, unless METRICS_PUBLIC is set
+app.config.setdefault('METRICS_TOKEN', os.environ.get('CARESYNC_METRICS_TOKEN'))
+app.config.setdefault('METRICS_PUBLIC', os.environ.get('CARESYNC_METRICS_PUBLIC', '').lower() in ('1', 'true', 'yes'))
+app.config.setdefault('SLOW_REQUEST_SECONDS', 1.0)
+# Per-endpoint overrides of SLOW_REQUEST_SECONDS, e.g. {'export_patients': 30}; None disables
+app.config.setdefault('SLOW_REQUEST_THRESHOLDS', {})
+app.config.setdefault('SLOW_REQUEST_LOG_SIZE', 200)
+app.config.setdefault('LOG_LEVEL', os.environ.get('CARESYNC_LOG_LEVEL', 'INFO').upper())
+# Per-logger levels: a dict, or a string like CARESYNC_LOG_LEVELS="werkzeug=WARNING,app=DEBUG"
+app.config.setdefault('LOG_LEVELS', os.environ.get('CARESYNC_LOG_LEVELS', ''))
+app.config.setdefault('LOG_FORMAT', os.environ.get('CARESYNC_LOG_FORMAT', 'json'))
+# Fraction of sub-WARNING records to keep per logger, e.g. {'werkzeug': 0.1}; 0 drops them all
+app.config.setdefault('LOG_SAMPLING', {})
+app.config.setdefault('LOG_QUEUE_SIZE', 10000)
+# Node number (0-1023) baked into generated IDs. When unset, each process
+# leases a free node from the database; set it per process when several hosts
+# write to different databases but share the IDs
+app.config.setdefault('ID_NODE', os.environ.get('CARESYNC_ID_NODE'))
+app.config.setdefault('ID_NODE_LEASE_SECONDS', 600)
+app.config.setdefault('ID_RETRY_ATTEMPTS', 3)
+
+# Request, database and template instrumentation, exposed at /metrics
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, labels, extra=''):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+                for labels, value in sorted(values)]
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = [(labels, (list(series[0]), series[1], series[2])) for labels, series in self._values.items()]
+        lines = []
+        for labels, (counts, total, count) in sorted(values):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+class MetricsRegistry:
+    """The set of metrics rendered at /metrics in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+
+    def counter(self, name, help, labelnames=()):
+        return self._metrics.setdefault(name, Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+request_duration = metrics.histogram('caresync_request_duration_seconds', 'Time spent handling a request.',
+                                     ('route', 'method', 'status'))
+requests_total = metrics.counter('caresync_requests_total', 'Requests handled.',
+                                 ('route', 'method', 'status', 'clinic'))
+db_call_duration = metrics.histogram('caresync_db_call_duration_seconds', 'Duration of single Mongo/SQLite calls.',
+                                     ('db', 'operation', 'route'))
+db_calls_total = metrics.counter('caresync_db_calls_total', 'Mongo/SQLite calls made.',
+                                 ('db', 'operation', 'route', 'clinic'))
+db_seconds_total = metrics.counter('caresync_db_seconds_total', 'Time spent in Mongo/SQLite calls.',
+                                   ('db', 'operation', 'route', 'clinic'))
+db_errors_total = metrics.counter('caresync_db_errors_total', 'Mongo/SQLite calls that raised.',
+                                  ('db', 'operation', 'route'))
+template_duration = metrics.histogram('caresync_template_render_seconds', 'Time spent rendering a Jinja template.',
+                                      ('template', 'route'))
+
+class RequestMetrics:
+    """Calls made while serving one request; flushed into the registry at the end.
+
+    Recording only appends to a list, which is safe from the executor
+    threads a request fans out to and keeps the global locks off the hot path.
+    """
+
+    __slots__ = ('route', 'clinic', 'calls')
+
+    def __init__(self):
+        self.route = 'unmatched'
+        self.clinic = ''
+        self.calls = []
+
+    def totals(self):
+        totals = defaultdict(lambda: [0, 0.0])
+        for kind, _, seconds, _ in self.calls:
+            totals[kind][0] += 1
+            totals[kind][1] += seconds
+        return totals
+
+_request_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+def record_call(kind, operation, seconds, failed=False):
+    """Record one Mongo/SQLite call or template render against the current request"""
+    current = _request_metrics.get()
+    if current is not None:
+        current.calls.append((kind, operation, seconds, failed))
+        return
+    _flush_call('background', '', kind, operation, seconds, failed)
+
+def _flush_call(route, clinic, kind, operation, seconds, failed):
+    if kind == 'template':
+        template_duration.observe((operation, route), seconds)
+        return
+    db_call_duration.observe((kind, operation, route), seconds)
+    db_calls_total.inc((kind, operation, route, clinic))
+    db_seconds_total.inc((kind, operation, route, clinic), seconds)
+    if failed:
+        db_errors_total.inc((kind, operation, route))
+
+def bind_request_metrics(fn):
+    """Wrap ``fn`` so calls it makes on a pool thread count towards the current request"""
+    current = _request_metrics.get()
+    if current is None:
+        return fn
+    @wraps(fn)
+    def bound(*args, **kwargs):
+        token = _request_metrics.set(current)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _request_metrics.reset(token)
+    return bound
+
+# Most recent requests that went over their slow-request threshold
+slow_requests = deque(maxlen=app.config['SLOW_REQUEST_LOG_SIZE'])
+
+def log_if_slow(current, method, path, status, seconds):
+    threshold = app.config['SLOW_REQUEST_THRESHOLDS'].get(current.route, app.config['SLOW_REQUEST_SECONDS'])
+    if threshold is None or seconds < threshold:
+        return
+    entry = {'at': datetime.now().isoformat(), 'method': method, 'path': path, 'route': current.route,
+             'clinic': current.clinic, 'status': status, 'total_ms': round(seconds * 1000, 2)}
+    accounted = 0.0
+    for kind, (calls, spent) in current.totals().items():
+        entry[f'{kind}_calls'] = calls
+        entry[f'{kind}_ms'] = round(spent * 1000, 2)
+        accounted += spent
+    # Whatever is left went to Python: joins, serialization, middleware
+    entry['other_ms'] = round(max(seconds - accounted, 0) * 1000, 2)
+    slow_requests.append(entry)
+    logger.warning("Slow request %s %s took %s ms", method, path, entry['total_ms'], extra={'slow_request': entry})
+
+class MetricsMiddleware:
+    """WSGI middleware that times each request and flushes its call metrics"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        current = RequestMetrics()
+        token = _request_metrics.set(current)
+        status = ['500']
+        def capture_status(status_line, headers, exc_info=None):
+            status[0] = status_line.split(' ', 1)[0]
+            return start_response(status_line, headers, exc_info)
+        started = time.perf_counter()
+        try:
+            # Streamed bodies are timed up to the first byte, not until the stream ends
+            return self.wsgi_app(environ, capture_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_metrics.reset(token)
+            method = environ.get('REQUEST_METHOD', '')
+            request_duration.observe((current.route, method, status[0]), elapsed)
+            requests_total.inc((current.route, method, status[0], current.clinic))
+            for kind, operation, seconds, failed in current.calls:
+                _flush_call(current.route, current.clinic, kind, operation, seconds, failed)
+            log_if_slow(current, method, environ.get('PATH_INFO', ''), status[0], elapsed)
+
+if app.config['METRICS_ENABLED']:
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+
+@app.before_request
+def tag_request_metrics():
+    current = _request_metrics.get()
+    if current is not None:
+        current.route = request.endpoint or 'unmatched'
+        # Free: the session is already open, and is a null session for
+        # static files and token scrapes (see SQLiteSessionInterface)
+        current.clinic = session.get('entity_id') or ''
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener feeding the Mongo call metrics"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        record_call('mongo', event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        record_call('mongo', event.command_name, event.duration_micros / 1e6, failed=True)
+
+@lru_cache(maxsize=1024)
+def sql_operation(sql):
+    """First keyword of a statement (SELECT, INSERT, BEGIN...), used as the metric label"""
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ''
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(sql, parameters)
+            failed = False
+            return result
+        finally:
+            record_call('sqlite', sql_operation(sql), time.perf_counter() - started, failed)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().executemany(sql, seq_of_parameters)
+            failed = False
+            return result
+        finally:
+            record_call('sqlite', sql_operation(sql), time.perf_counter() - started, failed)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """SQLite connection that times every statement and commit"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record_call('sqlite', 'COMMIT', time.perf_counter() - started)
+
+class TimedTemplate(Template):
+    """Jinja template that reports how long each render took"""
+
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            record_call('template', self.name or '<string>', time.perf_counter() - started)
+
+if app.config['METRICS_ENABLED']:
+    app.jinja_env.template_class = TimedTemplate
+
+# Logging: records are queued in the request thread and formatted and
+# written by a background thread
+log_records_dropped = metrics.counter('caresync_log_records_dropped_total',
+                                      'Log records dropped because the log queue was full.')
+log_records_sampled_out = metrics.counter('caresync_log_records_sampled_out_total',
+                                          'Log records skipped by per-logger sampling.', ('logger',))
+
+def parse_log_levels(value):
+    """Parse ``name=LEVEL,name=LEVEL`` into a dict"""
+    levels = {}
+    for item in (value or '').split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+class RequestContextFilter(logging.Filter):
+    """Tag records with the route and clinic of the request that logged them"""
+
+    def filter(self, record):
+        current = _request_metrics.get()
+        if current is not None:
+            record.route = current.route
+            record.clinic = current.clinic
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keep one in N records per (logger, message template) for configured loggers.
+
+    Only records below WARNING are sampled. The first record of each template
+    always gets through, and kept records carry ``sampled`` = N so counts can
+    be scaled back up.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.every = {name: max(1, round(1 / rate)) for name, rate in rates.items() if rate > 0}
+        self.disabled = {name for name, rate in rates.items() if rate <= 0}
+        self._seen = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        if record.name in self.disabled:
+            log_records_sampled_out.inc((record.name,))
+            return False
+        every = self.every.get(record.name)
+        if every is None or every == 1:
+            return True
+        with self._lock:
+            seen = self._seen[(record.name, record.msg)]
+            self._seen[(record.name, record.msg)] = seen + 1
+        if seen % every:
+            log_records_sampled_out.inc((record.name,))
+            return False
+        record.sampled = every
+        return True
+
+# Log arguments that cannot change after the call, so formatting them can wait
+_IMMUTABLE_LOG_ARGS = (str, bytes, int, float, bool, type(None), datetime)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that formats lazily and never blocks on a full queue.
+
+    ``msg % args`` is left for the writer thread when every argument is an
+    immutable scalar. A record with a dict, list or other object argument is
+    formatted in the caller, so a later mutation (a document gaining its
+    ``_id`` on insert, say) cannot change what was logged. Records dropped
+    by level or sampling never get here, so they are never formatted.
+    """
+
+    def prepare(self, record):
+        args = record.args
+        if args:
+            values = args.values() if isinstance(args, dict) else args
+            if not all(isinstance(value, _IMMUTABLE_LOG_ARGS) for value in values):
+                record.msg = record.getMessage()
+                record.args = None
+        if record.exc_info:
+            # Tracebacks hold frames; render them now rather than keep those alive
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+class LogWriter(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room so shutdown is not lost to a full queue
+        self.queue.put(self._sentinel, timeout=5)
+
+_RESERVED_LOG_ATTRS = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; ``extra`` fields are included as keys"""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_LOG_ATTRS:
+                payload[key] = value
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        if record.stack_info:
+            payload['stack'] = record.stack_info
+        return json.dumps(payload, default=str)
+
+log_writer = None
+
+@atexit.register
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global log_writer
+    if log_writer is not None:
+        log_writer.stop()
+        log_writer = None
+
+def configure_logging():
+    """Route every log record through a bounded queue to a background writer"""
+    global log_writer
+    stop_logging()
+    output = logging.StreamHandler(sys.stderr)
+    if app.config['LOG_FORMAT'] == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    records = queue.Queue(maxsize=app.config['LOG_QUEUE_SIZE'])
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(SamplingFilter(app.config['LOG_SAMPLING']))
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(app.config['LOG_LEVEL'])
+    levels = app.config['LOG_LEVELS']
+    if isinstance(levels, str):
+        levels = parse_log_levels(levels)
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    log_writer = LogWriter(records, output)
+    log_writer.start()
 
 # MongoDB Configuration
-try:
-    MONGO_URI = "mongodb://localhost:27017/"
-    logger.info("Attempting to connect to MongoDB...")
-    mongo_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-    # Test the connection
-    mongo_client.server_info()
-    db = mongo_client['caresync_db']
-    logger.info("Successfully connected to MongoDB")
-except Exception as e:
-    logger.error(f"Error connecting to MongoDB: {str(e)}")
-    db = None
-    # Don't raise the exception, let the app start and handle DB errors gracefully
+class LazyMongo:
+    """MongoDB client that is only created, and only connects, on first use.
+
+    Nothing touches the network at import time, so a worker boots at the same
+    speed whether or not MongoDB is up; an outage surfaces as an error from
+    the first query that needs it instead.
+    """
+
+    def __init__(self, uri, database, timeout_ms):
+        self.uri = uri
+        self.database = database
+        self.timeout_ms = timeout_ms
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    logger.info("Creating MongoDB client")
+                    listeners = [MongoCommandMetrics()] if app.config['METRICS_ENABLED'] else []
+                    self._client = MongoClient(self.uri, serverSelectionTimeoutMS=self.timeout_ms,
+                                               connect=False, event_listeners=listeners)
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.database]
+
+mongo = LazyMongo(app.config['MONGO_URI'], app.config['MONGO_DATABASE'],
+                  app.config['MONGO_SERVER_SELECTION_TIMEOUT_MS'])
+
+PATIENTS_COLLECTION = 'patients'
+
+def use_consolidated_patients():
+    return app.config['PATIENT_STORAGE'] == 'consolidated'
+
+class ClinicScopedCollection:
+    """View of the consolidated patients collection restricted to one clinic.
+
+    Mirrors the subset of the pymongo Collection API the routes use, adding
+    ``referred_by`` to every filter so callers can treat it exactly like a
+    per-clinic collection.
+    """
+
+    def __init__(self, collection, clinic_id):
+        self.collection = collection
+        self.clinic_id = clinic_id
+
+    def _scope(self, filter=None):
+        scoped = dict(filter or {})
+        scoped['referred_by'] = self.clinic_id
+        return scoped
+
+    def _claim(self, document):
+        if document.get('referred_by', self.clinic_id) != self.clinic_id:
+            raise ValueError("Patient belongs to a different clinic")
+        document['referred_by'] = self.clinic_id
+        return document
+
+    def find(self, filter=None, *args, **kwargs):
+        return self.collection.find(self._scope(filter), *args, **kwargs)
+
+    def find_one(self, filter=None, *args, **kwargs):
+        return self.collection.find_one(self._scope(filter), *args, **kwargs)
+
+    def count_documents(self, filter, **kwargs):
+        return self.collection.count_documents(self._scope(filter), **kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        return self.collection.aggregate([{'$match': {'referred_by': self.clinic_id}}] + list(pipeline), **kwargs)
+
+    def insert_one(self, document, **kwargs):
+        return self.collection.insert_one(self._claim(document), **kwargs)
+
+    def insert_many(self, documents, **kwargs):
+        return self.collection.insert_many([self._claim(d) for d in documents], **kwargs)
+
+    def update_one(self, filter, update, **kwargs):
+        return self.collection.update_one(self._scope(filter), update, **kwargs)
+
+    def find_one_and_update(self, filter, update, *args, **kwargs):
+        return self.collection.find_one_and_update(self._scope(filter), update, *args, **kwargs)
+
+    def update_many(self, filter, update, **kwargs):
+        return self.collection.update_many(self._scope(filter), update, **kwargs)
+
+    def delete_one(self, filter, **kwargs):
+        return self.collection.delete_one(self._scope(filter), **kwargs)
+
+def get_patients_collection():
+    """Return the consolidated patients collection"""
+    return mongo.db[PATIENTS_COLLECTION]
+
+# Indexes every per-clinic patient collection needs
+CLINIC_PATIENT_INDEXES = [
+    IndexModel([("patient_id", ASCENDING)], unique=True),
+    IndexModel([("created_at", DESCENDING), ("patient_id", DESCENDING)]),
+    IndexModel([("current_status", ASCENDING), ("created_at", DESCENDING), ("patient_id", DESCENDING)]),
+    IndexModel([("assigned_hospital_id", ASCENDING), ("current_status", ASCENDING)]),
+    IndexModel([("updated_at", ASCENDING)])
+]
+
+# Indexes the consolidated patients collection needs
+CONSOLIDATED_PATIENT_INDEXES = [
+    IndexModel([("referred_by", ASCENDING), ("patient_id", ASCENDING)], unique=True),
+    IndexModel([("assigned_hospital_id", ASCENDING), ("current_status", ASCENDING)]),
+    IndexModel([("referred_by", ASCENDING), ("created_at", DESCENDING), ("patient_id", DESCENDING)]),
+    IndexModel([("referred_by", ASCENDING), ("current_status", ASCENDING),
+                ("created_at", DESCENDING), ("patient_id", DESCENDING)]),
+    IndexModel([("referred_by", ASCENDING), ("updated_at", ASCENDING)])
+]
+
+class IndexProvisioner:
+    """Creates the required patient indexes once per collection per process.
+
+    Collections that have been provisioned are remembered, so after the
+    first use of a clinic no index round trips are made on the write path.
+    """
+
+    def __init__(self):
+        self._provisioned = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def required_indexes(collection):
+        if collection.name == PATIENTS_COLLECTION:
+            return CONSOLIDATED_PATIENT_INDEXES
+        return CLINIC_PATIENT_INDEXES
+
+    def ensure(self, collection):
+        """Make sure ``collection`` has its indexes; returns the collection"""
+        target = collection.collection if isinstance(collection, ClinicScopedCollection) else collection
+        if target.full_name in self._provisioned:
+            return collection
+        target.create_indexes(self.required_indexes(target))
+        with self._lock:
+            self._provisioned.add(target.full_name)
+        logger.info("Provisioned indexes for %s", target.full_name)
+        return collection
+
+    def provision_all(self):
+        """Provision every patient collection that already exists"""
+        if use_consolidated_patients():
+            self.ensure(get_patients_collection())
+        else:
+            list(fan_out_executor.map(self.ensure, list_clinic_collections()))
+
+    def report(self):
+        """Describe which required indexes exist on each patient collection"""
+        collections = list_clinic_collections()
+        if PATIENTS_COLLECTION in mongo.db.list_collection_names():
+            collections.append(get_patients_collection())
+        report = {}
+        for collection in collections:
+            existing = collection.index_information()
+            required = [index.document['name'] for index in self.required_indexes(collection)]
+            report[collection.name] = {
+                'provisioned_this_process': collection.full_name in self._provisioned,
+                'indexes': sorted(existing),
+                'missing': [name for name in required if name not in existing]
+            }
+        return report
+
+index_provisioner = IndexProvisioner()
 
 # Function to get clinic-specific collection
 def get_clinic_collection(clinic_id):
     try:
-        if not mongo_client:
-            logger.error("MongoDB client is not initialized")
-            raise Exception("MongoDB connection not available")
-        return db[f'clinic_{clinic_id}_patients']
+        if use_consolidated_patients():
+            return ClinicScopedCollection(get_patients_collection(), clinic_id)
+        return mongo.db[f'clinic_{clinic_id}_patients']
     except Exception as e:
-        logger.error(f"Error getting clinic collection: {str(e)}")
+        logger.error("Error getting clinic collection: %s", e)
         raise Exception("Failed to access database")
 
-# Function to initialize clinic collection if it doesn't exist
+# Function to get a clinic collection with its indexes provisioned
 def init_clinic_collection(clinic_id):
     try:
-        if not mongo_client:
-            logger.error("MongoDB client is not initialized")
-            raise Exception("MongoDB connection not available")
-        collection = get_clinic_collection(clinic_id)
-        if not collection.find_one():
-            collection.create_index([("patient_id", 1)], unique=True)
-        return collection
+        return index_provisioner.ensure(get_clinic_collection(clinic_id))
     except Exception as e:
-        logger.error(f"Error initializing clinic collection: {str(e)}")
+        logger.error("Error initializing clinic collection: %s", e)
         raise Exception("Failed to initialize database")
 
+class SQLitePool:
+    """Bounded pool of SQLite connections opened in WAL mode.
+
+    Connections are reused across requests, which also keeps each
+    connection's prepared-statement cache warm for the fixed SQL strings
+    used by the routes.
+    """
+
+    def __init__(self, path, size=8, timeout=10.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, cached_statements=256,
+                               factory=InstrumentedConnection if app.config['METRICS_ENABLED'] else sqlite3.Connection)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise Exception("Timed out waiting for a database connection")
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning("Discarding broken database connection: %s", e)
+            with self._lock:
+                self._created -= 1
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+            conn.close()
+
+sqlite_pool = SQLitePool(app.config['DATABASE'], size=app.config['SQLITE_POOL_SIZE'])
+
+def get_db():
+    """Return the SQLite connection bound to the current app context"""
+    if not has_app_context():
+        raise RuntimeError("get_db() needs an app context; use sqlite_pool.connection() instead")
+    if 'sqlite_conn' not in g:
+        g.sqlite_conn = sqlite_pool.acquire()
+    return g.sqlite_conn
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('sqlite_conn', None)
+    if conn is not None:
+        sqlite_pool.release(conn)
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session whose contents live in the database; the cookie holds only its ID"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.discarded_sid = None
+
+    def regenerate(self):
+        """Move the session to a fresh ID; the old row is deleted when the session is saved.
+
+        Call on login, so an ID planted before authentication is worthless after it.
+        """
+        if not self.new:
+            self.discarded_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+class SQLiteSessionInterface(SessionInterface):
+    """Stores sessions in the ``sessions`` table behind a per-process LRU cache.
+
+    The cookie carries a signed, random session ID. Each row has a version
+    number that is bumped on every write, so a cached copy is reused only
+    while it matches the stored version (another worker may have written
+    the session since).
+    """
+
+    def __init__(self, pool, cache_size=4096):
+        self.pool = pool
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='caresync-session')
+
+    def _cache_get(self, sid):
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry is not None:
+                self._cache.move_to_end(sid)
+            return entry
+
+    def _cache_put(self, sid, version, data):
+        with self._lock:
+            self._cache[sid] = (version, data)
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def _load(self, sid):
+        cached = self._cache_get(sid)
+        with self.pool.connection() as conn:
+            if cached is not None:
+                row = conn.execute(
+                    "SELECT version FROM sessions WHERE sid = ? AND expires_at > ?",
+                    (sid, time.time())).fetchone()
+                if row and row[0] == cached[0]:
+                    return dict(cached[1])
+            row = conn.execute(
+                "SELECT version, data FROM sessions WHERE sid = ? AND expires_at > ?",
+                (sid, time.time())).fetchone()
+        if not row:
+            self._cache_drop(sid)
+            return None
+        data = json.loads(row[1])
+        self._cache_put(sid, row[0], data)
+        return dict(data)
+
+    def _store(self, sid, data, expires_at):
+        payload = json.dumps(data)
+        with self.pool.connection() as conn:
+            conn.execute("""
+                INSERT INTO sessions (sid, data, version, expires_at) VALUES (?, ?, 1, ?)
+                ON CONFLICT(sid) DO UPDATE SET
+                    data = excluded.data,
+                    version = sessions.version + 1,
+                    expires_at = excluded.expires_at
+            """, (sid, payload, expires_at))
+            version = conn.execute("SELECT version FROM sessions WHERE sid = ?", (sid,)).fetchone()[0]
+            conn.commit()
+        self._cache_put(sid, version, data)
+
+    def _delete(self, sid):
+        self._cache_drop(sid)
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+            conn.commit()
+
+    def purge_expired(self):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+
+    @staticmethod
+    def _needs_session(app, request):
+        """Static files and token-authenticated /metrics scrapes never use the session"""
+        if app.static_url_path and request.path.startswith(app.static_url_path + '/'):
+            return False
+        return not (request.path == '/metrics' and request.headers.get('Authorization'))
+
+    def open_session(self, app, request):
+        if not self._needs_session(app, request):
+            return self.make_null_session(app)
+        cookie = request.cookies.get(app.session_cookie_name)
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                data = self._load(sid)
+                if data is not None:
+                    return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.discarded_sid:
+            self._delete(session.discarded_sid)
+            session.discarded_sid = None
+        if not session:
+            if session.modified:
+                self._delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+        if session.modified:
+            lifetime = app.permanent_session_lifetime.total_seconds()
+            self._store(session.sid, dict(session), time.time() + lifetime)
+        if not self.should_set_cookie(app, session):
+            return
+        response.set_cookie(
+            app.session_cookie_name,
+            self._signer(app).sign(session.sid.encode()).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+app.session_interface = SQLiteSessionInterface(sqlite_pool, cache_size=app.config['SESSION_CACHE_SIZE'])
+
 # Database setup
-def init_db():
-    """Initialize the SQLite database with required tables"""
-    conn = sqlite3.connect('caresync.db')
+def _create_tables(conn):
     c = conn.cursor()
     
     # Create users table for authentication
@@ -104,7 +1021,35 @@ def init_db():
             ambulance_services BOOLEAN NOT NULL,
             mental_health_support BOOLEAN NOT NULL,
             financial_assistance BOOLEAN NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    _add_column_if_missing(conn, 'hospitals', 'updated_at', 'REAL NOT NULL DEFAULT 0')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_hospitals_location ON hospitals (location COLLATE NOCASE)')
+    
+    # Normalized hospital specialties; ``specialty`` is the lowercased lookup key
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS hospital_specialties (
+            hospital_id TEXT NOT NULL REFERENCES hospitals (hospital_id) ON DELETE CASCADE,
+            specialty TEXT NOT NULL,
+            display_name TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (hospital_id, specialty)
+        )
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_hospital_specialties_specialty
+        ON hospital_specialties (specialty, hospital_id)
+    ''')
+    
+    # Log of hospital writes. Revisions are handed out under SQLite's write
+    # lock, so they follow commit order and caches can reload only what moved
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS hospital_changes (
+            revision INTEGER PRIMARY KEY AUTOINCREMENT,
+            hospital_id TEXT NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0
         )
     ''')
     
@@ -127,168 +1072,2026 @@ def init_db():
         )
     ''')
     
+    # Server-side session store
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            sid TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)')
+    
+    # Create ambulance_requests table
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ambulance_requests (
+            request_id TEXT PRIMARY KEY,
+            patient_id TEXT NOT NULL,
+            requested_by TEXT,
+            pickup_location TEXT NOT NULL,
+            drop_location TEXT NOT NULL,
+            status TEXT NOT NULL,
+            driver_details TEXT,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    # ID generator nodes leased by live processes (see NodeLeases)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS id_node_leases (
+            node INTEGER PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ambulance_requests_requested_by
+        ON ambulance_requests (requested_by, created_at)
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ambulance_requests_patient
+        ON ambulance_requests (patient_id, created_at)
+    ''')
+    # Dispatch job queue columns; a request is due for processing while
+    # available_at is set and has passed
+    for column, declaration in (('pickup_lat', 'REAL'), ('pickup_lon', 'REAL'),
+                                ('attempts', 'INTEGER NOT NULL DEFAULT 0'), ('available_at', 'REAL'),
+                                ('claim_token', 'TEXT'), ('last_error', 'TEXT'), ('updated_at', 'REAL')):
+        _add_column_if_missing(conn, 'ambulance_requests', column, declaration)
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ambulance_requests_due
+        ON ambulance_requests (available_at) WHERE available_at IS NOT NULL
+    ''')
+    
+    # Ambulance fleet with last reported positions
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ambulances (
+            ambulance_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            hospital_id TEXT,
+            driver_name TEXT,
+            driver_contact TEXT,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            status TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_ambulances_updated_at ON ambulances (updated_at)')
+    
+    # Bed capacity ledger and reservations
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS bed_ledger (
+            hospital_id TEXT NOT NULL,
+            bed_type TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            available INTEGER NOT NULL CHECK (available >= 0),
+            PRIMARY KEY (hospital_id, bed_type)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS bed_reservations (
+            reservation_id TEXT PRIMARY KEY,
+            hospital_id TEXT NOT NULL,
+            bed_type TEXT NOT NULL,
+            patient_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bed_reservations_status_expiry
+        ON bed_reservations (status, expires_at)
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bed_reservations_hospital
+        ON bed_reservations (hospital_id, bed_type, status)
+    ''')
+    
+    # Covering index for the login lookup on (entity_id, role)
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_entity_role
+        ON users (entity_id, role, password, username)
+    ''')
+    
+    # Analytics rollups: (name, key) -> running total. Bed and ambulance
+    # counters are kept by triggers on their tables, so every write path
+    # (in every worker) updates them in the same transaction.
+    backfill_stats = not _table_exists(conn, 'stats_counters')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, key)
+        ) WITHOUT ROWID
+    ''')
+    if backfill_stats:
+        c.execute('''
+            INSERT INTO stats_counters (name, key, value)
+            SELECT 'beds', bed_type || '_total', SUM(total) FROM bed_ledger GROUP BY bed_type
+            UNION ALL
+            SELECT 'beds', bed_type || '_available', SUM(available) FROM bed_ledger GROUP BY bed_type
+            UNION ALL
+            SELECT 'ambulance_requests_by_status', status, COUNT(*) FROM ambulance_requests GROUP BY status
+        ''')
+    for trigger, event, body in STATS_TRIGGERS:
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {trigger} AFTER {event} BEGIN {body} END")
+    
     conn.commit()
-    conn.close()
-
-# Initialize database
-init_db()
-
-# Load healthcare data
-try:
-    # Create data directory if it doesn't exist
-    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
-    os.makedirs(data_dir, exist_ok=True)
-    
-    json_path = os.path.join(data_dir, 'caresync_updated_seed_data.json')
-    # Create the file if it doesn't exist
-    if not os.path.exists(json_path):
-        initial_data = {
-            'patients': [],
-            'ambulance_requests': [],
-            'pros': [],
-            'multispeciality_hospitals': [],
-            'nursing_homes': [],
-            'counseling_resources': []
+
+def _stats_delta(name, key, delta):
+    """Trigger statement adding ``delta`` to a stats counter (all three are SQL expressions)"""
+    return (f"INSERT INTO stats_counters (name, key, value) VALUES ({name}, {key}, {delta}) "
+            "ON CONFLICT (name, key) DO UPDATE SET value = value + excluded.value;")
+
+STATS_TRIGGERS = [
+    ('stats_bed_ledger_insert', 'INSERT ON bed_ledger',
+     _stats_delta("'beds'", "NEW.bed_type || '_total'", 'NEW.total')
+     + _stats_delta("'beds'", "NEW.bed_type || '_available'", 'NEW.available')),
+    ('stats_bed_ledger_update', 'UPDATE OF total, available ON bed_ledger',
+     _stats_delta("'beds'", "NEW.bed_type || '_total'", 'NEW.total - OLD.total')
+     + _stats_delta("'beds'", "NEW.bed_type || '_available'", 'NEW.available - OLD.available')),
+    ('stats_bed_ledger_delete', 'DELETE ON bed_ledger',
+     _stats_delta("'beds'", "OLD.bed_type || '_total'", '-OLD.total')
+     + _stats_delta("'beds'", "OLD.bed_type || '_available'", '-OLD.available')),
+    ('stats_ambulance_requests_insert', 'INSERT ON ambulance_requests',
+     _stats_delta("'ambulance_requests_by_status'", 'NEW.status', '1')),
+    ('stats_ambulance_requests_update', 'UPDATE OF status ON ambulance_requests WHEN OLD.status IS NOT NEW.status',
+     _stats_delta("'ambulance_requests_by_status'", 'OLD.status', '-1')
+     + _stats_delta("'ambulance_requests_by_status'", 'NEW.status', '1')),
+    ('stats_ambulance_requests_delete', 'DELETE ON ambulance_requests',
+     _stats_delta("'ambulance_requests_by_status'", 'OLD.status', '-1')),
+]
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (table,)).fetchone() is not None
+
+def _add_column_if_missing(conn, table, column, declaration):
+    """Add a column to a table created by an older version of the schema"""
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+# Healthcare data (hospitals, nursing homes, PROs, counseling resources).
+# The dict is created empty here and filled in place by load_healthcare_data()
+# during startup, so references taken at import time stay valid and importing
+# the module touches no files
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+json_path = os.path.join(DATA_DIR, 'caresync_updated_seed_data.json')
+
+def empty_healthcare_data():
+    return {
+        'patients': [],
+        'ambulance_requests': [],
+        'pros': [],
+        'multispeciality_hospitals': [],
+        'nursing_homes': [],
+        'counseling_resources': []
+    }
+
+healthcare_data = empty_healthcare_data()
+
+def read_healthcare_snapshot():
+    """Read the JSON snapshot, creating an empty one if there is none yet"""
+    try:
+        # Create data directory if it doesn't exist
+        os.makedirs(DATA_DIR, exist_ok=True)
+        
+        # Create the file if it doesn't exist
+        if not os.path.exists(json_path):
+            initial_data = empty_healthcare_data()
+            with open(json_path, 'w') as file:
+                json.dump(initial_data, file, indent=4)
+            return initial_data
+        with open(json_path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        logger.error("caresync_updated_seed_data.json not found and could not be created")
+    except json.JSONDecodeError:
+        logger.error("caresync_updated_seed_data.json is not valid JSON")
+    except Exception as e:
+        logger.error("Error loading healthcare data: %s", e)
+    return empty_healthcare_data()
+
+class JournalStore:
+    """Snapshot plus append-only change journal for ``healthcare_data``.
+
+    Each mutation is appended to ``<snapshot>.journal`` as one JSON line and
+    fsync'd, so the cost of a write does not depend on the size of the
+    dataset. Once ``compact_every`` records have accumulated, a background
+    thread folds them into a fresh snapshot. Journal records are keyed
+    upserts/deletes, which makes replaying them idempotent: a crash in the
+    middle of a compaction is recovered by replaying both the rotated and
+    the live journal on top of whichever snapshot made it to disk.
+    """
+
+    def __init__(self, snapshot_path, compact_every=500):
+        self.snapshot_path = snapshot_path
+        self.journal_path = f"{snapshot_path}.journal"
+        self.rotated_path = f"{self.journal_path}.old"
+        self.compact_every = compact_every
+        self.lock = threading.RLock()
+        self.data = None
+        self._journal = None
+        self._records = 0
+        self._compacting = False
+
+    @staticmethod
+    def _apply(data, indexes, record):
+        collection = data.setdefault(record['collection'], [])
+        key = record['key']
+        index = indexes.get(record['collection'])
+        if index is None:
+            index = {item.get(key): pos for pos, item in enumerate(collection)}
+            indexes[record['collection']] = index
+        if record['op'] == 'upsert':
+            value = record['value']
+            pos = index.get(value[key])
+            if pos is None:
+                index[value[key]] = len(collection)
+                collection.append(value)
+            else:
+                collection[pos] = value
+        elif record['op'] == 'delete':
+            pos = index.pop(record['id'], None)
+            if pos is not None:
+                del collection[pos]
+                indexes.pop(record['collection'])
+
+    def _replay_file(self, path, data, indexes):
+        if not os.path.exists(path):
+            return 0
+        applied = 0
+        good_offset = 0
+        torn = False
+        with open(path, 'rb') as file:
+            for line_number, line in enumerate(file, 1):
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Only the final line can be torn by a crash mid-append
+                        logger.warning("Ignoring torn journal record at %s:%s", path, line_number)
+                        torn = True
+                        break
+                    self._apply(data, indexes, record)
+                    applied += 1
+                good_offset += len(line)
+        if torn:
+            # Drop the torn tail so later appends start on a clean line
+            with open(path, 'r+b') as file:
+                file.truncate(good_offset)
+        return applied
+
+    def replay(self, data):
+        """Apply journalled changes to ``data`` and open the journal for appends"""
+        with self.lock:
+            self.data = data
+            indexes = {}
+            replayed = self._replay_file(self.rotated_path, data, indexes)
+            replayed += self._replay_file(self.journal_path, data, indexes)
+            self._journal = open(self.journal_path, 'a')
+            self._records = replayed
+            if replayed:
+                logger.info("Replayed %s journal records onto snapshot", replayed)
+        if os.path.exists(self.rotated_path):
+            # A previous compaction did not finish; fold everything in now
+            self.compact()
+        return replayed
+
+    def _append(self, record):
+        with self.lock:
+            self._journal.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._records += 1
+            should_compact = self._records >= self.compact_every and not self._compacting
+            if should_compact:
+                self._compacting = True
+        if should_compact:
+            threading.Thread(target=self._compact_in_background, daemon=True,
+                             name='journal-compactor').start()
+
+    def upsert(self, collection, key, value):
+        """Journal the insert or replacement of an item; returns True on success"""
+        try:
+            self._append({'op': 'upsert', 'collection': collection, 'key': key, 'value': value})
+            return True
+        except Exception as e:
+            logger.error("Error journalling %s change: %s", collection, e)
+            return False
+
+    def delete(self, collection, key, item_id):
+        """Journal the removal of an item; returns True on success"""
+        try:
+            self._append({'op': 'delete', 'collection': collection, 'key': key, 'id': item_id})
+            return True
+        except Exception as e:
+            logger.error("Error journalling %s delete: %s", collection, e)
+            return False
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error("Background journal compaction failed: %s", e)
+        finally:
+            with self.lock:
+                self._compacting = False
+
+    def compact(self):
+        """Write a fresh snapshot and discard the journal records it covers"""
+        with self.lock:
+            payload = json.dumps(self.data, indent=4)
+            self._journal.close()
+            if os.path.exists(self.rotated_path):
+                # Keep the older records in front of the ones being rotated
+                with open(self.rotated_path, 'a') as rotated, open(self.journal_path, 'r') as live:
+                    rotated.write(live.read())
+                    rotated.flush()
+                    os.fsync(rotated.fileno())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.rotated_path)
+            self._journal = open(self.journal_path, 'a')
+            self._records = 0
+
+        temp_path = f"{self.snapshot_path}.temp"
+        with open(temp_path, 'w') as file:
+            file.write(payload)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        self._fsync_dir()
+        os.remove(self.rotated_path)
+        logger.info("Compacted healthcare data journal into snapshot")
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(os.path.dirname(self.snapshot_path) or '.', os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+data_journal = JournalStore(json_path, compact_every=app.config['JOURNAL_COMPACT_EVERY'])
+
+def load_healthcare_data():
+    """Fill healthcare_data from the snapshot and replay the journal on top"""
+    for key, value in read_healthcare_snapshot().items():
+        current = healthcare_data.get(key)
+        if isinstance(current, list) and isinstance(value, list):
+            current[:] = value
+        else:
+            healthcare_data[key] = value
+    data_journal.replay(healthcare_data)
+
+class DuplicateIdError(ValueError):
+    """An insert collided with an existing primary key"""
+
+class SortableIdGenerator:
+    """Compact, time-ordered IDs: 42 bits of milliseconds, 10 node bits, 12 sequence bits.
+
+    The 64-bit value is written as 13 Crockford base32 characters, so IDs
+    sort lexicographically in creation order and new index entries land at
+    the end of the B-tree. Unless a node is configured, each process leases
+    one from ``leases`` (a NodeLeases) so no two live processes share it,
+    renewing the lease as it goes. The node is re-leased after a fork so
+    preloaded workers do not share the parent's.
+    """
+
+    EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+    NODE_BITS = 10
+    SEQUENCE_BITS = 12
+    ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+    LENGTH = 13
+
+    def __init__(self, node=None, leases=None):
+        self._configured_node = node
+        self.leases = leases
+        self._owner = None
+        self._lease_expires = self._renew_at = math.inf
+        self._pid = None
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+        self._decode = {char: value for value, char in enumerate(self.ALPHABET)}
+
+    def _reset_for_process(self):
+        self._pid = os.getpid()
+        if self._configured_node is not None:
+            self.node = int(self._configured_node) % (1 << self.NODE_BITS)
+        else:
+            # A forked child must not renew or release the parent's lease
+            self._owner = f'{socket.gethostname()}:{self._pid}:{secrets.token_hex(4)}'
+            self._lease_node()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def _lease_node(self):
+        self.node, self._lease_expires = self.leases.acquire(self._owner)
+        self._renew_at = time.time() + (self._lease_expires - time.time()) / 3
+
+    def _renew_lease(self):
+        # Past expiry another process may already hold the node, so it is
+        # never renewed then, only replaced
+        expires = None
+        if time.time() < self._lease_expires:
+            expires = self.leases.renew(self.node, self._owner)
+        if expires is None:
+            logger.warning("Lost the lease on ID node %s; leasing another", self.node)
+            self._lease_node()
+        else:
+            self._lease_expires = expires
+            self._renew_at = time.time() + (expires - time.time()) / 3
+
+    def release(self):
+        """Give up this process's leased node, if it has one"""
+        with self._lock:
+            if self._owner is not None and self._pid == os.getpid():
+                self.leases.release(self.node, self._owner)
+                self._owner, self._pid = None, None
+                self._lease_expires = self._renew_at = math.inf
+
+    def next_value(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset_for_process()
+            elif time.time() >= self._renew_at:
+                self._renew_lease()
+            now = int(time.time() * 1000) - self.EPOCH_MS
+            # Never go backwards, even if the clock does; borrow from the
+            # next millisecond once this one's sequence numbers run out
+            if now > self._last_ms:
+                self._last_ms, self._sequence = now, 0
+            else:
+                self._sequence += 1
+                if self._sequence >> self.SEQUENCE_BITS:
+                    self._last_ms, self._sequence = self._last_ms + 1, 0
+            return ((self._last_ms << (self.NODE_BITS + self.SEQUENCE_BITS))
+                    | (self.node << self.SEQUENCE_BITS) | self._sequence)
+
+    def new_id(self, prefix=''):
+        value = self.next_value()
+        chars = []
+        for _ in range(self.LENGTH):
+            chars.append(self.ALPHABET[value & 31])
+            value >>= 5
+        return prefix + ''.join(reversed(chars))
+
+    def timestamp_ms(self, id_value, prefix=''):
+        """Unix milliseconds encoded in an ID, or None if it is not one of ours"""
+        if not id_value.startswith(prefix) or len(id_value) != len(prefix) + self.LENGTH:
+            return None
+        value = 0
+        for char in id_value[len(prefix):]:
+            digit = self._decode.get(char)
+            if digit is None:
+                return None
+            value = value * 32 + digit
+        return (value >> (self.NODE_BITS + self.SEQUENCE_BITS)) + self.EPOCH_MS
+
+    def created_at(self, id_value, prefix=''):
+        """The local ISO timestamp an ID was minted at, formatted like datetime.now().isoformat()"""
+        ms = self.timestamp_ms(id_value, prefix)
+        if ms is None:
+            return None
+        return datetime.fromtimestamp(ms // 1000).replace(microsecond=ms % 1000 * 1000).isoformat()
+
+class NodeLeases:
+    """Leases ID generator nodes out of the ``id_node_leases`` table.
+
+    Each live process holds one node; a lease lasts ``lease_seconds`` unless
+    renewed, so the nodes of crashed processes come back once they lapse.
+    """
+
+    def __init__(self, pool, nodes, lease_seconds=600):
+        self.pool = pool
+        self.nodes = nodes
+        self.lease_seconds = lease_seconds
+
+    def acquire(self, owner):
+        """Lease the lowest free node; returns (node, expires_at)"""
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            conn.execute("DELETE FROM id_node_leases WHERE expires_at <= ?", (now,))
+            taken = {row[0] for row in conn.execute("SELECT node FROM id_node_leases")}
+            node = next((node for node in range(self.nodes) if node not in taken), None)
+            if node is None:
+                raise RuntimeError(f"All {self.nodes} ID nodes are leased; set ID_NODE explicitly")
+            expires_at = now + self.lease_seconds
+            conn.execute("INSERT INTO id_node_leases (node, owner, expires_at) VALUES (?, ?, ?)",
+                         (node, owner, expires_at))
+            conn.commit()
+        logger.info("Leased ID node %s", node)
+        return node, expires_at
+
+    def renew(self, node, owner):
+        """Extend a lease; returns the new expiry, or None if the lease is gone"""
+        expires_at = time.time() + self.lease_seconds
+        with self.pool.connection() as conn:
+            renewed = conn.execute("UPDATE id_node_leases SET expires_at = ? WHERE node = ? AND owner = ?",
+                                   (expires_at, node, owner)).rowcount
+            conn.commit()
+        return expires_at if renewed else None
+
+    def release(self, node, owner):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM id_node_leases WHERE node = ? AND owner = ?", (node, owner))
+            conn.commit()
+
+ids = SortableIdGenerator(app.config['ID_NODE'],
+                          NodeLeases(sqlite_pool, 1 << SortableIdGenerator.NODE_BITS,
+                                     app.config['ID_NODE_LEASE_SECONDS']))
+
+@atexit.register
+def release_id_node():
+    try:
+        ids.release()
+    except sqlite3.Error as e:
+        logger.warning("Could not release the ID node lease: %s", e)
+
+def new_patient_id():
+    return ids.new_id()
+
+def new_hospital_id():
+    return ids.new_id('H')
+
+def new_clinic_id():
+    return ids.new_id('CL')
+
+def retry_duplicate_id(attempt, duplicate_errors, attempts=None):
+    """Call ``attempt()`` until it stops raising one of ``duplicate_errors``.
+
+    ``attempt`` is responsible for using a fresh ID on every call after a collision.
+    """
+    attempts = attempts or app.config['ID_RETRY_ATTEMPTS']
+    for number in range(1, attempts + 1):
+        try:
+            return attempt()
+        except duplicate_errors:
+            if number == attempts:
+                raise
+            logger.warning("ID collision on attempt %s, retrying with a fresh ID", number)
+
+class HospitalRepository:
+    """SQLite store for hospitals; the durable source of truth.
+
+    Specialties live in the normalized hospital_specialties table so
+    specialty and location lookups are served by indexes. Every write also
+    appends to hospital_changes in the same transaction and returns
+    ``(previous_revision, revision)``, so caches can tell whether anyone
+    else wrote in between and can reload just the hospitals that changed.
+    """
+
+    # Change-log entries kept; a cache further behind than this reloads everything
+    CHANGE_LOG_SIZE = 10000
+
+    COLUMNS = ('hospital_id', 'name', 'location', 'contact_number', 'total_beds', 'available_beds',
+               'icu_total', 'icu_available', 'ambulance_services', 'mental_health_support',
+               'financial_assistance')
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @contextmanager
+    def _connection(self, conn=None):
+        if conn is not None:
+            yield conn
+            return
+        with self.pool.connection() as conn:
+            with conn:
+                yield conn
+
+    @contextmanager
+    def _snapshot(self):
+        """A read transaction, so several SELECTs see the same committed state"""
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN')
+            try:
+                yield conn
+            finally:
+                conn.rollback()
+
+    def _log_change(self, conn, hospital_id, deleted=False):
+        # Called after the row was written, so this transaction already holds
+        # the write lock and no other writer can slip in before the insert
+        previous = conn.execute("SELECT COALESCE(MAX(revision), 0) FROM hospital_changes").fetchone()[0]
+        revision = conn.execute("INSERT INTO hospital_changes (hospital_id, deleted) VALUES (?, ?)",
+                                (hospital_id, int(deleted))).lastrowid
+        if revision % 100 == 0:
+            conn.execute("DELETE FROM hospital_changes WHERE revision <= ?", (revision - self.CHANGE_LOG_SIZE,))
+        return previous, revision
+
+    @staticmethod
+    def _specialty_key(specialty):
+        return specialty.strip().lower()
+
+    def _from_row(self, row, specialties):
+        fields = dict(zip(self.COLUMNS, row))
+        return {
+            'hospital_id': fields['hospital_id'],
+            'name': fields['name'],
+            'location': fields['location'],
+            'contact_number': fields['contact_number'],
+            'specialties': specialties,
+            'total_beds': fields['total_beds'],
+            'available_beds': fields['available_beds'],
+            'icu_beds': {'total': fields['icu_total'], 'available': fields['icu_available']},
+            'ambulance_services': bool(fields['ambulance_services']),
+            'mental_health_support': bool(fields['mental_health_support']),
+            'financial_assistance': bool(fields['financial_assistance'])
+        }
+
+    def _load(self, conn, hospital_ids=None):
+        """Load every hospital, or only those in ``hospital_ids``, with their specialties"""
+        where, params = '', ()
+        if hospital_ids is not None:
+            params = tuple(hospital_ids)
+            if not params:
+                return []
+            where = f"WHERE hospital_id IN ({', '.join('?' * len(params))})"
+        rows = conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM hospitals {where} ORDER BY rowid",
+                            params).fetchall()
+        specialties = defaultdict(list)
+        for hospital_id, name in conn.execute(f"""
+            SELECT hospital_id, display_name FROM hospital_specialties {where}
+            ORDER BY hospital_id, position
+        """, params):
+            specialties[hospital_id].append(name)
+        return [self._from_row(row, specialties.get(row[0], [])) for row in rows]
+
+    def load_all(self, conn=None):
+        with self._connection(conn) as conn:
+            return self._load(conn)
+
+    def get(self, hospital_id):
+        with self._connection() as conn:
+            hospitals = self._load(conn, [hospital_id])
+        return hospitals[0] if hospitals else None
+
+    def revision(self):
+        """Revision of the newest hospital write; cheap enough to poll"""
+        with self._connection() as conn:
+            return conn.execute("SELECT COALESCE(MAX(revision), 0) FROM hospital_changes").fetchone()[0]
+
+    def snapshot(self):
+        """Return (revision, every hospital) as of one consistent point"""
+        with self._snapshot() as conn:
+            revision = conn.execute("SELECT COALESCE(MAX(revision), 0) FROM hospital_changes").fetchone()[0]
+            return revision, self._load(conn)
+
+    def changes_since(self, revision):
+        """Return (revision, changed hospitals, deleted IDs) since ``revision``.
+
+        Returns None when the change log no longer reaches back that far.
+        """
+        with self._snapshot() as conn:
+            oldest, = conn.execute("SELECT MIN(revision) FROM hospital_changes").fetchone()
+            if oldest is not None and oldest > revision + 1:
+                return None
+            changes = conn.execute("SELECT revision, hospital_id, deleted FROM hospital_changes WHERE revision > ?",
+                                   (revision,)).fetchall()
+            if not changes:
+                return revision, [], []
+            latest = {hospital_id: deleted for _, hospital_id, deleted in changes}
+            changed = self._load(conn, [hospital_id for hospital_id, deleted in latest.items() if not deleted])
+            found = {hospital['hospital_id'] for hospital in changed}
+            return changes[-1][0], changed, [hospital_id for hospital_id in latest if hospital_id not in found]
+
+    def save(self, hospital, conn=None, insert_only=False):
+        """Insert or overwrite a hospital and its specialties; returns the revisions.
+
+        With ``insert_only`` an existing hospital_id raises DuplicateIdError instead.
+        """
+        values = (
+            hospital['hospital_id'],
+            hospital['name'],
+            hospital['location'],
+            hospital['contact_number'],
+            hospital['total_beds'],
+            hospital['available_beds'],
+            hospital['icu_beds']['total'],
+            hospital['icu_beds']['available'],
+            ','.join(hospital['specialties']),
+            hospital['ambulance_services'],
+            hospital['mental_health_support'],
+            hospital['financial_assistance'],
+            time.time()
+        )
+        conflict = '' if insert_only else """
+            ON CONFLICT (hospital_id) DO UPDATE SET
+                name = excluded.name, location = excluded.location,
+                contact_number = excluded.contact_number, total_beds = excluded.total_beds,
+                available_beds = excluded.available_beds, icu_total = excluded.icu_total,
+                icu_available = excluded.icu_available, specialties = excluded.specialties,
+                ambulance_services = excluded.ambulance_services,
+                mental_health_support = excluded.mental_health_support,
+                financial_assistance = excluded.financial_assistance,
+                updated_at = excluded.updated_at"""
+        with self._connection(conn) as conn:
+            try:
+                conn.execute(f"""
+                    INSERT INTO hospitals (
+                        hospital_id, name, location, contact_number,
+                        total_beds, available_beds, icu_total, icu_available,
+                        specialties, ambulance_services, mental_health_support,
+                        financial_assistance, updated_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?){conflict}
+                """, values)
+            except sqlite3.IntegrityError:
+                raise DuplicateIdError(f"Hospital {hospital['hospital_id']} already exists")
+            conn.execute("DELETE FROM hospital_specialties WHERE hospital_id = ?", (hospital['hospital_id'],))
+            rows = {}
+            for position, name in enumerate(hospital['specialties']):
+                rows.setdefault(self._specialty_key(name), (hospital['hospital_id'], self._specialty_key(name),
+                                                            name.strip(), position))
+            conn.executemany("""
+                INSERT INTO hospital_specialties (hospital_id, specialty, display_name, position)
+                VALUES (?, ?, ?, ?)
+            """, list(rows.values()))
+            return self._log_change(conn, hospital['hospital_id'])
+
+    def save_beds(self, hospital_id, available_beds, icu_available):
+        """Overwrite only the bed availability columns of one hospital; returns the revisions"""
+        with self._connection() as conn:
+            conn.execute("""
+                UPDATE hospitals SET available_beds = ?, icu_available = ?, updated_at = ?
+                WHERE hospital_id = ?
+            """, (available_beds, icu_available, time.time(), hospital_id))
+            return self._log_change(conn, hospital_id)
+
+    def delete(self, hospital_id):
+        """Delete a hospital; returns the revisions, or None if it did not exist"""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM hospital_specialties WHERE hospital_id = ?", (hospital_id,))
+            if not conn.execute("DELETE FROM hospitals WHERE hospital_id = ?", (hospital_id,)).rowcount:
+                return None
+            return self._log_change(conn, hospital_id, deleted=True)
+
+class HospitalRegistry:
+    """Write-through cache of the hospitals in a HospitalRepository.
+
+    Reads are served from memory through hash indexes by ``hospital_id`` and,
+    secondarily, by specialty and location (both matched case-insensitively).
+    Mutations are written to SQLite first and only then applied in memory,
+    so every mutation must go through the registry. ``refresh()`` applies
+    the hospitals other processes changed since the cached revision.
+
+    Readers do not take the lock, so a cached hospital dict is never changed
+    once published: a change builds a new dict and swaps it into the list and
+    indexes (copy-on-write), and a reader holding the old one sees it whole.
+    """
+
+    def __init__(self, repository, hospitals=None, lock=None, refresh_seconds=1.0):
+        self.repository = repository
+        self.refresh_seconds = refresh_seconds
+        self._lock = lock or threading.RLock()
+        self._hospitals = hospitals if hospitals is not None else []
+        # Bumped on every mutation so derived data can tell when it is stale;
+        # directory_version skips bed-count updates, for data that only shows
+        # names, specialties and services
+        self.version = 0
+        self.directory_version = 0
+        self._by_id = {}
+        self._by_specialty = defaultdict(dict)
+        self._by_location = defaultdict(dict)
+        self._revision = None
+        self._checked_at = 0.0
+
+    @staticmethod
+    def _key(value):
+        return (value or '').strip().lower()
+
+    def _index(self, hospital):
+        hospital_id = hospital['hospital_id']
+        self._by_id[hospital_id] = hospital
+        for specialty in hospital.get('specialties', []):
+            self._by_specialty[self._key(specialty)][hospital_id] = hospital
+        self._by_location[self._key(hospital.get('location'))][hospital_id] = hospital
+
+    def _unindex(self, hospital, replacement=None):
+        """Drop ``hospital`` from the indexes, keeping the entries its
+        ``replacement`` (already indexed, same ID) now occupies"""
+        hospital_id = hospital['hospital_id']
+        specialties = {self._key(specialty) for specialty in hospital.get('specialties', [])}
+        locations = {self._key(hospital.get('location'))}
+        if replacement is None:
+            self._by_id.pop(hospital_id, None)
+        else:
+            specialties -= {self._key(specialty) for specialty in replacement.get('specialties', [])}
+            locations -= {self._key(replacement.get('location'))}
+        for index, keys in ((self._by_specialty, specialties), (self._by_location, locations)):
+            for key in keys:
+                bucket = index.get(key)
+                if bucket is not None:
+                    bucket.pop(hospital_id, None)
+                    if not bucket:
+                        del index[key]
+
+    def _replace(self, current, hospital, position=None):
+        """Swap ``hospital`` in for the cached dict ``current`` without mutating it"""
+        if position is None:
+            position = next(i for i, cached in enumerate(self._hospitals) if cached is current)
+        self._hospitals[position] = hospital
+        self._index(hospital)
+        self._unindex(current, replacement=hospital)
+        return hospital
+
+    def load(self):
+        """Replace the cached hospitals with what is stored in SQLite"""
+        with self._lock:
+            revision, hospitals = self.repository.snapshot()
+            # Keep the same list object; healthcare_data snapshots share it
+            self._hospitals[:] = hospitals
+            self._by_id.clear()
+            self._by_specialty.clear()
+            self._by_location.clear()
+            for hospital in hospitals:
+                self._index(hospital)
+            self._revision = revision
+            self._checked_at = time.monotonic()
+            self.version += 1
+            self.directory_version += 1
+
+    def refresh(self):
+        """Apply other processes' hospital writes, checking at most every refresh_seconds"""
+        if time.monotonic() - self._checked_at < self.refresh_seconds:
+            return False
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if self.repository.revision() == self._revision:
+                return False
+            changes = self.repository.changes_since(self._revision)
+            if changes is None:
+                self.load()
+                return True
+            revision, changed, deleted = changes
+            directory = False
+            positions = {id(cached): i for i, cached in enumerate(self._hospitals)} if changed else {}
+            for hospital in changed:
+                current = self._by_id.get(hospital['hospital_id'])
+                if current is None:
+                    self._hospitals.append(hospital)
+                    self._index(hospital)
+                    directory = True
+                else:
+                    if not directory:
+                        directory = self._directory_fields(current) != self._directory_fields(hospital)
+                    self._replace(current, hospital, positions[id(current)])
+            for hospital_id in deleted:
+                current = self._by_id.get(hospital_id)
+                if current is not None:
+                    self._unindex(current)
+                    self._hospitals.remove(current)
+                    directory = True
+            self._revision = revision
+            if changed or deleted:
+                self._wrote(directory=directory)
+            return True
+
+    @staticmethod
+    def _directory_fields(hospital):
+        return {key: value for key, value in hospital.items() if key not in ('available_beds', 'icu_beds')}
+
+    def _wrote(self, revisions=None, directory=True):
+        # Adopt our own write's revision only if nothing else was written
+        # before it; otherwise leave the cache behind so refresh() catches up
+        if revisions is not None and revisions[0] == self._revision:
+            self._revision = revisions[1]
+        self.version += 1
+        if directory:
+            self.directory_version += 1
+
+    def all(self):
+        """Return the cached hospital list (do not mutate)"""
+        return self._hospitals
+
+    def get(self, hospital_id):
+        """Return the hospital with the given ID, or None"""
+        return self._by_id.get(hospital_id)
+
+    def name_of(self, hospital_id, default='Not Assigned'):
+        hospital = self._by_id.get(hospital_id) if hospital_id else None
+        return hospital['name'] if hospital else default
+
+    def by_specialty(self, specialty):
+        return list(self._by_specialty.get(self._key(specialty), {}).values())
+
+    def by_location(self, location):
+        return list(self._by_location.get(self._key(location), {}).values())
+
+    def is_at(self, hospital, location):
+        return self._key(hospital.get('location')) == self._key(location)
+
+    def add(self, hospital):
+        with self._lock:
+            if hospital['hospital_id'] in self._by_id:
+                raise DuplicateIdError(f"Hospital {hospital['hospital_id']} already exists")
+            revisions = self.repository.save(hospital, insert_only=True)
+            self._hospitals.append(hospital)
+            self._index(hospital)
+            self._wrote(revisions)
+        return hospital
+
+    def update(self, hospital_id, fields):
+        """Write ``fields`` through to SQLite, then swap in the updated hospital"""
+        with self._lock:
+            current = self._by_id.get(hospital_id)
+            if current is None:
+                return None
+            hospital = dict(current, **fields)
+            revisions = self.repository.save(hospital)
+            self._replace(current, hospital)
+            self._wrote(revisions)
+        return hospital
+
+    def update_beds(self, hospital_id, available_beds=None, icu_available=None):
+        """Write new bed availability for one hospital; returns it, or None if unknown or unchanged"""
+        with self._lock:
+            current = self._by_id.get(hospital_id)
+            if current is None:
+                return None
+            if available_beds is None:
+                available_beds = current['available_beds']
+            if icu_available is None:
+                icu_available = current['icu_beds']['available']
+            if (available_beds, icu_available) == (current['available_beds'], current['icu_beds']['available']):
+                return None
+            revisions = self.repository.save_beds(hospital_id, available_beds, icu_available)
+            hospital = dict(current, available_beds=available_beds,
+                            icu_beds=dict(current['icu_beds'], available=icu_available))
+            self._replace(current, hospital)
+            self._wrote(revisions, directory=False)
+        return hospital
+
+    def remove(self, hospital_id):
+        with self._lock:
+            hospital = self._by_id.get(hospital_id)
+            if hospital is None:
+                return None
+            revisions = self.repository.delete(hospital_id)
+            self._unindex(hospital)
+            self._hospitals.remove(hospital)
+            self._wrote(revisions)
+        return hospital
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, hospital_id):
+        return hospital_id in self._by_id
+
+hospital_repository = HospitalRepository(sqlite_pool)
+
+# Cache over the hospitals table. It fills healthcare_data's hospital list in
+# place and shares the journal's lock, so JSON snapshots mirror SQLite and a
+# compaction never serializes a hospital mid-update
+hospital_registry = HospitalRegistry(hospital_repository,
+                                     healthcare_data.setdefault('multispeciality_hospitals', []),
+                                     lock=data_journal.lock,
+                                     refresh_seconds=app.config['HOSPITAL_REFRESH_SECONDS'])
+
+class EventSubscriber:
+    """One live /stream connection and its bounded queue of pending events"""
+
+    def __init__(self, clinic_id, max_queue):
+        self.clinic_id = clinic_id
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+class EventBroker:
+    """In-process pub/sub that fans events out to subscribed clinics.
+
+    Publishing never blocks: if a slow client's queue is full it is marked
+    as overflowed, stops receiving events and is told to resync (reload)
+    instead of holding up the publisher or growing without bound.
+    """
+
+    def __init__(self, max_queue=256):
+        self.max_queue = max_queue
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, clinic_id):
+        subscriber = EventSubscriber(clinic_id, self.max_queue)
+        with self._lock:
+            self._subscribers[clinic_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            clinic_subscribers = self._subscribers.get(subscriber.clinic_id)
+            if clinic_subscribers is not None:
+                clinic_subscribers.discard(subscriber)
+                if not clinic_subscribers:
+                    del self._subscribers[subscriber.clinic_id]
+
+    def publish(self, event, data, clinic_id=None):
+        """Send an event to one clinic's subscribers, or to everyone if clinic_id is None"""
+        with self._lock:
+            if clinic_id is None:
+                targets = [s for subscribers in self._subscribers.values() for s in subscribers]
+            else:
+                targets = list(self._subscribers.get(clinic_id, ()))
+        if not targets:
+            return
+        message = (next(self._ids), event, json.dumps(data))
+        for subscriber in targets:
+            if subscriber.overflowed:
+                continue
+            try:
+                subscriber.queue.put_nowait(message)
+            except queue.Full:
+                subscriber.overflowed = True
+                logger.warning("Dropping events for slow stream client of clinic %s", subscriber.clinic_id)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+event_broker = EventBroker(max_queue=app.config['SSE_QUEUE_SIZE'])
+
+def publish_bed_availability(hospital):
+    event_broker.publish('bed_availability', {
+        'hospital_id': hospital['hospital_id'],
+        'available_beds': hospital['available_beds'],
+        'total_beds': hospital['total_beds'],
+        'icu_beds': hospital['icu_beds']
+    })
+
+class CapacityError(ValueError):
+    """Raised when a hospital has no free beds of the requested type"""
+
+class BedLedger:
+    """Shared bed availability with atomic reserve/commit/release.
+
+    Counts live in SQLite so every worker process sees the same numbers.
+    Each operation runs in a BEGIN IMMEDIATE transaction and only decrements
+    a counter that is still positive, so concurrent referrals can never be
+    handed the same bed. A reservation is ``held`` until it is committed
+    (the patient is on the way) or released; held reservations that are not
+    committed within their TTL expire and give the bed back.
+
+    reserve/commit/release also return the new counts of every hospital the
+    transaction touched, as {hospital_id: {bed_type: (total, available)}},
+    so callers can update just those hospitals.
+    """
+
+    BED_TYPES = ('general', 'icu')
+
+    def __init__(self, pool, ttl_seconds=900):
+        self.pool = pool
+        self.ttl_seconds = ttl_seconds
+
+    @contextmanager
+    def _transaction(self):
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def _counts(conn, hospital_ids):
+        counts = defaultdict(dict)
+        hospital_ids = list(hospital_ids)
+        if hospital_ids:
+            for hospital_id, bed_type, total, available in conn.execute(f"""
+                SELECT hospital_id, bed_type, total, available FROM bed_ledger
+                WHERE hospital_id IN ({', '.join('?' * len(hospital_ids))})
+            """, hospital_ids):
+                counts[hospital_id][bed_type] = (total, available)
+        return dict(counts)
+
+    @staticmethod
+    def _expire_stale(conn, now):
+        """Give back beds whose holds lapsed; returns the hospitals affected"""
+        expired = {row[0] for row in conn.execute(
+            "SELECT hospital_id FROM bed_reservations WHERE status = 'held' AND expires_at <= ?", (now,))}
+        if not expired:
+            return expired
+        conn.execute("""
+            UPDATE bed_ledger SET available = available + (
+                SELECT COUNT(*) FROM bed_reservations r
+                WHERE r.hospital_id = bed_ledger.hospital_id AND r.bed_type = bed_ledger.bed_type
+                  AND r.status = 'held' AND r.expires_at <= ?
+            )
+            WHERE EXISTS (
+                SELECT 1 FROM bed_reservations r
+                WHERE r.hospital_id = bed_ledger.hospital_id AND r.bed_type = bed_ledger.bed_type
+                  AND r.status = 'held' AND r.expires_at <= ?
+            )
+        """, (now, now))
+        conn.execute("UPDATE bed_reservations SET status = 'expired' WHERE status = 'held' AND expires_at <= ?",
+                     (now,))
+        return expired
+
+    def seed(self, hospitals, conn=None):
+        """Create ledger rows for hospitals that do not have one yet.
+
+        Pass ``conn`` to seed inside a transaction the caller already holds.
+        """
+        if conn is None:
+            with self._transaction() as conn:
+                return self.seed(hospitals, conn)
+        conn.executemany(
+            "INSERT OR IGNORE INTO bed_ledger (hospital_id, bed_type, total, available) VALUES (?, ?, ?, ?)",
+            [row for h in hospitals for row in (
+                (h['hospital_id'], 'general', h['total_beds'], h['available_beds']),
+                (h['hospital_id'], 'icu', h['icu_beds']['total'], h['icu_beds']['available'])
+            )])
+
+    def set_capacity(self, hospital_id, total_beds, available_beds, icu_total, icu_available, loaded=None):
+        """Apply the capacity an admin entered; returns the changed counts.
+
+        Totals are overwritten. ``loaded`` is the (available_beds,
+        icu_available) the edit form was showing: when given, only the change
+        the admin made is applied to the live count, so reservations made
+        while the form was open are kept. Available beds are always capped at
+        the total minus the beds held or committed.
+        """
+        loaded = loaded or (None, None)
+        with self._transaction() as conn:
+            changed = self._expire_stale(conn, time.time())
+            for bed_type, total, available, shown in (('general', total_beds, available_beds, loaded[0]),
+                                                      ('icu', icu_total, icu_available, loaded[1])):
+                outstanding = conn.execute("""
+                    SELECT COUNT(*) FROM bed_reservations
+                    WHERE hospital_id = ? AND bed_type = ? AND status IN ('held', 'committed')
+                """, (hospital_id, bed_type)).fetchone()[0]
+                row = conn.execute("SELECT available FROM bed_ledger WHERE hospital_id = ? AND bed_type = ?",
+                                   (hospital_id, bed_type)).fetchone()
+                if row and shown is not None:
+                    available = row[0] + available - shown
+                conn.execute("""
+                    INSERT INTO bed_ledger (hospital_id, bed_type, total, available) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(hospital_id, bed_type) DO UPDATE SET
+                        total = excluded.total, available = excluded.available
+                """, (hospital_id, bed_type, total, max(0, min(available, total - outstanding))))
+            return self._counts(conn, changed | {hospital_id})
+
+    def remove(self, hospital_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM bed_ledger WHERE hospital_id = ?", (hospital_id,))
+            conn.execute("""
+                UPDATE bed_reservations SET status = 'released'
+                WHERE hospital_id = ? AND status IN ('held', 'committed')
+            """, (hospital_id,))
+
+    def reserve(self, hospital_id, patient_id, bed_type='general', ttl_seconds=None):
+        """Hold one bed for a patient; returns (reservation ID, changed counts)"""
+        if bed_type not in self.BED_TYPES:
+            raise ValueError(f"Unknown bed type: {bed_type}")
+        now = time.time()
+        reservation_id = str(uuid.uuid4())
+        with self._transaction() as conn:
+            changed = self._expire_stale(conn, now)
+            taken = conn.execute("""
+                UPDATE bed_ledger SET available = available - 1
+                WHERE hospital_id = ? AND bed_type = ? AND available > 0
+            """, (hospital_id, bed_type)).rowcount
+            if not taken:
+                raise CapacityError("No beds available at the selected hospital")
+            conn.execute("""
+                INSERT INTO bed_reservations
+                    (reservation_id, hospital_id, bed_type, patient_id, status, expires_at, created_at)
+                VALUES (?, ?, ?, ?, 'held', ?, ?)
+            """, (reservation_id, hospital_id, bed_type, patient_id,
+                  now + (ttl_seconds or self.ttl_seconds), datetime.now().isoformat()))
+            changed.add(hospital_id)
+            return reservation_id, self._counts(conn, changed)
+
+    def commit(self, reservation_id):
+        """Turn a held reservation into an occupied bed; returns (committed, changed counts).
+
+        A reservation that already lapsed is expired here, in the same
+        transaction, so its bed goes back before the caller reserves again.
+        """
+        with self._transaction() as conn:
+            now = time.time()
+            if conn.execute("""
+                UPDATE bed_reservations SET status = 'committed'
+                WHERE reservation_id = ? AND status = 'held' AND expires_at > ?
+            """, (reservation_id, now)).rowcount:
+                return True, {}
+            changed = self._expire_stale(conn, now)
+            row = conn.execute("SELECT status FROM bed_reservations WHERE reservation_id = ?",
+                               (reservation_id,)).fetchone()
+            return bool(row) and row[0] == 'committed', self._counts(conn, changed)
+
+    def release(self, reservation_id):
+        """Give a held or committed bed back; returns (released, changed counts)"""
+        with self._transaction() as conn:
+            row = conn.execute("""
+                SELECT hospital_id, bed_type FROM bed_reservations
+                WHERE reservation_id = ? AND status IN ('held', 'committed')
+            """, (reservation_id,)).fetchone()
+            if not row:
+                return False, {}
+            conn.execute("UPDATE bed_reservations SET status = 'released' WHERE reservation_id = ?",
+                         (reservation_id,))
+            conn.execute("""
+                UPDATE bed_ledger SET available = MIN(total, available + 1)
+                WHERE hospital_id = ? AND bed_type = ?
+            """, row)
+            return True, self._counts(conn, [row[0]])
+
+    def expire_stale(self):
+        """Expire held reservations past their TTL; returns the changed counts"""
+        with self._transaction() as conn:
+            return self._counts(conn, self._expire_stale(conn, time.time()))
+
+bed_ledger = BedLedger(sqlite_pool, ttl_seconds=app.config['BED_RESERVATION_TTL'])
+
+def sync_registry_with_ledger(counts):
+    """Copy the counts a ledger operation returned onto those hospitals only"""
+    for hospital_id, beds in counts.items():
+        hospital = hospital_registry.update_beds(hospital_id,
+                                                 available_beds=beds.get('general', (None, None))[1],
+                                                 icu_available=beds.get('icu', (None, None))[1])
+        if hospital is not None:
+            publish_bed_availability(hospital)
+
+class AnalyticsRollups:
+    """Materialized counters behind /admin/dashboard and /api/stats.
+
+    Counters live in the stats_counters table so every worker reads and
+    updates the same totals. Bed and ambulance counters are maintained by
+    SQLite triggers; the patient counters (MongoDB data) are bumped by the
+    write paths that create patients, change their status or assign PROs.
+    Reading the dashboard therefore costs one small query, however many
+    patients there are.
+    """
+
+    PATIENT_ROLLUPS = ('patients_by_status', 'referrals_by_hospital', 'referrals_by_clinic')
+    # Per-clinic status counts live under one counter name per clinic
+    CLINIC_STATUS_PREFIX = 'clinic_status:'
+    ACTIVE_AMBULANCE_STATUSES = ('Pending', 'Assigned', 'En Route')
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def apply(self, changes, conn=None):
+        """Add each (name, key, delta) to its counter in one transaction"""
+        totals = defaultdict(int)
+        for name, key, delta in changes:
+            if key is not None and delta:
+                totals[(name, str(key))] += delta
+        rows = [(name, key, delta) for (name, key), delta in totals.items() if delta]
+        if not rows:
+            return
+        sql = """
+            INSERT INTO stats_counters (name, key, value) VALUES (?, ?, ?)
+            ON CONFLICT (name, key) DO UPDATE SET value = value + excluded.value
+        """
+        if conn is not None:
+            conn.executemany(sql, rows)
+            return
+        with self.pool.connection() as conn:
+            conn.executemany(sql, rows)
+            conn.commit()
+
+    def clinic_status_name(self, clinic_id):
+        return f'{self.CLINIC_STATUS_PREFIX}{clinic_id}'
+
+    def patients_added(self, patients):
+        self.apply(change for patient in patients for change in (
+            ('patients_by_status', patient.get('current_status'), 1),
+            (self.clinic_status_name(patient.get('referred_by')), patient.get('current_status'), 1),
+            ('referrals_by_hospital', patient.get('assigned_hospital_id'), 1),
+            ('referrals_by_clinic', patient.get('referred_by'), 1)))
+
+    def status_changed(self, old_status, new_status, clinic_id=None):
+        if old_status != new_status:
+            changes = [('patients_by_status', old_status, -1), ('patients_by_status', new_status, 1)]
+            if clinic_id:
+                changes += [(self.clinic_status_name(clinic_id), old_status, -1),
+                            (self.clinic_status_name(clinic_id), new_status, 1)]
+            self.apply(changes)
+
+    def clinic_status_counts(self, clinic_id):
+        """Patients per status for one clinic, or None until the rollups have been built"""
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+                SELECT name, key, value FROM stats_counters
+                WHERE name = ? OR (name = 'meta' AND key = 'patients_rebuilt_at')
+            """, (self.clinic_status_name(clinic_id),)).fetchall()
+        if not any(name == 'meta' for name, _, _ in rows):
+            return None
+        return {key: value for name, key, value in rows if name != 'meta' and value}
+
+    def pro_assigned(self, pro_id):
+        self.apply([('pro_assignments', pro_id, 1)])
+
+    def counters(self):
+        result = defaultdict(dict)
+        with self.pool.connection() as conn:
+            for name, key, value in conn.execute("SELECT name, key, value FROM stats_counters WHERE name NOT GLOB ?",
+                                                 (self.CLINIC_STATUS_PREFIX + '*',)):
+                result[name][key] = value
+        return result
+
+    def summary(self):
+        counters = self.counters()
+        # Statuses that were emptied keep a zero row; leave them out of the report
+        patients = {k: v for k, v in counters.get('patients_by_status', {}).items() if v}
+        ambulances = {k: v for k, v in counters.get('ambulance_requests_by_status', {}).items() if v}
+        beds = {}
+        for bed_type in BedLedger.BED_TYPES:
+            total = counters['beds'].get(f'{bed_type}_total', 0)
+            available = counters['beds'].get(f'{bed_type}_available', 0)
+            beds[bed_type] = {'total': total, 'available': available, 'occupied': total - available,
+                              'occupancy': round((total - available) / total, 4) if total else None}
+        return {
+            'patients': {'total': sum(patients.values()), 'by_status': patients},
+            'referrals': {'by_hospital': counters.get('referrals_by_hospital', {}),
+                          'by_clinic': counters.get('referrals_by_clinic', {})},
+            'beds': beds,
+            'ambulance_requests': {
+                'by_status': ambulances,
+                'pending': ambulances.get('Pending', 0),
+                'active': sum(ambulances.get(status, 0) for status in self.ACTIVE_AMBULANCE_STATUSES)
+            },
+            'pro_assignments': counters.get('pro_assignments', {}),
+            'hospitals': len(hospital_registry),
+            'patient_rollups_rebuilt_at': counters.get('meta', {}).get('patients_rebuilt_at')
         }
-        with open(json_path, 'w') as file:
-            json.dump(initial_data, file, indent=4)
-        healthcare_data = initial_data
-    else:
-        with open(json_path, 'r') as file:
-            healthcare_data = json.load(file)
-except FileNotFoundError:
-    logger.error("caresync_updated_seed_data.json not found and could not be created")
-    healthcare_data = {
-        'patients': [],
-        'ambulance_requests': [],
-        'pros': [],
-        'multispeciality_hospitals': [],
-        'nursing_homes': [],
-        'counseling_resources': []
-    }
-except json.JSONDecodeError:
-    logger.error("caresync_updated_seed_data.json is not valid JSON")
-    healthcare_data = {
-        'patients': [],
-        'ambulance_requests': [],
-        'pros': [],
-        'multispeciality_hospitals': [],
-        'nursing_homes': [],
-        'counseling_resources': []
-    }
-except Exception as e:
-    logger.error(f"Error loading healthcare data: {str(e)}")
-    healthcare_data = {
-        'patients': [],
-        'ambulance_requests': [],
-        'pros': [],
-        'multispeciality_hospitals': [],
-        'nursing_homes': [],
-        'counseling_resources': []
-    }
 
-def save_healthcare_data():
-    """Save the healthcare data back to the JSON file"""
-    try:
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(json_path), exist_ok=True)
-        
-        # Create a backup of the existing file if it exists
-        if os.path.exists(json_path):
-            backup_path = f"{json_path}.backup"
+    def rebuild_patients(self):
+        """Recount the patient rollups from MongoDB.
+
+        Writes that land while the scan runs may be counted twice or missed,
+        so run it when the counters are known to be off, not routinely.
+        """
+        changes = []
+        if use_consolidated_patients():
+            sources = [(get_patients_collection(), None)]
+        else:
+            sources = [(collection, collection.name[len('clinic_'):-len('_patients')])
+                       for collection in list_clinic_collections()]
+        for collection, clinic_id in sources:
+            pipeline = [{'$group': {
+                '_id': {'status': '$current_status', 'hospital': '$assigned_hospital_id', 'clinic': '$referred_by'},
+                'count': {'$sum': 1}}}]
+            for row in collection.aggregate(pipeline):
+                group = row['_id']
+                changes.append(('patients_by_status', group.get('status'), row['count']))
+                changes.append((self.clinic_status_name(group.get('clinic') or clinic_id), group.get('status'),
+                                row['count']))
+                changes.append(('referrals_by_hospital', group.get('hospital'), row['count']))
+                changes.append(('referrals_by_clinic', group.get('clinic') or clinic_id, row['count']))
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
             try:
-                import shutil
-                shutil.copy2(json_path, backup_path)
+                conn.execute(f"""
+                    DELETE FROM stats_counters
+                    WHERE name IN ({', '.join('?' * len(self.PATIENT_ROLLUPS))}) OR name GLOB ?
+                """, self.PATIENT_ROLLUPS + (self.CLINIC_STATUS_PREFIX + '*',))
+                self.apply(changes, conn)
+                conn.execute("""
+                    INSERT OR REPLACE INTO stats_counters (name, key, value) VALUES ('meta', 'patients_rebuilt_at', ?)
+                """, (int(time.time()),))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        logger.info("Rebuilt patient rollups from %s collections", len(sources))
+
+    def ensure_patient_rollups(self):
+        """Build the patient rollups once, the first time the app starts with this database"""
+        with self.pool.connection() as conn:
+            built = conn.execute("SELECT 1 FROM stats_counters WHERE name = 'meta' AND key = 'patients_rebuilt_at'").fetchone()
+        if not built:
+            try:
+                self.rebuild_patients()
             except Exception as e:
-                logger.warning(f"Failed to create backup: {e}")
-        
-        # Write the new data with proper permissions
-        temp_path = f"{json_path}.temp"
-        with open(temp_path, 'w') as file:
-            json.dump(healthcare_data, file, indent=4)
+                logger.error("Error building patient rollups: %s", e)
+
+analytics = AnalyticsRollups(sqlite_pool)
+
+# Canonical names for the specialty spellings used in hospital records
+SPECIALTY_ALIASES = {
+    'cardio': 'cardiology', 'cardiac': 'cardiology', 'heart': 'cardiology',
+    'neuro': 'neurology', 'neurosurgery': 'neurology',
+    'ortho': 'orthopedics', 'orthopaedics': 'orthopedics',
+    'eye': 'ophthalmology', 'lasik': 'ophthalmology', 'cornea': 'ophthalmology',
+    'er': 'emergency', 'trauma': 'emergency',
+    'psychiatry': 'mental health', 'psychology': 'mental health',
+    'kidney': 'nephrology', 'renal': 'nephrology',
+    'cancer': 'oncology', 'lung': 'pulmonology', 'respiratory': 'pulmonology',
+    'diabetology': 'endocrinology'
+}
+
+# Specialties that treat common medical_history entries
+CONDITION_SPECIALTIES = {
+    'hypertension': ['cardiology'], 'heart disease': ['cardiology'], 'heart attack': ['cardiology', 'emergency'],
+    'arrhythmia': ['cardiology'], 'chest pain': ['cardiology', 'emergency'],
+    'stroke': ['neurology', 'emergency'], 'seizure': ['neurology'], 'epilepsy': ['neurology'],
+    'dementia': ['neurology'], 'parkinson': ['neurology'], 'migraine': ['neurology'],
+    'diabetes': ['endocrinology'], 'thyroid': ['endocrinology'],
+    'cataract': ['ophthalmology'], 'glaucoma': ['ophthalmology'],
+    'fracture': ['orthopedics', 'emergency'], 'arthritis': ['orthopedics'],
+    'asthma': ['pulmonology'], 'copd': ['pulmonology'], 'pneumonia': ['pulmonology'],
+    'kidney disease': ['nephrology'], 'cancer': ['oncology'],
+    'depression': ['mental health'], 'anxiety': ['mental health']
+}
+
+def canonical_specialty(name):
+    key = (name or '').strip().lower()
+    return SPECIALTY_ALIASES.get(key, key)
+
+class HospitalRecommender:
+    """Ranks hospitals for a patient against precomputed specialty bitsets.
+
+    Every canonical specialty gets a bit, and each hospital's specialties are
+    folded into one integer mask. Scoring a hospital is then a single AND
+    plus a popcount against the patient's mask, over parallel arrays rebuilt
+    only when the registry's directory version changes. Bed counts move with
+    every referral, so they are read from the hospitals at scoring time.
+    """
+
+    SPECIALTY_WEIGHT = 0.5
+    BED_WEIGHT = 0.2
+    ICU_WEIGHT = 0.1
+    SERVICE_WEIGHT = 0.1
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._built_version = None
+
+    def _build(self):
+        bits = {}
+        masks, ambulance, mental_health, hospitals = [], [], [], []
+        for hospital in self.registry.all():
+            mask = 0
+            for specialty in hospital.get('specialties', []):
+                mask |= 1 << bits.setdefault(canonical_specialty(specialty), len(bits))
+            masks.append(mask)
+            ambulance.append(bool(hospital.get('ambulance_services')))
+            mental_health.append(bool(hospital.get('mental_health_support')))
+            hospitals.append(hospital)
+        # Published as one tuple so a concurrent recommend() never pairs
+        # new bit positions with old masks
+        self._index = (bits, masks, ambulance, mental_health, hospitals)
+
+    def _ensure_built(self):
+        version = self.registry.directory_version
+        if self._built_version != version:
+            with self._lock:
+                if self._built_version != version:
+                    self._build()
+                    self._built_version = version
+
+    def needed_specialties(self, conditions):
+        """Map medical_history entries onto canonical specialty names"""
+        needed = set()
+        for condition in conditions:
+            key = condition.strip().lower()
+            if not key:
+                continue
+            needed.update(CONDITION_SPECIALTIES.get(key, [canonical_specialty(key)]))
+        return needed
+
+    def recommend(self, conditions, needs_icu=False, needs_ambulance=False,
+                  needs_mental_health=False, limit=10):
+        """Return up to ``limit`` hospitals, best first, with their scores"""
+        self._ensure_built()
+        bits, masks, ambulance, mental_health, hospitals = self._index
+        needed = self.needed_specialties(conditions)
+        if 'mental health' in needed:
+            needs_mental_health = True
+        need_mask = 0
+        for specialty in needed:
+            if specialty in bits:
+                need_mask |= 1 << bits[specialty]
+        # Specialties no hospital offers still count against the match ratio
+        need_count = len(needed)
         
-        # Verify the temp file was written correctly
-        if not os.path.exists(temp_path):
-            raise Exception("Temporary file was not created successfully")
-            
-        # Try to read it back to verify it's valid JSON
-        with open(temp_path, 'r') as file:
-            json.load(file)
+        scored = []
+        for i, mask in enumerate(masks):
+            hospital = hospitals[i]
+            beds = hospital.get('available_beds', 0)
+            icu = hospital.get('icu_beds', {}).get('available', 0)
+            if beds <= 0 or (needs_icu and icu <= 0):
+                continue
+            total = hospital.get('total_beds') or 0
+            matched = bin(mask & need_mask).count('1')
+            score = (self.SPECIALTY_WEIGHT * (matched / need_count if need_count else 0.0)
+                     + self.BED_WEIGHT * (min(1.0, beds / total) if total else 0.0)
+                     + self.ICU_WEIGHT * (1.0 if icu > 0 else 0.0))
+            if ambulance[i]:
+                score += self.SERVICE_WEIGHT if needs_ambulance else self.SERVICE_WEIGHT / 2
+            if mental_health[i]:
+                score += self.SERVICE_WEIGHT if needs_mental_health else self.SERVICE_WEIGHT / 2
+            scored.append((score, matched, i, beds, icu))
         
-        # If verification passed, replace the original file
-        if os.path.exists(json_path):
-            os.remove(json_path)
-        os.rename(temp_path, json_path)
-            
-        logger.info("Successfully saved healthcare data")
-        return True
-    except Exception as e:
-        logger.error(f"Error saving healthcare data: {e}")
-        # Try to restore from backup if available
-        if os.path.exists(f"{json_path}.backup"):
-            try:
-                import shutil
-                shutil.copy2(f"{json_path}.backup", json_path)
-                logger.info("Restored from backup after failed save")
-            except Exception as backup_error:
-                logger.error(f"Failed to restore from backup: {backup_error}")
-        return False
+        results = []
+        for score, matched, i, beds, icu in heapq.nlargest(limit, scored):
+            hospital = hospitals[i]
+            results.append({
+                'hospital_id': hospital['hospital_id'],
+                'name': hospital['name'],
+                'location': hospital['location'],
+                'score': round(score, 4),
+                'matched_specialties': [s for s in hospital.get('specialties', [])
+                                        if canonical_specialty(s) in needed],
+                'available_beds': beds,
+                'icu_available': icu
+            })
+        return results
+
+hospital_recommender = HospitalRecommender(hospital_registry)
+
+class ResponseCache:
+    """Serialized JSON responses keyed by (dataset, version), with strong ETags.
+
+    A body is serialized once per dataset version and reused until the
+    version moves on; conditional GETs are answered with 304 straight from
+    the stored ETag. Entries are evicted least recently used first once
+    their bodies exceed ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def version(self, dataset):
+        return self._versions[dataset]
+
+    def bump(self, dataset):
+        """Mark a dataset as changed so its cached responses are rebuilt"""
+        with self._lock:
+            self._versions[dataset] += 1
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _put(self, key, entry):
+        size = len(entry[1])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            # Older versions of the same dataset can never be served again
+            for stale in [k for k in self._entries if k[0] == key[0] and k != key]:
+                self.size -= len(self._entries.pop(stale)[1])
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, body) = self._entries.popitem(last=False)
+                self.size -= len(body)
+
+    def json_response(self, dataset, build, version=None):
+        """Serve ``build()`` as JSON, serializing only when the dataset version changed"""
+        key = (dataset, self.version(dataset) if version is None else version)
+        entry = self._get(key)
+        if entry is None:
+            body = json.dumps(build(), separators=(',', ':')).encode()
+            entry = (hashlib.sha256(body).hexdigest()[:32], body)
+            self._put(key, entry)
+        etag, body = entry
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 4) if lookups else None}
+
+response_cache = ResponseCache(app.config['RESPONSE_CACHE_BYTES'])
+
+class FragmentCache:
+    """Rendered template fragments keyed by the version of the data they show.
+
+    Templates wrap an expensive block in ``{% call cache_fragment(name, ...) %}``;
+    the block is rendered once per (name, extra key, dataset version[, clinic])
+    and replayed from memory until the dataset changes. Pass ``per_clinic=True``
+    for fragments whose output depends on the logged-in clinic.
+    """
 
-# Initialize session data if not exists
-def init_session_data():
-    if 'patients' not in session:
-        session['patients'] = healthcare_data['patients']
-    if 'ambulance_requests' not in session:
-        session['ambulance_requests'] = healthcare_data['ambulance_requests']
-    if 'pros' not in session:
-        session['pros'] = healthcare_data['pros']
+    def __init__(self, versions, max_entries=512):
+        self.versions = versions
+        self.max_entries = max_entries
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, name, *key, dataset='hospitals', per_clinic=False, caller=None):
+        clinic_id = session.get('entity_id') if per_clinic else None
+        cache_key = (name, key, clinic_id)
+        version = self.versions[dataset]()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(cache_key)
+                self.hits[name] += 1
+                return Markup(entry[1])
+            self.misses[name] += 1
+        html = caller()
+        with self._lock:
+            self._entries[cache_key] = (version, html)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return Markup(html)
+
+    def invalidate(self):
+        """Drop cached fragments eagerly instead of waiting for them to age out"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            report = {}
+            for name in set(self.hits) | set(self.misses):
+                lookups = self.hits[name] + self.misses[name]
+                report[name] = {'hits': self.hits[name], 'misses': self.misses[name],
+                                'hit_rate': round(self.hits[name] / lookups, 4)}
+            return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'fragments': report}
+
+# Fragments that only show hospital names, contacts and locations key on the
+# directory version, which bed-count updates leave alone
+fragment_cache = FragmentCache({'hospitals': lambda: hospital_registry.version,
+                                'hospital_directory': lambda: hospital_registry.directory_version},
+                               max_entries=app.config['FRAGMENT_CACHE_SIZE'])
+app.add_template_global(fragment_cache.render, 'cache_fragment')
 
 def hash_password(password):
     """Hash a password using SHA-256"""
     return hashlib.sha256(password.encode()).hexdigest()
 
-def init_nursing_home_credentials():
-    """Initialize nursing home credentials in the database"""
-    conn = sqlite3.connect('caresync.db')
-    c = conn.cursor()
+def _seed_nursing_homes(conn):
+    """Add seeded nursing homes, with default credentials, that are not in the database yet"""
+    existing = {row[0] for row in conn.execute("SELECT clinic_id FROM nursing_homes")}
+    homes = [home for home in healthcare_data['nursing_homes'] if home['clinic_id'] not in existing]
+    if not homes:
+        return 0
     
-    for home in healthcare_data['nursing_homes']:
-        # Check if nursing home exists in database
-        c.execute("SELECT * FROM nursing_homes WHERE clinic_id = ?", (home['clinic_id'],))
-        if not c.fetchone():
-            # Insert nursing home into database
-            c.execute("""
-                INSERT INTO nursing_homes (clinic_id, name, location, contact_person, phone, email)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                home['clinic_id'],
-                home['name'],
-                home['location'],
-                home['contact_person'],
-                home['phone'],
-                home['email']
-            ))
-            
-            # Create default username and password
-            username = f"clinic_{home['clinic_id'].lower()}"
-            password = f"{home['clinic_id']}123"
-            
-            # Insert user credentials
-            c.execute("""
-                INSERT INTO users (username, password, role, entity_id)
-                VALUES (?, ?, ?, ?)
-            """, (
-                username,
-                hash_password(password),
-                'nursing_home',
-                home['clinic_id']
-            ))
+    conn.executemany("""
+        INSERT INTO nursing_homes (clinic_id, name, location, contact_person, phone, email)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(
+        home['clinic_id'],
+        home['name'],
+        home['location'],
+        home['contact_person'],
+        home['phone'],
+        home['email']
+    ) for home in homes])
     
-    conn.commit()
-    conn.close()
+    # Default username is clinic_<id>, password <CLINIC_ID>123
+    conn.executemany("""
+        INSERT OR IGNORE INTO users (username, password, role, entity_id)
+        VALUES (?, ?, ?, ?)
+    """, [(
+        f"clinic_{home['clinic_id'].lower()}",
+        hash_password(f"{home['clinic_id']}123"),
+        'nursing_home',
+        home['clinic_id']
+    ) for home in homes])
+    return len(homes)
+
+AMBULANCE_REQUEST_COLUMNS = ('request_id', 'patient_id', 'requested_by', 'pickup_location',
+                             'drop_location', 'status', 'driver_details', 'created_at')
+
+def ambulance_request_from_row(row):
+    ambulance_request = dict(zip(AMBULANCE_REQUEST_COLUMNS, row))
+    if ambulance_request['driver_details']:
+        ambulance_request['driver_details'] = json.loads(ambulance_request['driver_details'])
+    else:
+        del ambulance_request['driver_details']
+    return ambulance_request
+
+def _seed_ambulance_requests(conn):
+    """Copy seeded ambulance requests into the ambulance_requests table"""
+    conn.executemany("""
+        INSERT OR IGNORE INTO ambulance_requests
+            (request_id, patient_id, requested_by, pickup_location, drop_location,
+             status, driver_details, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(
+        r['request_id'],
+        r['patient_id'],
+        r.get('requested_by'),
+        r['pickup_location'],
+        r['drop_location'],
+        r['status'],
+        json.dumps(r['driver_details']) if r.get('driver_details') else None,
+        r.get('created_at', '')
+    ) for r in healthcare_data.get('ambulance_requests', [])])
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+class GridIndex:
+    """Uniform lat/lon grid for k-nearest-neighbour lookups.
 
-# Initialize nursing home credentials
-init_nursing_home_credentials()
+    Points are bucketed into cells ``cell_degrees`` tall; longitude columns
+    are as close to that as divides 360 evenly, and wrap at the antimeridian.
+    A query scans rings of cells outward from the query cell and stops as
+    soon as the next ring cannot contain anything closer than the k-th best
+    hit, so cost depends on local density rather than fleet size. Once the
+    rings have probed more cells than are occupied (a sparse or spread-out
+    index, or a query near a pole), it scans the occupied cells directly
+    instead. Moving a point only touches its old and new cell.
+    """
+
+    def __init__(self, cell_degrees=0.05):
+        self.cell_degrees = cell_degrees
+        self._columns = max(1, round(360 / cell_degrees))
+        self._column_degrees = 360 / self._columns
+        self._cells = defaultdict(dict)
+        self._points = {}
+        # Bounding box of every cell ever used; only ever grows, which keeps
+        # it a safe stopping bound for the ring search
+        self._bounds = None
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_degrees),
+                math.floor((lon + 180) % 360 / self._column_degrees) % self._columns)
+
+    def upsert(self, item_id, lat, lon):
+        self.remove(item_id)
+        cell = self._cell(lat, lon)
+        self._cells[cell][item_id] = (lat, lon)
+        self._points[item_id] = cell
+        if self._bounds is None:
+            self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+        else:
+            bounds = self._bounds
+            bounds[0], bounds[1] = min(bounds[0], cell[0]), max(bounds[1], cell[0])
+            bounds[2], bounds[3] = min(bounds[2], cell[1]), max(bounds[3], cell[1])
+
+    def remove(self, item_id):
+        cell = self._points.pop(item_id, None)
+        if cell is not None:
+            bucket = self._cells[cell]
+            bucket.pop(item_id, None)
+            if not bucket:
+                del self._cells[cell]
+
+    def _ring(self, row, col, radius):
+        if radius == 0:
+            yield (row, col)
+            return
+        columns = self._columns
+        if 2 * radius + 1 > columns:
+            # The ring wraps onto itself: only its top and bottom rows are new
+            for d in range(columns):
+                yield (row - radius, d)
+                yield (row + radius, d)
+            return
+        for d in range(-radius, radius + 1):
+            yield (row - radius, (col + d) % columns)
+            yield (row + radius, (col + d) % columns)
+        for d in range(-radius + 1, radius):
+            yield (row + d, (col - radius) % columns)
+            yield (row + d, (col + radius) % columns)
+
+    def _column_distance(self, col, first, last):
+        """Most columns, going either way round, from ``col`` to any in first..last"""
+        columns = self._columns
+        if first <= (col + columns // 2) % columns <= last:
+            return columns // 2
+        return max(min((col - c) % columns, (c - col) % columns) for c in (first, last))
+
+    def _unprobed_km(self, lat, radius):
+        """Lower bound on the distance to any point outside rings 0..radius-1.
+
+        Such a point is at least ``radius - 1`` cells away in latitude or in
+        longitude. Across longitude the bound is the cross-track distance to
+        the nearest meridian that far round, which is exact at any latitude.
+        """
+        if radius <= 1:
+            return 0.0
+        if 2 * radius - 1 >= self._columns:
+            return (radius - 1) * self.cell_degrees * KM_PER_DEGREE
+        lat_km = (radius - 1) * self.cell_degrees * KM_PER_DEGREE
+        angle = min(math.radians((radius - 1) * self._column_degrees), math.pi / 2)
+        lon_km = EARTH_RADIUS_KM * math.asin(min(1.0, math.cos(math.radians(lat)) * math.sin(angle)))
+        return min(lat_km, lon_km)
+
+    def _scan(self, lat, lon, k):
+        return heapq.nsmallest(k, ((haversine_km(lat, lon, item_lat, item_lon), item_id)
+                                   for bucket in self._cells.values()
+                                   for item_id, (item_lat, item_lon) in bucket.items()))
+
+    def nearest(self, lat, lon, k=5):
+        """Return up to k (distance_km, item_id) pairs, closest first"""
+        if not self._cells:
+            return []
+        row, col = self._cell(lat, lon)
+        min_row, max_row, min_col, max_col = self._bounds
+        max_radius = max(abs(row - min_row), abs(row - max_row), self._column_distance(col, min_col, max_col))
+        best = []
+        probed = 0
+        for radius in range(max_radius + 1):
+            if len(best) >= k and -best[0][0] <= self._unprobed_km(lat, radius):
+                break
+            if probed > len(self._cells):
+                return self._scan(lat, lon, k)
+            for cell in self._ring(row, col, radius):
+                probed += 1
+                bucket = self._cells.get(cell)
+                if not bucket:
+                    continue
+                for item_id, (item_lat, item_lon) in bucket.items():
+                    distance = haversine_km(lat, lon, item_lat, item_lon)
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, item_id))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, item_id))
+        return sorted((-d, item_id) for d, item_id in best)
+
+    def __len__(self):
+        return len(self._points)
+
+AMBULANCE_COLUMNS = ('ambulance_id', 'name', 'hospital_id', 'driver_name', 'driver_contact',
+                     'lat', 'lon', 'status', 'updated_at')
+
+class AmbulanceFleet:
+    """Ambulances and their last known positions, with a spatial index.
+
+    SQLite holds the shared state; each process keeps a GridIndex of the
+    free vehicles that is brought up to date incrementally from rows whose
+    ``updated_at`` moved since the last sync, at most every
+    ``refresh_seconds`` unless this process just wrote. Claiming a vehicle
+    is a conditional update, so two workers cannot dispatch the same
+    ambulance even when one of them is looking at a slightly stale index.
+    """
+
+    # Re-read rows this far behind the newest timestamp seen, so a write
+    # stamped just before another worker's commit is not skipped
+    SYNC_LOOKBACK_SECONDS = 2.0
+
+    def __init__(self, pool, cell_degrees=0.05, refresh_seconds=1.0):
+        self.pool = pool
+        self.refresh_seconds = refresh_seconds
+        self.index = GridIndex(cell_degrees)
+        self._vehicles = {}
+        self._synced_at = 0.0
+        self._checked_at = None
+        self._lock = threading.RLock()
+
+    def refresh(self, force=False):
+        """Pull in vehicles changed by any worker, checking at most every refresh_seconds unless forced"""
+        if not force and self._checked_at is not None and time.monotonic() - self._checked_at < self.refresh_seconds:
+            return
+        self._checked_at = time.monotonic()
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"""
+                SELECT {', '.join(AMBULANCE_COLUMNS)} FROM ambulances
+                WHERE updated_at >= ? ORDER BY updated_at
+            """, (self._synced_at - self.SYNC_LOOKBACK_SECONDS,)).fetchall()
+        with self._lock:
+            for row in rows:
+                vehicle = dict(zip(AMBULANCE_COLUMNS, row))
+                self._vehicles[vehicle['ambulance_id']] = vehicle
+                if vehicle['status'] == 'available':
+                    self.index.upsert(vehicle['ambulance_id'], vehicle['lat'], vehicle['lon'])
+                else:
+                    self.index.remove(vehicle['ambulance_id'])
+                self._synced_at = max(self._synced_at, vehicle['updated_at'])
+
+    def _write(self, conn, vehicle):
+        vehicle['updated_at'] = time.time()
+        conn.execute(f"""
+            INSERT INTO ambulances ({', '.join(AMBULANCE_COLUMNS)})
+            VALUES ({', '.join('?' for _ in AMBULANCE_COLUMNS)})
+            ON CONFLICT(ambulance_id) DO UPDATE SET
+                name = excluded.name, hospital_id = excluded.hospital_id,
+                driver_name = excluded.driver_name, driver_contact = excluded.driver_contact,
+                lat = excluded.lat, lon = excluded.lon,
+                status = excluded.status, updated_at = excluded.updated_at
+        """, tuple(vehicle[column] for column in AMBULANCE_COLUMNS))
+
+    def register(self, name, lat, lon, hospital_id=None, driver_name=None,
+                 driver_contact=None, ambulance_id=None):
+        vehicle = {
+            'ambulance_id': ambulance_id or f"AMB{str(uuid.uuid4())[:8].upper()}",
+            'name': name,
+            'hospital_id': hospital_id,
+            'driver_name': driver_name,
+            'driver_contact': driver_contact,
+            'lat': lat,
+            'lon': lon,
+            'status': 'available'
+        }
+        with self.pool.connection() as conn:
+            self._write(conn, vehicle)
+            conn.commit()
+        self.refresh(force=True)
+        return vehicle
+
+    def report_position(self, ambulance_id, lat, lon, status=None):
+        """Record a vehicle's new position; returns the vehicle or None if unknown"""
+        with self.pool.connection() as conn:
+            changed = conn.execute("""
+                UPDATE ambulances SET lat = ?, lon = ?, status = COALESCE(?, status), updated_at = ?
+                WHERE ambulance_id = ?
+            """, (lat, lon, status, time.time(), ambulance_id)).rowcount
+            conn.commit()
+        if not changed:
+            return None
+        self.refresh(force=True)
+        return self.get(ambulance_id)
+
+    def get(self, ambulance_id):
+        with self._lock:
+            vehicle = self._vehicles.get(ambulance_id)
+            return dict(vehicle) if vehicle else None
+
+    def nearest(self, lat, lon, k=5):
+        """Return the k closest free ambulances with their distance"""
+        self.refresh()
+        with self._lock:
+            return [dict(self._vehicles[ambulance_id], distance_km=round(distance, 3))
+                    for distance, ambulance_id in self.index.nearest(lat, lon, k)]
+
+    def available(self, k=5):
+        """Return up to k free ambulances, for requests without a pickup point"""
+        self.refresh()
+        with self._lock:
+            return [dict(vehicle) for vehicle in self._vehicles.values()
+                    if vehicle['status'] == 'available'][:k]
+
+    @staticmethod
+    def claim(conn, ambulance_id):
+        """Mark a free ambulance dispatched inside the caller's transaction; False if taken"""
+        return conn.execute("""
+            UPDATE ambulances SET status = 'dispatched', updated_at = ?
+            WHERE ambulance_id = ? AND status = 'available'
+        """, (time.time(), ambulance_id)).rowcount > 0
+
+    @staticmethod
+    def release(conn, ambulance_id):
+        """Put a dispatched ambulance back into service inside the caller's transaction"""
+        return conn.execute("""
+            UPDATE ambulances SET status = 'available', updated_at = ?
+            WHERE ambulance_id = ? AND status = 'dispatched'
+        """, (time.time(), ambulance_id)).rowcount > 0
+
+    def __len__(self):
+        return len(self._vehicles)
+
+ambulance_fleet = AmbulanceFleet(sqlite_pool, cell_degrees=app.config['AMBULANCE_GRID_DEGREES'],
+                                 refresh_seconds=app.config['AMBULANCE_REFRESH_SECONDS'])
+
+def parse_coordinates(data, lat_key='lat', lon_key='lon'):
+    """Read a lat/lon pair from a dict; returns None if absent, raises ValueError if invalid"""
+    if data.get(lat_key) in (None, '') and data.get(lon_key) in (None, ''):
+        return None
+    try:
+        lat, lon = float(data.get(lat_key)), float(data.get(lon_key))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid coordinates")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("Coordinates out of range")
+    return lat, lon
 
 # Login required decorator
 def login_required(f):
@@ -321,30 +3124,24 @@ def nursing_home_login():
         clinic_id = request.form.get('clinic_id')
         password = request.form.get('password')
         
-        conn = sqlite3.connect('caresync.db')
-        c = conn.cursor()
-        
-        # Find the nursing home
-        c.execute("""
-            SELECT u.*, n.name 
+        # Find the nursing home (served by idx_users_entity_role)
+        user = get_db().execute("""
+            SELECT u.id, u.username, u.role, u.entity_id, n.name
             FROM users u
             JOIN nursing_homes n ON u.entity_id = n.clinic_id
-            WHERE u.entity_id = ? AND u.password = ? AND u.role = 'nursing_home'
-        """, (clinic_id, hash_password(password)))
-        
-        user = c.fetchone()
-        conn.close()
+            WHERE u.entity_id = ? AND u.role = 'nursing_home' AND u.password = ?
+        """, (clinic_id, hash_password(password))).fetchone()
         
         if user:
+            # Start a fresh session under a new ID, so a fixated one is useless
+            session.clear()
+            session.regenerate()
             # Store nursing home info in session
             session['user_id'] = user[0]
             session['username'] = user[1]
-            session['role'] = user[3]
-            session['entity_id'] = user[4]
-            session['nursing_home_name'] = user[5]  # nursing home name
-            
-            # Initialize session data
-            init_session_data()
+            session['role'] = user[2]
+            session['entity_id'] = user[3]
+            session['nursing_home_name'] = user[4]  # nursing home name
             
             flash('Login successful!', 'success')
             return redirect(url_for('nursing_home_dashboard'))
@@ -370,7 +3167,7 @@ def home():
 @login_required
 def about():
     return render_template('about.html', 
-                         hospitals=healthcare_data['multispeciality_hospitals'],
+                         hospitals=hospital_registry.all(),
                          nursing_homes=healthcare_data['nursing_homes'])
 
 @app.route('/contact', methods=['GET', 'POST'])
@@ -382,86 +3179,117 @@ def contact():
         message = request.form.get('message')
         return jsonify({"status": "success", "message": "Thank you for your message!"})
     return render_template('contact.html', 
-                         hospitals=healthcare_data['multispeciality_hospitals'],
+                         hospitals=hospital_registry.all(),
                          counseling=healthcare_data['counseling_resources'])
 
+def build_patient_doc(fields, referred_by, patient_id=None):
+    """Validate submitted patient fields and build the document to insert.
+
+    ``fields`` can be any mapping (form data, a CSV row, a JSON object).
+    Raises ValueError describing the first invalid field.
+    """
+    def text(key, label):
+        # JSON rows can carry numbers, lists or objects where forms only send strings
+        value = fields.get(key)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{label} must be a string")
+        return value
+
+    name = text('name', "Patient name")
+    if not name:
+        raise ValueError("Patient name is required")
+
+    try:
+        age = int(fields.get('age'))
+        if age < 0 or age > 120:
+            raise ValueError("Age must be between 0 and 120")
+    except (TypeError, ValueError):
+        raise ValueError("Invalid age value")
+
+    gender = text('gender', "Gender")
+    if not gender:
+        raise ValueError("Gender is required")
+
+    contact_number = text('contact_number', "Contact number")
+    if not contact_number:
+        raise ValueError("Contact number is required")
+
+    address = text('address', "Address")
+    if not address:
+        raise ValueError("Address is required")
+
+    medical_history = fields.get('medical_history') or ''
+    if isinstance(medical_history, list):
+        if not all(isinstance(condition, str) for condition in medical_history):
+            raise ValueError("Medical history must be a string or a list of strings")
+        medical_history = [condition.strip() for condition in medical_history if condition.strip()]
+    elif not isinstance(medical_history, str):
+        raise ValueError("Medical history must be a string or a list of strings")
+    elif not medical_history.strip():
+        medical_history = []
+    else:
+        medical_history = [condition.strip() for condition in medical_history.strip().split(',')]
+
+    assigned_hospital_id = text('assigned_hospital_id', "Hospital assignment")
+    if not assigned_hospital_id:
+        raise ValueError("Hospital assignment is required")
+    if assigned_hospital_id not in hospital_registry:
+        raise ValueError("Selected hospital does not exist")
+
+    patient_doc = {
+        'patient_id': patient_id,
+        'name': name,
+        'age': age,
+        'gender': gender,
+        'contact_number': contact_number,
+        'address': address,
+        'medical_history': medical_history,
+        'current_status': 'Pending',
+        'assigned_hospital_id': assigned_hospital_id,
+        'referred_by': referred_by,
+        'created_at': datetime.now().isoformat()
+    }
+    patient_doc['updated_at'] = patient_doc['created_at']
+    if not patient_id:
+        assign_patient_id(patient_doc)
+    return patient_doc
+
+def assign_patient_id(patient_doc):
+    """Give a patient a fresh time-ordered ID; created_at is the ID's own timestamp
+    so that the ID alone can serve as the dashboard's keyset cursor"""
+    patient_doc['patient_id'] = new_patient_id()
+    patient_doc['created_at'] = patient_doc['updated_at'] = ids.created_at(patient_doc['patient_id'])
+    return patient_doc
+
 @app.route('/add-patient', methods=['GET', 'POST'])
 @login_required
 @role_required(['nursing_home', 'admin'])
 def add_patient():
     if request.method == 'POST':
         try:
-            # Check MongoDB connection
-            if not mongo_client:
-                logger.error("MongoDB client is not initialized")
-                raise Exception("MongoDB connection not available")
-
-            # Get form data with validation
-            name = request.form.get('name')
-            if not name:
-                raise ValueError("Patient name is required")
-
-            try:
-                age = int(request.form.get('age'))
-                if age < 0 or age > 120:
-                    raise ValueError("Age must be between 0 and 120")
-            except (TypeError, ValueError):
-                raise ValueError("Invalid age value")
-
-            gender = request.form.get('gender')
-            if not gender:
-                raise ValueError("Gender is required")
-
-            contact_number = request.form.get('contact_number')
-            if not contact_number:
-                raise ValueError("Contact number is required")
-
-            address = request.form.get('address')
-            if not address:
-                raise ValueError("Address is required")
-
-            medical_history = request.form.get('medical_history', '').strip()
-            if not medical_history:
-                medical_history = []
-            else:
-                medical_history = [condition.strip() for condition in medical_history.split(',')]
-
-            assigned_hospital_id = request.form.get('assigned_hospital_id')
-            if not assigned_hospital_id:
-                raise ValueError("Hospital assignment is required")
-
             referred_by = session.get('entity_id')
             if not referred_by:
                 raise ValueError("Clinic ID not found in session")
 
-            # Generate a unique patient ID
-            patient_id = str(uuid.uuid4())[:8]
-            
-            # Create patient document
-            patient_doc = {
-                'patient_id': patient_id,
-                'name': name,
-                'age': age,
-                'gender': gender,
-                'contact_number': contact_number,
-                'address': address,
-                'medical_history': medical_history,
-                'current_status': 'Pending',
-                'assigned_hospital_id': assigned_hospital_id,
-                'referred_by': referred_by,
-                'created_at': datetime.now().isoformat()
-            }
-            
-            logger.info(f"Attempting to add patient: {patient_doc}")
+            # Validate the form and build the patient document
+            patient_doc = build_patient_doc(request.form, referred_by)
+            assigned_hospital_id = patient_doc['assigned_hospital_id']
             
-            # Get clinic-specific collection
-            clinic_collection = init_clinic_collection(referred_by)
+            logger.debug("Attempting to add patient: %s", patient_doc)
             
-            # Insert patient document
-            result = clinic_collection.insert_one(patient_doc)
+            result = store_new_patient(referred_by, patient_doc)
+            # The ID is only final once stored; a collision gets a fresh one
+            patient_id = patient_doc['patient_id']
             
             if result.inserted_id:
-                logger.info(f"Successfully added patient with ID: {patient_id}")
+                logger.info("Successfully added patient with ID: %s", patient_id)
+                patient_search.add(referred_by, patient_doc)
+                event_broker.publish('patient_status', {
+                    'patient_id': patient_id,
+                    'name': patient_doc['name'],
+                    'current_status': patient_doc['current_status'],
+                    'assigned_hospital_id': assigned_hospital_id
+                }, clinic_id=referred_by)
                 flash('Patient added successfully!', 'success')
                 return redirect(url_for('patient_details', patient_id=patient_id))
             else:
@@ -469,20 +3297,228 @@ def add_patient():
             
         except ValueError as e:
             error_msg = str(e)
-            logger.error(f"Validation error: {error_msg}")
+            logger.error("Validation error: %s", error_msg)
             flash(f'Error: {error_msg}', 'error')
             return redirect(url_for('add_patient'))
         except Exception as e:
             error_msg = str(e)
-            logger.error(f"Error adding patient: {error_msg}")
+            logger.error("Error adding patient: %s", error_msg)
             flash('An error occurred while adding the patient. Please try again.', 'error')
             return redirect(url_for('add_patient'))
     
     # GET request - show the form
     return render_template('add_patient.html', 
-                         hospitals=healthcare_data['multispeciality_hospitals'],
+                         hospitals=hospital_registry.all(),
                          nursing_homes=healthcare_data['nursing_homes'])
 
+def store_new_patient(clinic_id, patient_doc):
+    """Reserve a bed and insert the patient, retrying with a fresh ID on a collision"""
+    clinic_collection = init_clinic_collection(clinic_id)
+    
+    def insert():
+        # Hold a bed at the assigned hospital until the patient is moved
+        patient_doc['bed_reservation_id'], counts = bed_ledger.reserve(patient_doc['assigned_hospital_id'],
+                                                                       patient_doc['patient_id'])
+        sync_registry_with_ledger(counts)
+        try:
+            result = clinic_collection.insert_one(patient_doc)
+        except Exception as e:
+            sync_registry_with_ledger(bed_ledger.release(patient_doc['bed_reservation_id'])[1])
+            if isinstance(e, DuplicateKeyError):
+                assign_patient_id(patient_doc)
+            raise
+        analytics.patients_added([patient_doc])
+        return result
+    
+    return retry_duplicate_id(insert, DuplicateKeyError)
+
+def iter_decoded_lines(stream):
+    """Decode a binary upload line by line without reading it all into memory"""
+    first = True
+    for raw in stream:
+        line = raw.decode('utf-8')
+        if first:
+            line = line.lstrip('\ufeff')
+            first = False
+        yield line
+
+class MalformedUpload(ValueError):
+    """Raised when a multipart upload body cannot be parsed"""
+
+def open_multipart_file(stream, boundary, field_name, chunk_size=64 * 1024):
+    """Find a file field in a multipart body read straight off the request stream.
+
+    Unlike request.files, nothing is spooled: returns (filename, mimetype,
+    lines) as soon as the field's headers arrive, where ``lines`` yields the
+    file's bytes line by line while the rest of the body is still being read.
+    Returns None if the body has no such field.
+    """
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    
+    def next_event():
+        try:
+            while True:
+                event = decoder.next_event()
+                if event is not NEED_DATA:
+                    return event
+                decoder.receive_data(stream.read(chunk_size) or None)
+        except ValueError as e:
+            raise MalformedUpload(str(e)) from e
+    
+    def drain():
+        while not isinstance(next_event(), Epilogue):
+            pass
+    
+    def lines():
+        pending = b''
+        while True:
+            event = next_event()
+            if not isinstance(event, Data):
+                raise MalformedUpload("Unexpected multipart event")
+            *complete, pending = (pending + event.data).split(b'\n')
+            for line in complete:
+                yield line + b'\n'
+            if not event.more_data:
+                break
+        if pending:
+            yield pending
+        drain()
+    
+    while True:
+        event = next_event()
+        if isinstance(event, Epilogue):
+            return None
+        if isinstance(event, File) and event.name == field_name:
+            mimetype = parse_options_header(event.headers.get('content-type', ''))[0]
+            return event.filename, mimetype, lines()
+
+def iter_import_rows(stream, fmt):
+    """Yield (row_number, fields, error) for each record of a CSV or NDJSON upload"""
+    lines = iter_decoded_lines(stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for fields in reader:
+            yield reader.line_num, fields, None
+        return
+    for row_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            fields = json.loads(line)
+        except ValueError:
+            yield row_number, None, "Invalid JSON"
+            continue
+        if not isinstance(fields, dict):
+            yield row_number, None, "Each line must be a JSON object"
+            continue
+        yield row_number, fields, None
+
+def import_patient_rows(collection, rows, referred_by, batch_size, max_errors):
+    """Validate rows with the add_patient rules and insert them in batches"""
+    report = {'rows': 0, 'imported': 0, 'failed': 0, 'errors': [], 'errors_truncated': False}
+    
+    def record_error(row_number, message):
+        report['failed'] += 1
+        if len(report['errors']) < max_errors:
+            report['errors'].append({'row': row_number, 'error': message})
+        else:
+            report['errors_truncated'] = True
+    
+    def flush(batch, batch_rows):
+        failed = set()
+        try:
+            collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            for error in write_errors:
+                failed.add(error['index'])
+                message = "Duplicate patient_id" if error.get('code') == 11000 else error.get('errmsg', 'Write failed')
+                record_error(batch_rows[error['index']], message)
+        report['imported'] += len(batch) - len(failed)
+        analytics.patients_added(patient for index, patient in enumerate(batch) if index not in failed)
+    
+    batch, batch_rows = [], []
+    for row_number, fields, error in rows:
+        report['rows'] += 1
+        if error:
+            record_error(row_number, error)
+            continue
+        try:
+            patient_id = fields.get('patient_id') or None
+            if patient_id is not None and not isinstance(patient_id, str):
+                raise ValueError("patient_id must be a string")
+            batch.append(build_patient_doc(fields, referred_by, patient_id=patient_id))
+            batch_rows.append(row_number)
+        except ValueError as e:
+            record_error(row_number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            flush(batch, batch_rows)
+            batch, batch_rows = [], []
+    if batch:
+        flush(batch, batch_rows)
+    return report
+
+@app.route('/patients/import', methods=['POST'])
+@login_required
+@role_required(['nursing_home', 'admin'])
+def import_patients():
+    """Bulk-import patients from a streamed CSV or NDJSON upload.
+
+    The body may be a multipart upload (field ``file``) or the raw file with
+    a text/csv or application/x-ndjson content type. Imported patients do not
+    hold beds; one is reserved when they are moved to In Transit.
+    """
+    referred_by = session.get('entity_id')
+    if not referred_by:
+        return jsonify({"status": "error", "message": "Clinic ID not found in session"}), 400
+    
+    if request.mimetype == 'multipart/form-data':
+        boundary = request.mimetype_params.get('boundary')
+        try:
+            upload = open_multipart_file(request.stream, boundary, 'file') if boundary else None
+        except MalformedUpload as e:
+            return jsonify({"status": "error", "message": f"Malformed multipart upload: {e}"}), 400
+        if upload is None:
+            return jsonify({"status": "error", "message": "Multipart upload has no file field"}), 400
+        name, content_type, stream = upload
+    else:
+        stream, name, content_type = request.stream, '', request.mimetype
+    fmt = request.args.get('format')
+    if not fmt:
+        if name.endswith('.csv') or content_type in ('text/csv', 'application/csv'):
+            fmt = 'csv'
+        elif name.endswith(('.ndjson', '.jsonl')) or content_type in ('application/x-ndjson', 'application/jsonl'):
+            fmt = 'ndjson'
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"status": "error", "message": "Upload must be CSV or NDJSON"}), 400
+    
+    try:
+        collection = init_clinic_collection(referred_by)
+    except Exception as e:
+        logger.error("Database error in import_patients: %s", e)
+        return jsonify({"status": "error", "message": "Database error"}), 500
+    
+    started = time.perf_counter()
+    try:
+        report = import_patient_rows(collection, iter_import_rows(stream, fmt), referred_by,
+                                     app.config['IMPORT_BATCH_SIZE'], app.config['IMPORT_MAX_ERRORS'])
+    except UnicodeDecodeError:
+        return jsonify({"status": "error", "message": "Upload must be UTF-8 encoded"}), 400
+    except MalformedUpload as e:
+        return jsonify({"status": "error", "message": f"Malformed multipart upload: {e}"}), 400
+    except csv.Error as e:
+        return jsonify({"status": "error", "message": f"Malformed CSV: {e}"}), 400
+    elapsed = time.perf_counter() - started
+    
+    report['elapsed_seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round(report['rows'] / elapsed, 1) if elapsed else None
+    report['status'] = 'success' if not report['failed'] else 'partial'
+    logger.info("Imported %s of %s patients for clinic %s", report['imported'], report['rows'], referred_by)
+    if report['imported']:
+        event_broker.publish('patients_imported', {'count': report['imported']}, clinic_id=referred_by)
+    return jsonify(report)
+
 @app.route('/patient/<patient_id>')
 @login_required
 def patient_details(patient_id):
@@ -501,125 +3537,1059 @@ def patient_details(patient_id):
             return redirect(url_for('home'))
         
         # Check if user has permission to view this patient
-        if session['user']['role'] == 'nursing_home' and patient['referred_by'] != session['user']['entity_id']:
+        if session.get('role') == 'nursing_home' and patient['referred_by'] != clinic_id:
             flash('You do not have permission to view this patient.', 'error')
             return redirect(url_for('nursing_home_dashboard'))
         
         # Get hospital details from healthcare_data
         hospital = None
         if patient.get('assigned_hospital_id'):
-            hospital = next((h for h in healthcare_data['multispeciality_hospitals'] 
-                           if h['hospital_id'] == patient['assigned_hospital_id']), None)
+            hospital = hospital_registry.get(patient['assigned_hospital_id'])
         
         # Get nursing home details from healthcare_data
         nursing_home = next((h for h in healthcare_data['nursing_homes'] 
                            if h['clinic_id'] == patient['referred_by']), None)
         
+        # Get the assigned PRO and the latest ambulance request
+        pro = None
+        if patient.get('assigned_pro_id'):
+            pro = next((p for p in healthcare_data.get('pros', [])
+                        if p['pro_id'] == patient['assigned_pro_id']), None)
+        row = get_db().execute("""
+            SELECT request_id, patient_id, requested_by, pickup_location, drop_location,
+                   status, driver_details, created_at
+            FROM ambulance_requests
+            WHERE patient_id = ?
+            ORDER BY created_at DESC
+            LIMIT 1
+        """, (patient_id,)).fetchone()
+        ambulance = ambulance_request_from_row(row) if row else None
+        
         return render_template('patient_details.html', 
                              patient=patient,
                              hospital=hospital,
-                             nursing_home=nursing_home)
+                             nursing_home=nursing_home,
+                             pro=pro,
+                             ambulance=ambulance)
                              
     except Exception as e:
         flash('An error occurred while fetching patient details.', 'error')
-        print(f"Error fetching patient details: {str(e)}")
+        logger.error("Error fetching patient details for %s: %s", patient_id, e)
         return redirect(url_for('home'))
 
+class NoAmbulanceAvailable(Exception):
+    """No free ambulance could be claimed; the job is retried later"""
+
+class DispatchQueue:
+    """Durable job queue that moves ambulance requests through their states.
+
+    The ambulance_requests table is the queue: a request is due while its
+    ``available_at`` is set and has passed. A worker claims a due request by
+    stamping a fresh ``claim_token`` and pushing ``available_at`` out by the
+    visibility timeout, so if the worker dies the request becomes due again
+    (at-least-once processing). Results are written only while the worker
+    still holds the claim token.
+
+    States: Pending -> Assigned (an ambulance is claimed) -> En Route (the
+    patient is moved to In Transit; waits for the delivery report) ->
+    Delivered (the patient is Transferred and the ambulance freed). Requests
+    that keep failing end up Failed.
+    """
+
+    STATES = ('Pending', 'Assigned', 'En Route', 'Delivered', 'Failed')
+    CLAIM_COLUMNS = AMBULANCE_REQUEST_COLUMNS + ('pickup_lat', 'pickup_lon', 'attempts', 'claim_token')
+
+    def __init__(self, pool, fleet, visibility_timeout=30, max_attempts=5, poll_seconds=1.0,
+                 no_ambulance_retry_seconds=15):
+        self.pool = pool
+        self.fleet = fleet
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.no_ambulance_retry_seconds = no_ambulance_retry_seconds
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._workers = []
+        self._handlers = {'Pending': self._assign, 'Assigned': self._depart, 'En Route': self._deliver}
+
+    @contextmanager
+    def _transaction(self):
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def enqueue(self, ambulance_request, pickup_point=None):
+        """Store a new Pending request and wake a worker; returns immediately.
+
+        Raises DuplicateIdError if the request_id is already taken.
+        """
+        now = time.time()
+        lat, lon = pickup_point or (None, None)
+        with self.pool.connection() as conn:
+            try:
+                conn.execute("""
+                    INSERT INTO ambulance_requests
+                        (request_id, patient_id, requested_by, pickup_location, drop_location, status,
+                         created_at, pickup_lat, pickup_lon, available_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, 'Pending', ?, ?, ?, ?, ?)
+                """, (
+                    ambulance_request['request_id'],
+                    ambulance_request['patient_id'],
+                    ambulance_request['requested_by'],
+                    ambulance_request['pickup_location'],
+                    ambulance_request['drop_location'],
+                    ambulance_request['created_at'],
+                    lat, lon, now, now
+                ))
+            except sqlite3.IntegrityError as e:
+                raise DuplicateIdError(f"Ambulance request {ambulance_request['request_id']} already exists") from e
+            conn.commit()
+        self._wakeup.set()
+
+    def report_delivered(self, request_id):
+        """Make an En Route request due so a worker completes the delivery"""
+        with self.pool.connection() as conn:
+            changed = conn.execute("""
+                UPDATE ambulance_requests SET available_at = ?, updated_at = ?
+                WHERE request_id = ? AND status = 'En Route' AND available_at IS NULL
+            """, (time.time(), time.time(), request_id)).rowcount
+            conn.commit()
+        if changed:
+            self._wakeup.set()
+        return changed > 0
+
+    def claim(self):
+        """Lease the next due request; returns it as a dict, or None"""
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._transaction() as conn:
+            row = conn.execute("""
+                SELECT request_id FROM ambulance_requests
+                WHERE available_at IS NOT NULL AND available_at <= ?
+                ORDER BY available_at LIMIT 1
+            """, (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("""
+                UPDATE ambulance_requests
+                SET claim_token = ?, available_at = ?, attempts = attempts + 1, updated_at = ?
+                WHERE request_id = ?
+            """, (token, now + self.visibility_timeout, now, row[0]))
+            job = conn.execute(f"SELECT {', '.join(self.CLAIM_COLUMNS)} FROM ambulance_requests WHERE request_id = ?",
+                               (row[0],)).fetchone()
+        job = dict(zip(self.CLAIM_COLUMNS, job))
+        job['driver_details'] = json.loads(job['driver_details']) if job['driver_details'] else None
+        return job
+
+    @staticmethod
+    def _advance(conn, job, status, available_at=None, driver_details=None):
+        """Record the next state if the claim is still ours; False if the lease was lost"""
+        return conn.execute("""
+            UPDATE ambulance_requests
+            SET status = ?, available_at = ?, attempts = 0, claim_token = NULL, last_error = NULL,
+                driver_details = COALESCE(?, driver_details), updated_at = ?
+            WHERE request_id = ? AND claim_token = ?
+        """, (status, available_at, json.dumps(driver_details) if driver_details else None,
+              time.time(), job['request_id'], job['claim_token'])).rowcount > 0
+
+    def _retry(self, job, error, delay=None, count_attempt=True):
+        """Release the claim so the request is retried, or fail it once attempts run out"""
+        attempts = job['attempts'] if count_attempt else job['attempts'] - 1
+        with self._transaction() as conn:
+            if attempts >= self.max_attempts:
+                failed = conn.execute("""
+                    UPDATE ambulance_requests
+                    SET status = 'Failed', available_at = NULL, claim_token = NULL, last_error = ?, updated_at = ?
+                    WHERE request_id = ? AND claim_token = ?
+                """, (error, time.time(), job['request_id'], job['claim_token'])).rowcount
+                if failed and job['driver_details']:
+                    self.fleet.release(conn, job['driver_details']['ambulance_id'])
+                logger.error("Ambulance request %s failed after %s attempts: %s", job['request_id'], attempts, error)
+                return
+            if delay is None:
+                delay = min(2 ** attempts, 60)
+            conn.execute("""
+                UPDATE ambulance_requests
+                SET available_at = ?, attempts = ?, claim_token = NULL, last_error = ?, updated_at = ?
+                WHERE request_id = ? AND claim_token = ?
+            """, (time.time() + delay, attempts, error, time.time(), job['request_id'], job['claim_token']))
+
+    def _assign(self, job):
+        if job['pickup_lat'] is not None:
+            candidates = self.fleet.nearest(job['pickup_lat'], job['pickup_lon'])
+        else:
+            candidates = self.fleet.available()
+        for vehicle in candidates:
+            with self._transaction() as conn:
+                if not self.fleet.claim(conn, vehicle['ambulance_id']):
+                    continue
+                driver_details = {
+                    'ambulance_id': vehicle['ambulance_id'],
+                    'name': vehicle['driver_name'],
+                    'contact': vehicle['driver_contact']
+                }
+                # Claim the ambulance and record it in one transaction, so a
+                # lost lease never leaves a vehicle dispatched to nobody
+                if not self._advance(conn, job, 'Assigned', time.time(), driver_details):
+                    conn.rollback()
+                    return False
+            self.fleet.refresh(force=True)
+            return True
+        raise NoAmbulanceAvailable("No free ambulance")
+
+    def _move_patient(self, job, new_status, done_statuses, attempts=3):
+        """Move the job's patient to ``new_status`` unless already in one of ``done_statuses``"""
+        collection = get_clinic_collection(job['requested_by'])
+        for _ in range(attempts):
+            patient = collection.find_one({'patient_id': job['patient_id']}, PATIENT_STATUS_PROJECTION)
+            # Skip the move if an earlier attempt already made it
+            if not patient or patient.get('current_status') in done_statuses:
+                return
+            if transition_patient_status(collection, patient, new_status):
+                return
+        logger.warning("Patient %s kept changing status; left it for request %s",
+                       job['patient_id'], job['request_id'])
+
+    def _depart(self, job):
+        self._move_patient(job, 'In Transit', ('In Transit', 'Transferred'))
+        with self._transaction() as conn:
+            return self._advance(conn, job, 'En Route')
+
+    def _deliver(self, job):
+        self._move_patient(job, 'Transferred', ('Transferred',))
+        with self._transaction() as conn:
+            if not self._advance(conn, job, 'Delivered'):
+                conn.rollback()
+                return False
+            if job['driver_details']:
+                self.fleet.release(conn, job['driver_details']['ambulance_id'])
+        self.fleet.refresh(force=True)
+        return True
+
+    def process_one(self):
+        """Claim and run one due request; returns False when nothing was due"""
+        job = self.claim()
+        if job is None:
+            return False
+        handler = self._handlers.get(job['status'])
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for status {job['status']}")
+            if handler(job):
+                self._publish(job['request_id'])
+            else:
+                logger.warning("Lost the claim on ambulance request %s", job['request_id'])
+        except NoAmbulanceAvailable as e:
+            self._retry(job, str(e), delay=self.no_ambulance_retry_seconds, count_attempt=False)
+        except Exception as e:
+            logger.error("Error processing ambulance request %s: %s", job['request_id'], e)
+            self._retry(job, str(e))
+        return True
+
+    def _publish(self, request_id):
+        with self.pool.connection() as conn:
+            row = conn.execute(f"SELECT {', '.join(AMBULANCE_REQUEST_COLUMNS)} FROM ambulance_requests WHERE request_id = ?",
+                               (request_id,)).fetchone()
+        if row:
+            ambulance_request = ambulance_request_from_row(row)
+            event_broker.publish('ambulance_request', ambulance_request, clinic_id=ambulance_request['requested_by'])
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if self.process_one():
+                    continue
+            except Exception as e:
+                logger.error("Dispatch worker error: %s", e)
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+
+    def start(self, workers):
+        for number in range(workers):
+            worker = threading.Thread(target=self._run, name=f'dispatch-worker-{number}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+dispatch_queue = DispatchQueue(sqlite_pool, ambulance_fleet,
+                               visibility_timeout=app.config['DISPATCH_VISIBILITY_TIMEOUT'],
+                               max_attempts=app.config['DISPATCH_MAX_ATTEMPTS'],
+                               poll_seconds=app.config['DISPATCH_POLL_SECONDS'],
+                               no_ambulance_retry_seconds=app.config['DISPATCH_NO_AMBULANCE_RETRY_SECONDS'])
+
 @app.route('/patient/<patient_id>/request-ambulance', methods=['POST'])
 @login_required
 @role_required(['nursing_home', 'admin'])
 def request_ambulance(patient_id):
-    # Find the patient in the session
-    patients = session.get('patients', [])
-    patient = next((p for p in patients if p['patient_id'] == patient_id), None)
+    clinic_id = session.get('entity_id')
+    
+    # Find the patient in the clinic's collection
+    try:
+        clinic_collection = get_clinic_collection(clinic_id)
+        patient = clinic_collection.find_one({'patient_id': patient_id}, PATIENT_STATUS_PROJECTION)
+    except Exception as e:
+        logger.error("Error looking up patient for ambulance request: %s", e)
+        return jsonify({"status": "error", "message": "Database error"}), 500
     
     if not patient:
         return jsonify({"status": "error", "message": "Patient not found"}), 404
     
     # Check if user has permission to request ambulance for this patient
-    if session['user']['role'] == 'nursing_home' and patient.get('referred_by') != session['user']['entity_id']:
+    if session.get('role') == 'nursing_home' and patient.get('referred_by') != clinic_id:
         return jsonify({"status": "error", "message": "You do not have permission to request ambulance for this patient"}), 403
     
     # Get the request data
-    data = request.json
+    data = request.get_json(silent=True) or {}
     pickup_location = data.get('pickup_location')
     drop_location = data.get('drop_location')
     
     if not pickup_location or not drop_location:
         return jsonify({"status": "error", "message": "Missing required fields"}), 400
     
-    # Create a new ambulance request
+    try:
+        pickup_point = parse_coordinates(data, 'pickup_lat', 'pickup_lon')
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    # Queue the request; the dispatch workers assign an ambulance and move the patient
     ambulance_request = {
-        'request_id': str(uuid.uuid4())[:8],
         'patient_id': patient_id,
+        'requested_by': patient.get('referred_by'),
         'pickup_location': pickup_location,
         'drop_location': drop_location,
         'status': 'Pending',
         'created_at': datetime.now().isoformat()
     }
+    def enqueue():
+        ambulance_request['request_id'] = ids.new_id()
+        dispatch_queue.enqueue(ambulance_request, pickup_point)
+    try:
+        retry_duplicate_id(enqueue, DuplicateIdError)
+    except DuplicateIdError as e:
+        logger.error("Could not queue ambulance request for %s: %s", patient_id, e)
+        return jsonify({"status": "error", "message": "Could not queue the request, please retry"}), 503
+    event_broker.publish('ambulance_request', ambulance_request, clinic_id=ambulance_request['requested_by'])
+    
+    return jsonify({"status": "success", "message": "Ambulance requested successfully",
+                    "request": ambulance_request}), 202
+
+@app.route('/api/ambulance-requests/<request_id>/delivered', methods=['POST'])
+@login_required
+@role_required(['nursing_home', 'admin'])
+def report_ambulance_delivered(request_id):
+    """Report that an en-route ambulance has handed its patient over"""
+    with sqlite_pool.connection() as conn:
+        row = conn.execute("SELECT requested_by, status FROM ambulance_requests WHERE request_id = ?",
+                           (request_id,)).fetchone()
+    if not row:
+        return jsonify({"status": "error", "message": "Ambulance request not found"}), 404
+    if session.get('role') == 'nursing_home' and row[0] != session.get('entity_id'):
+        return jsonify({"status": "error", "message": "You do not have permission to update this request"}), 403
+    if not dispatch_queue.report_delivered(request_id):
+        return jsonify({"status": "error", "message": f"Request is {row[1]}, not En Route"}), 409
+    return jsonify({"status": "success", "message": "Delivery recorded"}), 202
+
+# Fields needed to move a patient between statuses
+PATIENT_STATUS_PROJECTION = {
+    '_id': 0,
+    'patient_id': 1,
+    'referred_by': 1,
+    'current_status': 1,
+    'assigned_hospital_id': 1,
+    'bed_reservation_id': 1
+}
+
+PATIENT_STATUSES = ['Pending', 'Awaiting Transfer', 'In Transit', 'Transferred', 'Discharged', 'Cancelled']
+# Statuses that occupy the reserved bed, and statuses that free it
+BED_COMMIT_STATUSES = {'In Transit', 'Transferred'}
+BED_RELEASE_STATUSES = {'Discharged', 'Cancelled'}
+
+def transition_patient_status(clinic_collection, patient, new_status):
+    """Move a patient from the status they were read with to ``new_status``.
+
+    The status is swapped with one conditional update, so of two concurrent
+    transitions from the same status only one applies (and counts towards
+    the rollups); returns False, changing nothing, for the one that lost.
+    The bed reservation is settled after the swap, and if that fails (e.g.
+    CapacityError when a lapsed reservation cannot be replaced) the status
+    is put back and the error re-raised.
+    """
+    old_status = patient.get('current_status')
+    claimed = clinic_collection.find_one_and_update(
+        {'patient_id': patient['patient_id'], 'current_status': old_status},
+        {'$set': {'current_status': new_status, 'updated_at': datetime.now().isoformat()}},
+        projection=PATIENT_STATUS_PROJECTION)
+    if claimed is None:
+        return False
+    reservation_id = claimed.get('bed_reservation_id')
+    hospital_id = claimed.get('assigned_hospital_id')
+    try:
+        if new_status in BED_COMMIT_STATUSES and hospital_id:
+            committed, counts = bed_ledger.commit(reservation_id) if reservation_id else (False, {})
+            sync_registry_with_ledger(counts)
+            if not committed:
+                reservation_id, counts = bed_ledger.reserve(hospital_id, patient['patient_id'])
+                sync_registry_with_ledger(counts)
+                bed_ledger.commit(reservation_id)
+        elif new_status in BED_RELEASE_STATUSES and reservation_id:
+            sync_registry_with_ledger(bed_ledger.release(reservation_id)[1])
+    except Exception:
+        clinic_collection.update_one({'patient_id': patient['patient_id'], 'current_status': new_status},
+                                     {'$set': {'current_status': old_status, 'updated_at': datetime.now().isoformat()}})
+        raise
+    if reservation_id != claimed.get('bed_reservation_id'):
+        clinic_collection.update_one({'patient_id': patient['patient_id']},
+                                     {'$set': {'bed_reservation_id': reservation_id,
+                                               'updated_at': datetime.now().isoformat()}})
+    analytics.status_changed(old_status, new_status, claimed.get('referred_by'))
+    patient_search.update_status(patient.get('referred_by'), patient['patient_id'], new_status)
+    event_broker.publish('patient_status', {
+        'patient_id': patient['patient_id'],
+        'current_status': new_status,
+        'assigned_hospital_id': hospital_id
+    }, clinic_id=patient.get('referred_by'))
+    return True
+
+@app.route('/patient/<patient_id>/status', methods=['POST'])
+@login_required
+@role_required(['nursing_home', 'admin'])
+def update_patient_status(patient_id):
+    clinic_id = session.get('entity_id')
+    data = request.get_json(silent=True) or {}
+    new_status = data.get('status')
+    
+    if new_status not in PATIENT_STATUSES:
+        return jsonify({"status": "error", "message": "Invalid status"}), 400
     
-    # Add the request to the session
-    ambulance_requests = session.get('ambulance_requests', [])
-    ambulance_requests.append(ambulance_request)
-    session['ambulance_requests'] = ambulance_requests
+    try:
+        clinic_collection = get_clinic_collection(clinic_id)
+        patient = clinic_collection.find_one({'patient_id': patient_id}, PATIENT_STATUS_PROJECTION)
+    except Exception as e:
+        logger.error("Error looking up patient for status change: %s", e)
+        return jsonify({"status": "error", "message": "Database error"}), 500
+    
+    if not patient:
+        return jsonify({"status": "error", "message": "Patient not found"}), 404
+    
+    if session.get('role') == 'nursing_home' and patient.get('referred_by') != clinic_id:
+        return jsonify({"status": "error", "message": "You do not have permission to update this patient"}), 403
+    
+    try:
+        moved = transition_patient_status(clinic_collection, patient, new_status)
+    except CapacityError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    if not moved:
+        return jsonify({"status": "error", "message": "Patient status changed meanwhile; reload and retry"}), 409
     
-    # Update the patient status
-    patient['current_status'] = 'In Transit'
-    session['patients'] = patients
+    return jsonify({"status": "success", "message": "Patient status updated"})
+
+def list_clinic_collections():
+    """Return the per-clinic patient collections that exist in MongoDB"""
+    return [mongo.db[name] for name in mongo.db.list_collection_names()
+            if name.startswith('clinic_') and name.endswith('_patients')]
+
+# Shared pool for querying every per-clinic collection at once
+fan_out_executor = ThreadPoolExecutor(max_workers=app.config['FAN_OUT_WORKERS'],
+                                      thread_name_prefix='clinic-fan-out')
+
+def fan_out_clinics(fn):
+    """Run ``fn(collection)`` against every per-clinic collection concurrently"""
+    return list(fan_out_executor.map(bind_request_metrics(fn), list_clinic_collections()))
+
+def find_patients_all_clinics(query=None, projection=None, limit=0):
+    """Find patients across all clinics, in whichever storage mode is active"""
+    query = query or {}
+    projection = projection or {'_id': 0}
+    if use_consolidated_patients():
+        return list(get_patients_collection().find(query, projection).limit(limit))
+    batches = fan_out_clinics(lambda collection: list(collection.find(query, projection).limit(limit)))
+    patients = [patient for batch in batches for patient in batch]
+    return patients[:limit] if limit else patients
+
+def iter_patients_all_clinics(projection=None, batch_size=1000):
+    """Lazily yield every patient across all clinics.
+
+    Per-clinic collections are read concurrently on the fan-out pool, one
+    batch per clinic at a time and at most FAN_OUT_WORKERS clinics in
+    flight, so memory stays bounded however many patients there are.
+    Patients from different clinics come out interleaved.
+    """
+    projection = projection or {'_id': 0}
+    if use_consolidated_patients():
+        yield from get_patients_collection().find({}, projection, batch_size=batch_size)
+        return
+    fetch = bind_request_metrics(lambda cursor: (cursor, list(itertools.islice(cursor, batch_size))))
+    pending = deque(list_clinic_collections())
+    in_flight = set()
+
+    def start_next_clinic():
+        cursor = pending.popleft().find({}, projection, batch_size=batch_size)
+        in_flight.add(fan_out_executor.submit(fetch, cursor))
+
+    try:
+        while pending and len(in_flight) < app.config['FAN_OUT_WORKERS']:
+            start_next_clinic()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.discard(future)
+                cursor, batch = future.result()
+                if len(batch) == batch_size:
+                    in_flight.add(fan_out_executor.submit(fetch, cursor))
+                elif pending:
+                    start_next_clinic()
+                yield from batch
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+SEARCH_TOKEN_RE = re.compile(r'[a-z0-9]+')
+SEARCH_PROJECTION = {'_id': 0, 'patient_id': 1, 'name': 1, 'contact_number': 1, 'medical_history': 1,
+                     'current_status': 1, 'assigned_hospital_id': 1, 'created_at': 1, 'updated_at': 1}
+
+def search_trigrams(token):
+    padded = f' {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class PatientSearchIndex:
+    """In-memory inverted index over one clinic's patients.
+
+    Name, patient ID and medical-history words are indexed as tokens, and the
+    phone number as its digits. A sorted vocabulary answers prefix queries, a
+    trigram -> tokens map answers substring queries (partial phone numbers),
+    and each word's single-character deletions answer typo queries within one
+    edit, transpositions included, without scanning the patients themselves.
+    """
+
+    FUZZY_MIN_LENGTH = 4
+
+    def __init__(self):
+        self.docs = {}
+        self.watermark = None
+        self.synced_at = 0.0
+        self.lock = threading.RLock()
+        self.sync_lock = threading.Lock()
+        self._doc_tokens = {}
+        self._created = {}
+        self._postings = {}
+        self._trigrams = defaultdict(set)
+        self._deletions = defaultdict(set)
+        self._vocabulary = []
+
+    def _fuzzy_keys(self, token):
+        if len(token) < self.FUZZY_MIN_LENGTH - 1 or token.isdigit():
+            return set()
+        return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+    @staticmethod
+    def tokenize(patient):
+        text = ' '.join([patient.get('name') or '', patient.get('patient_id') or '',
+                         ' '.join(patient.get('medical_history') or [])])
+        tokens = set(SEARCH_TOKEN_RE.findall(text.lower()))
+        digits = ''.join(ch for ch in str(patient.get('contact_number') or '') if ch.isdigit())
+        if digits:
+            tokens.add(digits)
+        return tokens
+
+    def add(self, patient):
+        with self.lock:
+            patient_id = patient['patient_id']
+            self.remove(patient_id)
+            tokens = self.tokenize(patient)
+            self.docs[patient_id] = {field: patient.get(field) for field in SEARCH_PROJECTION if field != '_id'}
+            self._doc_tokens[patient_id] = tokens
+            self._created[patient_id] = patient.get('created_at') or ''
+            for token in tokens:
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = set()
+                    bisect.insort(self._vocabulary, token)
+                    for gram in search_trigrams(token):
+                        self._trigrams[gram].add(token)
+                    for key in self._fuzzy_keys(token):
+                        self._deletions[key].add(token)
+                postings.add(patient_id)
+
+    def remove(self, patient_id):
+        with self.lock:
+            tokens = self._doc_tokens.pop(patient_id, None)
+            if tokens is None:
+                return
+            del self.docs[patient_id]
+            del self._created[patient_id]
+            for token in tokens:
+                postings = self._postings[token]
+                postings.discard(patient_id)
+                if postings:
+                    continue
+                del self._postings[token]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+                for index, keys in ((self._trigrams, search_trigrams(token)),
+                                    (self._deletions, self._fuzzy_keys(token))):
+                    for key in keys:
+                        tokens = index[key]
+                        tokens.discard(token)
+                        if not tokens:
+                            del index[key]
+
+    def update_status(self, patient_id, status):
+        with self.lock:
+            if patient_id in self.docs:
+                self.docs[patient_id]['current_status'] = status
+
+    def _match_term(self, term):
+        """Score every patient matching one query term: exact > prefix > substring > fuzzy"""
+        matches = {}
+        if term in self._postings:
+            matches[term] = 3.0
+        start = bisect.bisect_left(self._vocabulary, term)
+        for token in itertools.islice(self._vocabulary, start, None):
+            if not token.startswith(term):
+                break
+            matches.setdefault(token, 2.0)
+        if len(term) >= 3:
+            grams = sorted((self._trigrams.get(term[i:i + 3], set()) for i in range(len(term) - 2)), key=len)
+            for token in set.intersection(*grams) if grams[0] else ():
+                if term in token:
+                    matches.setdefault(token, 1.5)
+        if len(term) >= self.FUZZY_MIN_LENGTH and not term.isdigit():
+            # One insertion, deletion, substitution or transposition away
+            fuzzy = set(self._deletions.get(term, ()))
+            for key in self._fuzzy_keys(term):
+                if key in self._postings:
+                    fuzzy.add(key)
+                fuzzy.update(self._deletions.get(key, ()))
+            for token in fuzzy:
+                matches.setdefault(token, 1.0)
+        # Apply the weakest matches first so a patient keeps its best score
+        scores = {}
+        for token, score in sorted(matches.items(), key=lambda item: item[1]):
+            scores.update(dict.fromkeys(self._postings[token], score))
+        return scores
+
+    def search(self, query, status=None, limit=20):
+        """Return the best ``limit`` patients matching every term of ``query``"""
+        terms = SEARCH_TOKEN_RE.findall(query.lower())
+        if not terms:
+            return []
+        with self.lock:
+            per_term = sorted((self._match_term(term) for term in terms), key=len)
+            totals = per_term[0]
+            for scores in per_term[1:]:
+                totals = {pid: score + scores[pid] for pid, score in totals.items() if pid in scores}
+            docs = self.docs
+            if status:
+                totals = {pid: score for pid, score in totals.items()
+                          if docs[pid].get('current_status') == status}
+            # Highest score first, newest patient first among equal scores
+            best = heapq.nlargest(limit, zip(totals.values(), map(self._created.__getitem__, totals), totals))
+            return [dict(docs[pid], score=round(score, 3)) for score, _, pid in best]
+
+class PatientSearch:
+    """Per-clinic search indexes, built from MongoDB in the background at startup.
+
+    Writes made by this process are applied as they happen; before a search
+    the index also re-reads patients created or updated since its watermark
+    (at most every ``refresh_seconds``), which covers imports and other
+    workers' edits and status changes. The watermark is read back by
+    ``SYNC_OVERLAP`` so writes stamped just before a sync but committed after
+    it are not missed.
+    """
+
+    SYNC_OVERLAP = timedelta(seconds=5)
+
+    def __init__(self, refresh_seconds=1.0):
+        self.refresh_seconds = refresh_seconds
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def index_for(self, clinic_id):
+        with self._lock:
+            index = self._indexes.get(clinic_id)
+            if index is None:
+                index = self._indexes[clinic_id] = PatientSearchIndex()
+        if time.monotonic() - index.synced_at >= self.refresh_seconds:
+            with index.sync_lock:
+                if time.monotonic() - index.synced_at >= self.refresh_seconds:
+                    self._catch_up(clinic_id, index)
+        return index
+
+    def _catch_up(self, clinic_id, index):
+        query = {}
+        if index.watermark:
+            since = (datetime.fromisoformat(index.watermark) - self.SYNC_OVERLAP).isoformat()
+            # Patients written without an updated_at are still found by created_at
+            query = {'$or': [{'updated_at': {'$gte': since}}, {'created_at': {'$gte': since}}]}
+        synced_at = time.monotonic()
+        watermark = index.watermark
+        for patient in get_clinic_collection(clinic_id).find(query, SEARCH_PROJECTION, batch_size=1000):
+            index.add(patient)
+            changed_at = max(patient.get('updated_at') or '', patient.get('created_at') or '')
+            if watermark is None or changed_at > watermark:
+                watermark = changed_at
+        index.watermark = watermark
+        index.synced_at = synced_at
+
+    def warm_up(self, clinic_ids):
+        """Build the indexes of ``clinic_ids`` so no search has to wait for one"""
+        for clinic_id in clinic_ids:
+            try:
+                self.index_for(clinic_id)
+            except Exception as e:
+                logger.error("Error building search index for clinic %s: %s", clinic_id, e)
+
+    def add(self, clinic_id, patient):
+        index = self._indexes.get(clinic_id)
+        if index is not None:
+            index.add(patient)
+
+    def update_status(self, clinic_id, patient_id, status):
+        index = self._indexes.get(clinic_id)
+        if index is not None:
+            index.update_status(patient_id, status)
+
+    def search(self, clinic_id, query, status=None, limit=20):
+        return self.index_for(clinic_id).search(query, status=status, limit=limit)
+
+patient_search = PatientSearch(refresh_seconds=app.config['SEARCH_REFRESH_SECONDS'])
+
+@app.route('/api/patients/search')
+@login_required
+@role_required(['nursing_home', 'admin'])
+def search_patients():
+    """Search a clinic's patients by partial name, phone number or condition"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"status": "error", "message": "Missing search query"}), 400
+    if session.get('role') == 'nursing_home':
+        clinic_id = session.get('entity_id')
+    else:
+        clinic_id = request.args.get('clinic_id')
+    if not clinic_id:
+        return jsonify({"status": "error", "message": "Missing clinic_id"}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid limit"}), 400
     
-    return jsonify({"status": "success", "message": "Ambulance requested successfully"})
+    started = time.perf_counter()
+    try:
+        results = patient_search.search(clinic_id, query, status=request.args.get('status') or None, limit=limit)
+    except Exception as e:
+        logger.error("Error searching patients: %s", e)
+        return jsonify({"status": "error", "message": "Database error"}), 500
+    for patient in results:
+        patient['hospital_name'] = hospital_registry.name_of(patient.get('assigned_hospital_id'))
+    return jsonify({"status": "success", "query": query, "results": results,
+                    "took_ms": round((time.perf_counter() - started) * 1000, 2)})
 
 @app.route('/api/patients')
 @login_required
 def get_patients():
     # Filter patients based on user role
-    if session['user']['role'] == 'nursing_home':
-        patients = [p for p in session.get('patients', []) 
-                   if p.get('referred_by') == session['user']['entity_id']]
+    try:
+        patients = iter_export_patients()
+    except Exception as e:
+        logger.error("Error fetching patients: %s", e)
+        return jsonify({"status": "error", "message": "Database error"}), 500
+    
+    return Response(stream_json_array(patients), mimetype='application/json')
+
+# Columns written by the export endpoints; the patient columns match what
+# /patients/import reads back
+PATIENT_EXPORT_FIELDS = ['patient_id', 'name', 'age', 'gender', 'contact_number', 'address',
+                         'medical_history', 'current_status', 'assigned_hospital_id',
+                         'referred_by', 'created_at']
+HOSPITAL_EXPORT_FIELDS = ['hospital_id', 'name', 'location', 'contact_number', 'total_beds',
+                          'available_beds', 'icu_total', 'icu_available', 'specialties',
+                          'ambulance_services', 'mental_health_support', 'financial_assistance']
+
+def iter_export_patients():
+    """Return a lazy iterator over the patients the current user may see.
+
+    The first patient is fetched before returning, so a database error is
+    raised here (where the route can still answer 500) rather than halfway
+    through a streamed response.
+    """
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+    if session.get('role') == 'nursing_home':
+        clinic_collection = get_clinic_collection(session.get('entity_id'))
+        patients = iter(clinic_collection.find({}, {'_id': 0}, batch_size=batch_size))
+    else:
+        patients = iter_patients_all_clinics(batch_size=batch_size)
+    for first in patients:
+        return itertools.chain([first], patients)
+    return iter(())
+
+def patient_export_row(patient):
+    row = {field: patient.get(field, '') for field in PATIENT_EXPORT_FIELDS}
+    row['medical_history'] = ', '.join(patient.get('medical_history') or [])
+    return row
+
+def hospital_export_row(hospital):
+    row = {field: hospital.get(field, '') for field in HOSPITAL_EXPORT_FIELDS}
+    row['icu_total'] = hospital['icu_beds']['total']
+    row['icu_available'] = hospital['icu_beds']['available']
+    row['specialties'] = ', '.join(hospital.get('specialties', []))
+    return row
+
+def stream_json_array(items):
+    """Serialize an iterable as a JSON array one element at a time"""
+    yield '['
+    first = True
+    for item in items:
+        yield ('' if first else ',') + json.dumps(item, default=str)
+        first = False
+    yield ']'
+
+def stream_ndjson(items):
+    for item in items:
+        yield json.dumps(item, default=str) + '\n'
+
+def stream_csv(rows, fields):
+    """Serialize dict rows as CSV, reusing one small buffer for every line"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def export_response(items, csv_row, fields, basename):
+    """Build a streamed CSV or NDJSON download, chosen by the ``format`` argument"""
+    fmt = request.args.get('format', 'csv')
+    if fmt == 'csv':
+        body, mimetype = stream_csv((csv_row(item) for item in items), fields), 'text/csv'
+    elif fmt == 'ndjson':
+        body, mimetype = stream_ndjson(items), 'application/x-ndjson'
+    else:
+        return jsonify({"status": "error", "message": "Format must be csv or ndjson"}), 400
+    filename = f"{basename}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/patients/export')
+@login_required
+@role_required(['nursing_home', 'admin'])
+def export_patients():
+    """Stream the clinic's patients (every clinic's, for admins) as CSV or NDJSON"""
+    try:
+        patients = iter_export_patients()
+    except Exception as e:
+        logger.error("Error exporting patients: %s", e)
+        flash('Database connection error. Please try again later.', 'error')
+        return redirect(url_for('home'))
+    return export_response(patients, patient_export_row, PATIENT_EXPORT_FIELDS, 'patients')
+
+@app.route('/hospitals/export')
+@login_required
+def export_hospitals():
+    """Stream the hospital registry as CSV or NDJSON"""
+    hospitals = list(hospital_registry.all())
+    return export_response(hospitals, hospital_export_row, HOSPITAL_EXPORT_FIELDS, 'hospitals')
+
+def is_truthy(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+@app.route('/api/recommend-hospitals')
+@login_required
+def recommend_hospitals():
+    """Rank hospitals for a patient's medical history and care needs"""
+    medical_history = request.args.get('medical_history', '')
+    patient_id = request.args.get('patient_id')
+    if patient_id:
+        try:
+            patient = get_clinic_collection(session.get('entity_id')).find_one(
+                {'patient_id': patient_id}, {'_id': 0, 'medical_history': 1})
+        except Exception as e:
+            logger.error("Error looking up patient for recommendations: %s", e)
+            return jsonify({"status": "error", "message": "Database error"}), 500
+        if not patient:
+            return jsonify({"status": "error", "message": "Patient not found"}), 404
+        conditions = patient.get('medical_history', [])
     else:
-        patients = session.get('patients', [])
+        conditions = [c.strip() for c in medical_history.split(',') if c.strip()]
     
-    return jsonify(patients)
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 100))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid limit"}), 400
+    
+    return jsonify(hospital_recommender.recommend(
+        conditions,
+        needs_icu=is_truthy(request.args.get('needs_icu')),
+        needs_ambulance=is_truthy(request.args.get('needs_ambulance')),
+        needs_mental_health=is_truthy(request.args.get('needs_mental_health')),
+        limit=limit))
+
+@app.route('/stream')
+@login_required
+def stream():
+    """Server-Sent Events feed of patient, ambulance and bed updates for this clinic"""
+    subscriber = event_broker.subscribe(session.get('entity_id'))
+    heartbeat = app.config['SSE_HEARTBEAT_SECONDS']
+    
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                if subscriber.overflowed:
+                    # The client fell behind; have it reload instead of replaying
+                    yield "event: resync\ndata: {}\n\n"
+                    return
+                try:
+                    event_id, event, data = subscriber.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+        finally:
+            event_broker.unsubscribe(subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/ambulances', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def register_ambulance():
+    """Add an ambulance to the fleet"""
+    data = request.get_json(silent=True) or {}
+    try:
+        point = parse_coordinates(data)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if not data.get('name') or not point:
+        return jsonify({"status": "error", "message": "Missing required fields"}), 400
+    
+    vehicle = ambulance_fleet.register(
+        data['name'], *point,
+        hospital_id=data.get('hospital_id'),
+        driver_name=data.get('driver_name'),
+        driver_contact=data.get('driver_contact'))
+    return jsonify({"status": "success", "ambulance": vehicle}), 201
+
+@app.route('/api/ambulances/<ambulance_id>/position', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def report_ambulance_position(ambulance_id):
+    """Record a vehicle's current position (and optionally its status)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        point = parse_coordinates(data)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if not point:
+        return jsonify({"status": "error", "message": "Missing coordinates"}), 400
+    if data.get('status') not in (None, 'available', 'dispatched', 'offline'):
+        return jsonify({"status": "error", "message": "Invalid status"}), 400
+    
+    vehicle = ambulance_fleet.report_position(ambulance_id, *point, status=data.get('status'))
+    if not vehicle:
+        return jsonify({"status": "error", "message": "Ambulance not found"}), 404
+    return jsonify({"status": "success", "ambulance": vehicle})
+
+@app.route('/api/ambulances/nearest')
+@login_required
+def nearest_ambulances():
+    """List the free ambulances closest to a point"""
+    try:
+        point = parse_coordinates(request.args)
+        k = max(1, min(int(request.args.get('k', 5)), 50))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if not point:
+        return jsonify({"status": "error", "message": "Missing coordinates"}), 400
+    return jsonify(ambulance_fleet.nearest(*point, k=k))
 
 @app.route('/api/hospitals')
 @login_required
 def get_hospitals():
-    return jsonify(healthcare_data['multispeciality_hospitals'])
+    specialty = request.args.get('specialty', '').strip()
+    location = request.args.get('location', '').strip()
+    if specialty or location:
+        # Filtered lists come straight off the registry's secondary indexes
+        if specialty:
+            hospitals = hospital_registry.by_specialty(specialty)
+            if location:
+                hospitals = [h for h in hospitals if hospital_registry.is_at(h, location)]
+        else:
+            hospitals = hospital_registry.by_location(location)
+        return jsonify(hospitals)
+    # The registry version also moves when ledger syncs change bed counts
+    return response_cache.json_response('hospitals', hospital_registry.all,
+                                        version=hospital_registry.version)
 
 @app.route('/api/ambulance-requests')
 @login_required
 def get_ambulance_requests():
     # Filter ambulance requests based on user role
-    if session['user']['role'] == 'nursing_home':
-        requests = [r for r in session.get('ambulance_requests', []) 
-                   if r.get('requested_by') == session['user']['entity_id']]
-    else:
-        requests = session.get('ambulance_requests', [])
-    
-    return jsonify(requests)
+    clinic_id = session.get('entity_id') if session.get('role') == 'nursing_home' else None
+    return jsonify(list_ambulance_requests(clinic_id))
+
+def list_ambulance_requests(clinic_id=None):
+    """Ambulance requests newest first, optionally limited to one clinic"""
+    with sqlite_pool.connection() as conn:
+        if clinic_id:
+            rows = conn.execute("""
+                SELECT request_id, patient_id, requested_by, pickup_location, drop_location,
+                       status, driver_details, created_at
+                FROM ambulance_requests
+                WHERE requested_by = ?
+                ORDER BY created_at DESC
+            """, (clinic_id,)).fetchall()
+        else:
+            rows = conn.execute("""
+                SELECT request_id, patient_id, requested_by, pickup_location, drop_location,
+                       status, driver_details, created_at
+                FROM ambulance_requests
+                ORDER BY created_at DESC
+            """).fetchall()
+    return [ambulance_request_from_row(row) for row in rows]
 
 @app.route('/api/pros')
 @login_required
 def get_pros():
-    return jsonify(healthcare_data.get('pros', []))
+    return response_cache.json_response('pros', lambda: healthcare_data.get('pros', []))
 
 @app.route('/patient/<patient_id>/assign-pro', methods=['POST'])
 @login_required
 @role_required(['nursing_home', 'admin'])
 def assign_pro(patient_id):
-    # Find the patient in the session
-    patients = session.get('patients', [])
-    patient = next((p for p in patients if p['patient_id'] == patient_id), None)
+    clinic_id = session.get('entity_id')
+    
+    # Find the patient in the clinic's collection
+    try:
+        clinic_collection = get_clinic_collection(clinic_id)
+        patient = clinic_collection.find_one({'patient_id': patient_id},
+                                             {'_id': 0, 'patient_id': 1, 'referred_by': 1})
+    except Exception as e:
+        logger.error("Error looking up patient for PRO assignment: %s", e)
+        return jsonify({"status": "error", "message": "Database error"}), 500
     
     if not patient:
         return jsonify({"status": "error", "message": "Patient not found"}), 404
     
     # Check if user has permission to assign PRO for this patient
-    if session['user']['role'] == 'nursing_home' and patient.get('referred_by') != session['user']['entity_id']:
+    if session.get('role') == 'nursing_home' and patient.get('referred_by') != clinic_id:
         return jsonify({"status": "error", "message": "You do not have permission to assign PRO for this patient"}), 403
     
     # Get the request data
-    data = request.json
+    data = request.get_json(silent=True) or {}
     pro_id = data.get('pro_id')
     
     if not pro_id:
@@ -633,15 +4603,19 @@ def assign_pro(patient_id):
         return jsonify({"status": "error", "message": "PRO not found"}), 404
     
     # Update the patient with the assigned PRO
-    patient['assigned_pro_id'] = pro_id
-    session['patients'] = patients
+    clinic_collection.update_one({'patient_id': patient_id}, {'$set': {'assigned_pro_id': pro_id,
+                                                                          'updated_at': datetime.now().isoformat()}})
     
     # Update the PRO's assigned patients
-    if 'patients_assigned' not in pro:
-        pro['patients_assigned'] = []
-    
-    if patient_id not in pro['patients_assigned']:
-        pro['patients_assigned'].append(patient_id)
+    with data_journal.lock:
+        if 'patients_assigned' not in pro:
+            pro['patients_assigned'] = []
+        
+        if patient_id not in pro['patients_assigned']:
+            pro['patients_assigned'].append(patient_id)
+            data_journal.upsert('pros', 'pro_id', pro)
+            response_cache.bump('pros')
+            analytics.pro_assigned(pro_id)
     
     return jsonify({"status": "success", "message": "PRO assigned successfully"})
 
@@ -650,7 +4624,7 @@ def assign_pro(patient_id):
 @role_required(['admin'])
 def add_hospital():
     # Log user session info for debugging
-    logger.info(f"User attempting to add hospital - User ID: {session.get('user_id')}, Role: {session.get('role')}")
+    logger.info("User attempting to add hospital - User ID: %s, Role: %s", session.get('user_id'), session.get('role'))
     
     if request.method == 'POST':
         try:
@@ -679,12 +4653,8 @@ def add_hospital():
                     raise ValueError("Invalid number format for bed counts")
                 raise e
             
-            # Generate a unique hospital ID
-            hospital_id = f"H{str(uuid.uuid4())[:8].upper()}"
-            
-            # Create new hospital record
+            # Create new hospital record; the ID is assigned when it is stored
             new_hospital = {
-                "hospital_id": hospital_id,
                 "name": request.form.get('name').strip(),
                 "location": request.form.get('location').strip(),
                 "contact_number": request.form.get('contact_number').strip(),
@@ -704,74 +4674,147 @@ def add_hospital():
             if not new_hospital['specialties']:
                 raise ValueError("At least one specialty is required")
             
-            # Add to healthcare data
-            healthcare_data['multispeciality_hospitals'].append(new_hospital)
-            
-            # Save to file
-            if save_healthcare_data():
-                flash('Hospital added successfully!', 'success')
-                logger.info(f"Successfully added hospital: {new_hospital['name']} ({hospital_id})")
-            else:
-                # Remove the hospital from memory if save failed
-                healthcare_data['multispeciality_hospitals'].remove(new_hospital)
-                flash('Error saving hospital data. Please try again.', 'error')
-                logger.error(f"Failed to save hospital data for: {new_hospital['name']}")
+            # Store the hospital (written through to SQLite) under a fresh time-ordered ID
+            def store():
+                new_hospital['hospital_id'] = new_hospital_id()
+                return hospital_registry.add(new_hospital)
+            retry_duplicate_id(store, DuplicateIdError)
+            hospital_id = new_hospital['hospital_id']
+            fragment_cache.invalidate()
+            sync_registry_with_ledger(bed_ledger.set_capacity(hospital_id, total_beds, available_beds,
+                                                              icu_total, icu_available))
+            publish_bed_availability(new_hospital)
+            flash('Hospital added successfully!', 'success')
+            logger.info("Successfully added hospital: %s (%s)", new_hospital['name'], hospital_id)
             
             return redirect(url_for('list_hospitals'))
             
         except ValueError as e:
             flash(f'Validation error: {str(e)}', 'error')
-            logger.warning(f"Hospital addition validation error: {str(e)}")
+            logger.warning("Hospital addition validation error: %s", e)
             return redirect(url_for('add_hospital'))
         except Exception as e:
             flash('An error occurred while adding the hospital. Please try again.', 'error')
-            logger.error(f"Error adding hospital: {str(e)}")
+            logger.error("Error adding hospital: %s", e)
             return redirect(url_for('add_hospital'))
     
     return render_template('add_hospital.html')
 
+@app.route('/api/hospitals/<hospital_id>/referrals')
+@login_required
+@role_required(['admin'])
+def get_hospital_referrals(hospital_id):
+    """List the patients referred to a hospital by any clinic"""
+    query = {'assigned_hospital_id': hospital_id}
+    if request.args.get('status'):
+        query['current_status'] = request.args.get('status')
+    try:
+        patients = find_patients_all_clinics(query)
+    except Exception as e:
+        logger.error("Error fetching referrals for hospital %s: %s", hospital_id, e)
+        return jsonify({"status": "error", "message": "Database error"}), 500
+    return jsonify(patients)
+
+@app.route('/admin/indexes')
+@login_required
+@role_required(['admin'])
+def index_report():
+    """Report the indexes present on every patient collection"""
+    try:
+        return jsonify(index_provisioner.report())
+    except Exception as e:
+        logger.error("Error building index report: %s", e)
+        return jsonify({"status": "error", "message": "Database error"}), 500
+
+@app.route('/admin/cache-stats')
+@login_required
+@role_required(['admin'])
+def cache_stats():
+    """Report hit rates for the response and template fragment caches"""
+    return jsonify({'responses': response_cache.stats(), 'fragments': fragment_cache.stats()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text exposition of the request, database and template metrics.
+
+    The labels name routes and clinics, so scrapers need METRICS_TOKEN as a
+    bearer token (or an admin session) unless METRICS_PUBLIC is set.
+    """
+    token = app.config['METRICS_TOKEN']
+    authorization = request.headers.get('Authorization')
+    if authorization:
+        allowed = bool(token) and hmac.compare_digest(authorization, f'Bearer {token}')
+    else:
+        allowed = app.config['METRICS_PUBLIC'] or session.get('role') == 'admin'
+    if not allowed:
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/slow-requests')
+@login_required
+@role_required(['admin'])
+def slow_request_log():
+    """Most recent slow requests, newest first, with their time split by Mongo/SQLite/templates"""
+    return jsonify({'threshold_seconds': app.config['SLOW_REQUEST_SECONDS'],
+                    'overrides': app.config['SLOW_REQUEST_THRESHOLDS'],
+                    'requests': list(reversed(slow_requests))})
+
 @app.route('/hospitals')
 @login_required
 def list_hospitals():
     """View all hospitals with option to edit"""
     return render_template('hospitals.html', 
-                         hospitals=healthcare_data['multispeciality_hospitals'])
+                         hospitals=hospital_registry.all())
 
 @app.route('/hospital/<hospital_id>/edit', methods=['GET', 'POST'])
 @login_required
 @role_required(['admin'])
 def edit_hospital(hospital_id):
     """Edit an existing hospital"""
-    hospital = next((h for h in healthcare_data['multispeciality_hospitals'] 
-                    if h['hospital_id'] == hospital_id), None)
+    hospital = hospital_registry.get(hospital_id)
     
     if not hospital:
         flash('Hospital not found!', 'error')
         return redirect(url_for('list_hospitals'))
     
     if request.method == 'POST':
-        # Update hospital data
-        hospital.update({
-            "name": request.form.get('name'),
-            "location": request.form.get('location'),
-            "contact_number": request.form.get('contact_number'),
-            "total_beds": int(request.form.get('total_beds')),
-            "available_beds": int(request.form.get('available_beds')),
-            "icu_beds": {
-                "total": int(request.form.get('icu_total')),
-                "available": int(request.form.get('icu_available'))
-            },
-            "specialties": [s.strip() for s in request.form.get('specialties').split(',')],
-            "ambulance_services": 'ambulance_services' in request.form,
-            "mental_health_support": 'mental_health_support' in request.form,
-            "financial_assistance": 'financial_assistance' in request.form
-        })
+        # Update hospital data (written through to SQLite)
+        try:
+            loaded = None
+            if request.form.get('loaded_available_beds') and request.form.get('loaded_icu_available'):
+                loaded = (int(request.form['loaded_available_beds']), int(request.form['loaded_icu_available']))
+            hospital = hospital_registry.update(hospital_id, {
+                "name": request.form.get('name'),
+                "location": request.form.get('location'),
+                "contact_number": request.form.get('contact_number'),
+                "total_beds": int(request.form.get('total_beds')),
+                "available_beds": int(request.form.get('available_beds')),
+                "icu_beds": {
+                    "total": int(request.form.get('icu_total')),
+                    "available": int(request.form.get('icu_available'))
+                },
+                "specialties": [s.strip() for s in request.form.get('specialties').split(',')],
+                "ambulance_services": 'ambulance_services' in request.form,
+                "mental_health_support": 'mental_health_support' in request.form,
+                "financial_assistance": 'financial_assistance' in request.form
+            })
+        except Exception as e:
+            logger.error("Error updating hospital %s: %s", hospital_id, e)
+            flash('Error saving hospital data. Please try again.', 'error')
+            return redirect(url_for('list_hospitals'))
         
-        # Save changes
-        if save_healthcare_data():
+        fragment_cache.invalidate()
+        if hospital:
+            # The ledger owns availability; the registry takes whatever it settled on
+            sync_registry_with_ledger(bed_ledger.set_capacity(
+                hospital_id, hospital['total_beds'], hospital['available_beds'],
+                hospital['icu_beds']['total'], hospital['icu_beds']['available'], loaded=loaded))
+            # The sync swapped in a new dict if the ledger changed the counts
+            hospital = hospital_registry.get(hospital_id) or hospital
+            publish_bed_availability(hospital)
             flash('Hospital updated successfully!', 'success')
         else:
-            flash('Error saving hospital data. Please try again.', 'error')
+            flash('Hospital not found!', 'error')
         
         return redirect(url_for('list_hospitals'))
     
@@ -782,25 +4825,104 @@ def edit_hospital(hospital_id):
 @role_required(['admin'])
 def delete_hospital(hospital_id):
     """Delete an existing hospital"""
-    hospital = next((h for h in healthcare_data['multispeciality_hospitals'] 
-                    if h['hospital_id'] == hospital_id), None)
+    # Remove the hospital from SQLite and the registry
+    try:
+        hospital = hospital_registry.remove(hospital_id)
+    except Exception as e:
+        logger.error("Error deleting hospital %s: %s", hospital_id, e)
+        flash('Error deleting hospital. Please try again.', 'error')
+        return redirect(url_for('list_hospitals'))
     
     if not hospital:
         flash('Hospital not found!', 'error')
         return redirect(url_for('list_hospitals'))
-    
-    # Remove the hospital from the list
-    healthcare_data['multispeciality_hospitals'] = [h for h in healthcare_data['multispeciality_hospitals'] 
-                                                  if h['hospital_id'] != hospital_id]
-    
-    # Save changes
-    if save_healthcare_data():
-        flash('Hospital deleted successfully!', 'success')
-    else:
-        flash('Error deleting hospital. Please try again.', 'error')
+    fragment_cache.invalidate()
+    bed_ledger.remove(hospital_id)
+    flash('Hospital deleted successfully!', 'success')
     
     return redirect(url_for('list_hospitals'))
 
+# Fields the dashboard table actually renders
+DASHBOARD_PROJECTION = {
+    '_id': 0,
+    'patient_id': 1,
+    'name': 1,
+    'current_status': 1,
+    'assigned_hospital_id': 1,
+    'created_at': 1
+}
+
+def encode_page_cursor(patient):
+    """Encode the keyset position of a patient as an opaque URL-safe token.
+
+    Patients with time-ordered IDs carry their created_at inside the ID, so
+    the ID itself is the cursor; older patients get the full (created_at, id).
+    """
+    if patient.get('created_at') and ids.created_at(patient['patient_id']) == patient['created_at']:
+        return patient['patient_id']
+    raw = json.dumps([patient.get('created_at', ''), patient['patient_id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_page_cursor(token):
+    """Decode a page cursor into (created_at, patient_id), or None if invalid"""
+    if not token:
+        return None
+    created_at = ids.created_at(token)
+    if created_at:
+        return created_at, token
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, patient_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(created_at), str(patient_id)
+    except Exception:
+        logger.warning("Ignoring invalid page cursor: %r", token)
+        return None
+
+def get_page_size(value):
+    """Clamp a requested page size to the configured bounds"""
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        return app.config['DASHBOARD_PAGE_SIZE']
+    return max(1, min(page_size, app.config['DASHBOARD_MAX_PAGE_SIZE']))
+
+def fetch_patient_page(collection, filters, cursor, page_size):
+    """Fetch one page of patients, newest first, using keyset pagination.
+
+    Returns (patients, next_cursor) where next_cursor is None on the last page.
+    """
+    query = dict(filters)
+    if cursor:
+        created_at, patient_id = cursor
+        query['$or'] = [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, 'patient_id': {'$lt': patient_id}}
+        ]
+    patients = list(collection.find(query, DASHBOARD_PROJECTION)
+                    .sort([('created_at', DESCENDING), ('patient_id', DESCENDING)])
+                    .limit(page_size + 1))
+    next_cursor = None
+    if len(patients) > page_size:
+        patients = patients[:page_size]
+        next_cursor = encode_page_cursor(patients[-1])
+    return patients, next_cursor
+
+def count_patients_by_status(collection, filters, clinic_id=None):
+    """Count patients per current_status.
+
+    Unfiltered counts for a clinic come from the analytics rollups; anything
+    else (or a database whose rollups are not built yet) runs one aggregation.
+    """
+    if clinic_id and not filters:
+        counts = analytics.clinic_status_counts(clinic_id)
+        if counts is not None:
+            return counts
+    pipeline = [
+        {'$match': filters},
+        {'$group': {'_id': '$current_status', 'count': {'$sum': 1}}}
+    ]
+    return {row['_id']: row['count'] for row in collection.aggregate(pipeline)}
+
 @app.route('/nursing-home/dashboard')
 @login_required
 @role_required(['nursing_home'])
@@ -817,39 +4939,76 @@ def nursing_home_dashboard():
             clinic_collection = get_clinic_collection(nursing_home_id)
         except Exception as e:
             flash('Database connection error. Please try again later.', 'error')
-            logger.error(f"Database error in nursing_home_dashboard: {str(e)}")
+            logger.error("Database error in nursing_home_dashboard: %s", e)
             return redirect(url_for('nursing_home_login'))
         
-        # Get all patients for this clinic
-        patients = list(clinic_collection.find())
+        # Build filters from the query string
+        status_filter = request.args.get('status') or None
+        hospital_filter = request.args.get('hospital') or None
+        count_filters = {}
+        if hospital_filter:
+            count_filters['assigned_hospital_id'] = hospital_filter
+        filters = dict(count_filters)
+        if status_filter:
+            filters['current_status'] = status_filter
         
-        # Add hospital names to patient data
+        status_counts = count_patients_by_status(clinic_collection, count_filters, nursing_home_id)
+        
+        # Fetch a single page of patients
+        page_size = get_page_size(request.args.get('page_size'))
+        cursor = decode_page_cursor(request.args.get('after'))
+        patients, next_cursor = fetch_patient_page(clinic_collection, filters, cursor, page_size)
+        
+        # Add hospital names to the patients on this page only
         for patient in patients:
-            if patient.get('assigned_hospital_id'):
-                hospital = next((h for h in healthcare_data['multispeciality_hospitals'] 
-                               if h['hospital_id'] == patient['assigned_hospital_id']), None)
-                patient['hospital_name'] = hospital['name'] if hospital else 'Not Assigned'
-            else:
-                patient['hospital_name'] = 'Not Assigned'
+            patient['hospital_name'] = hospital_registry.name_of(patient.get('assigned_hospital_id'))
         
         return render_template('nursing_home_dashboard.html', 
                              nursing_home_name=session.get('nursing_home_name'),
                              patients=patients,
-                             hospitals=healthcare_data['multispeciality_hospitals'])
+                             hospitals=hospital_registry.all(),
+                             status_counts=status_counts,
+                             total_patients=sum(status_counts.values()),
+                             status_filter=status_filter,
+                             hospital_filter=hospital_filter,
+                             hospital_filter_name=hospital_registry.name_of(hospital_filter, hospital_filter),
+                             page_size=page_size,
+                             is_first_page=cursor is None,
+                             next_cursor=next_cursor)
                              
     except Exception as e:
         flash('An error occurred while fetching patient data.', 'error')
-        logger.error(f"Error in nursing_home_dashboard: {str(e)}")
+        logger.error("Error in nursing_home_dashboard: %s", e)
         return redirect(url_for('nursing_home_login'))
 
 @app.route('/admin/dashboard')
 @login_required
 @role_required(['admin'])
 def admin_dashboard():
+    """Network-wide totals, read from the analytics rollups rather than the patient collections"""
     return render_template('admin_dashboard.html',
-                         patients=session.get('patients', []),
-                         hospitals=healthcare_data['multispeciality_hospitals'],
-                         nursing_homes=healthcare_data['nursing_homes'])
+                         stats=analytics.summary(),
+                         hospital_name=hospital_registry.name_of,
+                         nursing_homes={home['clinic_id']: home['name'] for home in healthcare_data['nursing_homes']})
+
+@app.route('/api/stats')
+@login_required
+@role_required(['admin'])
+def get_stats():
+    """Analytics rollups as JSON"""
+    return jsonify(analytics.summary())
+
+@app.route('/admin/stats/rebuild', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def rebuild_stats():
+    """Recount the patient rollups from MongoDB"""
+    try:
+        analytics.rebuild_patients()
+    except Exception as e:
+        logger.error("Error rebuilding patient rollups: %s", e)
+        return jsonify({"status": "error", "message": "Database error"}), 500
+    return jsonify({"status": "success", "stats": analytics.summary()})
 
 @app.route('/signup', methods=['GET', 'POST'])
 def signup():
@@ -868,109 +5027,234 @@ def signup():
             flash('Passwords do not match.', 'error')
             return render_template('signup.html')
         
-        # Generate a unique clinic ID
-        clinic_id = f"CL{str(uuid.uuid4())[:8].upper()}"
-        
-        conn = sqlite3.connect('caresync.db')
+        conn = get_db()
         c = conn.cursor()
         
-        try:
-            # Insert nursing home into database
-            c.execute("""
-                INSERT INTO nursing_homes (clinic_id, name, location, contact_person, phone, email)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (clinic_id, name, location, contact_person, phone, email))
-            
-            # Create username and password
-            username = f"clinic_{clinic_id.lower()}"
-            
-            # Insert user credentials
-            c.execute("""
-                INSERT INTO users (username, password, role, entity_id)
-                VALUES (?, ?, ?, ?)
-            """, (username, hash_password(password), 'nursing_home', clinic_id))
-            
+        def register():
+            # Generate a unique, time-ordered clinic ID
+            clinic_id = new_clinic_id()
+            try:
+                # Insert nursing home into database
+                c.execute("""
+                    INSERT INTO nursing_homes (clinic_id, name, location, contact_person, phone, email)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (clinic_id, name, location, contact_person, phone, email))
+                
+                # Create username and password
+                username = f"clinic_{clinic_id.lower()}"
+                
+                # Insert user credentials
+                c.execute("""
+                    INSERT INTO users (username, password, role, entity_id)
+                    VALUES (?, ?, ?, ?)
+                """, (username, hash_password(password), 'nursing_home', clinic_id))
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                raise
             conn.commit()
+            return clinic_id
+        
+        try:
+            clinic_id = retry_duplicate_id(register, sqlite3.IntegrityError)
             flash(f'Registration successful! Your Clinic ID is: {clinic_id}. Please use this ID to login.', 'success')
             return redirect(url_for('nursing_home_login'))
             
         except sqlite3.IntegrityError:
             flash('An error occurred during registration. Please try again.', 'error')
             conn.rollback()
-        finally:
-            conn.close()
     
     return render_template('signup.html')
 
-def migrate_hospital_data():
-    """Migrate hospital data from JSON to database"""
+def _seed_hospitals(conn):
+    """Copy the hospitals from the JSON data into SQLite.
+
+    Until the hospital repository existed the JSON file was authoritative and
+    the hospitals table was only filled once, so the JSON copy wins.
+    """
+    for hospital in list(healthcare_data.get('multispeciality_hospitals', [])):
+        hospital_repository.save(hospital, conn)
+
+def seed_database():
+    """Create the schema and load every seed table in one transaction.
+
+    Each step only inserts what is missing, so running it again is a no-op.
+    """
+    with sqlite_pool.connection() as conn:
+        # The hospitals are imported from JSON once, when hospital_specialties is first created
+        import_hospitals = not _table_exists(conn, 'hospital_specialties')
+        _create_tables(conn)
+        with conn:
+            _seed_nursing_homes(conn)
+            if import_hospitals:
+                _seed_hospitals(conn)
+            _seed_ambulance_requests(conn)
+            bed_ledger.seed(hospital_repository.load_all(conn), conn)
+
+def provision_patient_indexes():
     try:
-        conn = sqlite3.connect('caresync.db')
-        c = conn.cursor()
-        
-        # Check if hospitals table is empty
-        c.execute('SELECT COUNT(*) FROM hospitals')
-        if c.fetchone()[0] == 0:
-            # Insert hospitals from healthcare_data
-            for hospital in healthcare_data['multispeciality_hospitals']:
-                c.execute('''
-                    INSERT INTO hospitals (
-                        hospital_id, name, location, contact_number,
-                        total_beds, available_beds, icu_total, icu_available,
-                        specialties, ambulance_services, mental_health_support,
-                        financial_assistance
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    hospital['hospital_id'],
-                    hospital['name'],
-                    hospital['location'],
-                    hospital['contact_number'],
-                    hospital['total_beds'],
-                    hospital['available_beds'],
-                    hospital['icu_beds']['total'],
-                    hospital['icu_beds']['available'],
-                    ','.join(hospital['specialties']),
-                    hospital['ambulance_services'],
-                    hospital['mental_health_support'],
-                    hospital['financial_assistance']
-                ))
-        
-        conn.commit()
-        conn.close()
-        return True
+        index_provisioner.provision_all()
     except Exception as e:
-        print(f"Error migrating hospital data: {e}")
-        return False
+        logger.error("Error provisioning patient indexes: %s", e)
+
+# Milliseconds spent in each startup step, in the order they ran
+startup_timings = OrderedDict()
+_startup_lock = threading.Lock()
+_initialized = False
 
-# Initialize database and migrate data
-init_db()
-migrate_hospital_data()
+@contextmanager
+def startup_step(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = round((time.perf_counter() - started) * 1000, 2)
+
+def initialize_app():
+    """Run the one-off startup work (seeding, cache warm-up) exactly once per process"""
+    global _initialized
+    if _initialized:
+        return
+    with _startup_lock:
+        if _initialized:
+            return
+        # Importing the module leaves the host's logging alone; the app
+        # takes over the root logger only once it actually starts
+        configure_logging()
+        with startup_step('load_healthcare_data'):
+            load_healthcare_data()
+        with startup_step('seed_database'):
+            seed_database()
+        with startup_step('load_hospitals'):
+            hospital_registry.load()
+        with startup_step('purge_expired_sessions'):
+            app.session_interface.purge_expired()
+        # Counting existing patients needs MongoDB, so it runs in the background
+        with startup_step('schedule_patient_rollups'):
+            threading.Thread(target=analytics.ensure_patient_rollups, daemon=True,
+                             name='patient-rollups').start()
+        with startup_step('load_ambulance_fleet'):
+            ambulance_fleet.refresh()
+        with startup_step('start_dispatch_workers'):
+            dispatch_queue.start(app.config['DISPATCH_WORKERS'])
+        # Provision patient indexes up front so the insert path never has to,
+        # without holding up startup on a slow or absent MongoDB
+        with startup_step('schedule_index_provisioning'):
+            threading.Thread(target=provision_patient_indexes, daemon=True,
+                             name='index-provisioning').start()
+        # A large clinic's search index takes seconds to build; do it before
+        # the first search rather than inside it
+        with startup_step('schedule_search_warm_up'):
+            clinic_ids = [home['clinic_id'] for home in healthcare_data['nursing_homes']]
+            threading.Thread(target=patient_search.warm_up, args=(clinic_ids,), daemon=True,
+                             name='search-warm-up').start()
+        _initialized = True
+    logger.info("Startup finished in %.1f ms", sum(startup_timings.values()),
+                extra={'startup_steps': dict(startup_timings)})
+
+def create_app():
+    """Application factory: initialize resources and return the app.
+
+    Serve with ``gunicorn 'app:create_app()'``; serving ``app:app`` directly
+    also works and initializes on the first request instead.
+    """
+    initialize_app()
+    return app
+
+def initialize_on_first_request(wsgi_app):
+    @wraps(wsgi_app)
+    def wrapper(environ, start_response):
+        if not _initialized:
+            initialize_app()
+        return wsgi_app(environ, start_response)
+    return wrapper
+
+app.wsgi_app = initialize_on_first_request(app.wsgi_app)
+
+@app.before_request
+def refresh_hospitals():
+    """Pick up hospital changes made by other worker processes"""
+    try:
+        hospital_registry.refresh()
+    except Exception as e:
+        logger.error("Error refreshing hospitals: %s", e)
+
+@app.route('/admin/startup')
+@login_required
+@role_required(['admin'])
+def startup_report():
+    """Report how long each startup step took in this process"""
+    return jsonify({'initialized': _initialized,
+                    'total_ms': round(sum(startup_timings.values()), 2),
+                    'steps': [{'step': name, 'ms': ms} for name, ms in startup_timings.items()]})
+
+def migrate_patients_to_consolidated(batch_size=1000, drop_source=False):
+    """Copy every per-clinic patient collection into the consolidated collection.
+
+    Documents are upserted on (referred_by, patient_id), so the migration can
+    be re-run safely. Returns the number of patients copied per collection.
+    """
+    target = get_patients_collection()
+    index_provisioner.ensure(target)
+    copied = {}
+    for collection in list_clinic_collections():
+        clinic_id = collection.name[len('clinic_'):-len('_patients')]
+        count = 0
+        batch = []
+        for patient in collection.find({}, {'_id': 0}):
+            patient.setdefault('referred_by', clinic_id)
+            batch.append(ReplaceOne({'referred_by': patient['referred_by'], 'patient_id': patient['patient_id']},
+                                    patient, upsert=True))
+            if len(batch) >= batch_size:
+                target.bulk_write(batch, ordered=False)
+                count += len(batch)
+                batch = []
+        if batch:
+            target.bulk_write(batch, ordered=False)
+            count += len(batch)
+        copied[collection.name] = count
+        if drop_source:
+            collection.drop()
+        logger.info("Migrated %s patients from %s", count, collection.name)
+    return copied
+
+@app.cli.command('migrate-patients')
+@click.option('--batch-size', default=1000, show_default=True, help='Documents per bulk write.')
+@click.option('--drop-source', is_flag=True, help='Drop each per-clinic collection once copied.')
+def migrate_patients_command(batch_size, drop_source):
+    """Move patients from per-clinic collections into one patients collection"""
+    copied = migrate_patients_to_consolidated(batch_size=batch_size, drop_source=drop_source)
+    for name, count in copied.items():
+        click.echo(f"{name}: {count} patients")
+    click.echo(f"Migrated {sum(copied.values())} patients from {len(copied)} clinics. "
+               "Set CARESYNC_PATIENT_STORAGE=consolidated to switch over.")
 
 @app.route('/test-db')
 def test_db():
     try:
-        if not mongo_client:
-            return jsonify({"status": "error", "message": "MongoDB client not initialized"})
-        
         # Test the connection
-        mongo_client.server_info()
+        mongo.client.server_info()
         
         # Try to access a collection
-        test_collection = db['test_collection']
+        test_collection = mongo.db['test_collection']
         test_collection.insert_one({"test": "connection"})
         test_collection.delete_one({"test": "connection"})
         
         return jsonify({
             "status": "success",
             "message": "MongoDB connection successful",
-            "collections": db.list_collection_names()
+            "collections": mongo.db.list_collection_names()
         })
     except Exception as e:
-        logger.error(f"Database test error: {str(e)}")
+        logger.error("Database test error: %s", e)
         return jsonify({
             "status": "error",
             "message": str(e)
         })
 
 if __name__ == '__main__':
+    # The debug reloader's parent process only watches files and restarts the
+    # server; only the child it spawns (WERKZEUG_RUN_MAIN) should start the
+    # dispatch workers and lease an ID node
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        initialize_app()
     app.run(debug=True)
\ No newline at end of file
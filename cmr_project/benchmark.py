@@ -0,0 +1,428 @@
+"""Route-level benchmarks for CareSync.
+
+Copies the project into a temporary directory (so the SQLite file and the
+JSON data are throwaway), fills it with a synthetic dataset of the requested
+size and drives the routes through Flask's test client, reporting throughput
+and p50/p95/p99 latency per route.
+
+MongoDB is replaced by mongomock unless ``--mongo-uri`` points at a real
+server; in that case a separate ``caresync_bench`` database is used and
+dropped first. mongomock keeps everything in memory, so use a real local
+server for datasets in the hundreds of thousands of patients.
+
+    python benchmark.py --patients 100000 --output baseline.json
+    python benchmark.py --patients 100000 --compare baseline.json
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+import click
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FIRST_NAMES = ['Aarav', 'Priya', 'Rajesh', 'Anita', 'Vikram', 'Lakshmi', 'Arjun', 'Meena', 'Suresh', 'Kavya',
+               'Ravi', 'Divya', 'Karthik', 'Nivedha', 'Sanjay', 'Deepa', 'Mohan', 'Revathi', 'Ashok', 'Geetha']
+LAST_NAMES = ['Kumar', 'Sharma', 'Iyer', 'Reddy', 'Nair', 'Menon', 'Rao', 'Pillai', 'Gupta', 'Singh',
+              'Patel', 'Das', 'Krishnan', 'Subramanian', 'Joshi']
+CITIES = [('Chennai', 13.08, 80.27), ('Bengaluru', 12.97, 77.59), ('Mysuru', 12.30, 76.64),
+          ('Coimbatore', 11.02, 76.96), ('Hyderabad', 17.39, 78.49), ('Kochi', 9.93, 76.27)]
+SPECIALTIES = ['Cardiology', 'Neurology', 'Orthopedics', 'Oncology', 'Pediatrics', 'Emergency',
+               'Nephrology', 'Pulmonology', 'Gastroenterology', 'Psychiatry']
+CONDITIONS = ['Diabetes', 'Hypertension', 'Asthma', 'Heart disease', 'Stroke', 'Fracture', 'Cancer',
+              'Kidney disease', 'COPD', 'Depression', 'Epilepsy', 'Arthritis']
+STATUSES = ['Pending', 'Pending', 'Pending', 'Awaiting Transfer', 'In Transit', 'Transferred', 'Discharged']
+
+def generate_hospitals(rng, count):
+    hospitals = []
+    for n in range(count):
+        city = rng.choice(CITIES)
+        total_beds = rng.randint(200, 2000)
+        icu_total = rng.randint(10, 100)
+        hospitals.append({
+            'hospital_id': f'BH{n:05d}',
+            'name': f'{rng.choice(LAST_NAMES)} Memorial Hospital {n}',
+            'location': f'{city[0]}, India',
+            'contact_number': f'+91-90{rng.randint(0, 99999999):08d}',
+            'specialties': rng.sample(SPECIALTIES, rng.randint(2, 5)),
+            # Enough free beds that the add_patient benchmark never runs out
+            'total_beds': total_beds * 100,
+            'available_beds': total_beds * 100 - rng.randint(0, total_beds),
+            'icu_beds': {'total': icu_total, 'available': rng.randint(0, icu_total)},
+            'ambulance_services': rng.random() < 0.7,
+            'mental_health_support': rng.random() < 0.3,
+            'financial_assistance': rng.random() < 0.4
+        })
+    return hospitals
+
+def generate_clinics(rng, count):
+    """Nursing homes; each logs in with the seed default password ``<CLINIC_ID>123``"""
+    clinics = []
+    for n in range(count):
+        city = rng.choice(CITIES)
+        clinics.append({
+            'clinic_id': f'BENCH{n:04d}',
+            'name': f'{rng.choice(FIRST_NAMES)} Care Home {n}',
+            'location': city[0],
+            'contact_person': f'Dr. {rng.choice(FIRST_NAMES)}',
+            'phone': f'+91-98{rng.randint(0, 99999999):08d}',
+            'email': f'bench{n}@example.com'
+        })
+    return clinics
+
+def generate_pros(rng, count, hospital_ids):
+    return [{
+        'pro_id': f'BPRO{n:05d}',
+        'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+        'assigned_hospital_id': rng.choice(hospital_ids),
+        'contact': f'+91-90{rng.randint(0, 99999999):08d}',
+        'email': f'pro{n}@example.com',
+        'patients_assigned': []
+    } for n in range(count)]
+
+def generate_patients(rng, count, clinic_ids, hospital_ids):
+    """Yield (clinic_id, patient) pairs spread over the last year"""
+    now = datetime.now()
+    for n in range(count):
+        clinic_id = clinic_ids[n % len(clinic_ids)]
+        city = rng.choice(CITIES)
+        yield clinic_id, {
+            'patient_id': f'BP{n:07d}',
+            'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'age': rng.randint(1, 99),
+            'gender': rng.choice(['Male', 'Female']),
+            'contact_number': f'+91-9{rng.randint(0, 999999999):09d}',
+            'address': f'{rng.randint(1, 500)} Main Road, {city[0]}',
+            'medical_history': rng.sample(CONDITIONS, rng.randint(0, 3)),
+            'current_status': rng.choice(STATUSES),
+            'assigned_hospital_id': rng.choice(hospital_ids),
+            'referred_by': clinic_id,
+            'created_at': (now - timedelta(seconds=rng.randint(0, 365 * 86400))).isoformat()
+        }
+
+def load_app(workdir, mongo_uri):
+    """Import the app from a throwaway copy of the project"""
+    shutil.copytree(PROJECT_DIR, workdir, ignore=shutil.ignore_patterns(
+        '__pycache__', '*.db', '*.db-wal', '*.db-shm', '*.journal', '*.journal.old', '*.temp'))
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    import app as caresync
+    if mongo_uri:
+        caresync.mongo.uri = mongo_uri
+        caresync.mongo.database = 'caresync_bench'
+        caresync.mongo.client.drop_database('caresync_bench')
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            raise click.ClickException("mongomock is not installed; pip install mongomock or pass --mongo-uri")
+        caresync.mongo._client = mongomock.MongoClient()
+    return caresync
+
+def populate(caresync, hospitals, clinics, pros, patients, seed, batch_size):
+    """Load a synthetic dataset through the app's own seeding path"""
+    rng = random.Random(seed)
+    data = caresync.empty_healthcare_data()
+    data['multispeciality_hospitals'] = generate_hospitals(rng, hospitals)
+    data['nursing_homes'] = generate_clinics(rng, clinics)
+    hospital_ids = [h['hospital_id'] for h in data['multispeciality_hospitals']]
+    clinic_ids = [c['clinic_id'] for c in data['nursing_homes']]
+    data['pros'] = generate_pros(rng, pros, hospital_ids)
+    # Startup loads this snapshot and seeds SQLite from it
+    os.makedirs(os.path.dirname(caresync.json_path), exist_ok=True)
+    with open(caresync.json_path, 'w') as file:
+        json.dump(data, file)
+    caresync.initialize_app()
+
+    batches = {}
+    for clinic_id, patient in generate_patients(rng, patients, clinic_ids, hospital_ids):
+        batch = batches.setdefault(clinic_id, [])
+        batch.append(patient)
+        if len(batch) >= batch_size:
+            caresync.init_clinic_collection(clinic_id).insert_many(batch, ordered=False)
+            batches[clinic_id] = []
+    for clinic_id, batch in batches.items():
+        if batch:
+            caresync.init_clinic_collection(clinic_id).insert_many(batch, ordered=False)
+
+    # The rollups were built at startup, before these patients existed
+    caresync.analytics.rebuild_patients()
+
+    for n in range(min(20, len(data['nursing_homes']))):
+        city = CITIES[n % len(CITIES)]
+        caresync.ambulance_fleet.register(f'Bench ambulance {n}', city[1], city[2])
+    return hospital_ids, clinic_ids
+
+def make_client(caresync, role, clinic_id):
+    client = caresync.app.test_client()
+    if role == 'nursing_home':
+        response = client.post('/nursing-home/login', data={'clinic_id': clinic_id, 'password': f'{clinic_id}123'})
+        if response.status_code != 302:
+            raise click.ClickException(f"Could not log in as {clinic_id}")
+    else:
+        # There is no admin login form; admin sessions are provisioned directly
+        with client.session_transaction() as session:
+            session['user_id'] = 0
+            session['role'] = 'admin'
+            session['username'] = 'bench_admin'
+    return client
+
+def build_scenarios(hospital_ids, clinic_ids):
+    """(name, role, weight, request, expected) tuples; weight scales the iteration count.
+
+    ``expected`` is (status, redirect path prefix, flash category); a response
+    that differs in any of them counts as an error. A redirect path or flash
+    category of None is not checked.
+    """
+    def login(client, rng, clinic_id):
+        return client.post('/nursing-home/login', data={'clinic_id': clinic_id, 'password': f'{clinic_id}123'})
+
+    def dashboard(client, rng, clinic_id):
+        return client.get('/nursing-home/dashboard')
+
+    def dashboard_filtered(client, rng, clinic_id):
+        return client.get(f'/nursing-home/dashboard?status=Pending&hospital={rng.choice(hospital_ids)}')
+
+    def add_patient(client, rng, clinic_id):
+        return client.post('/add-patient', data={
+            'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'age': str(rng.randint(1, 99)),
+            'gender': 'Female',
+            'contact_number': f'+91-9{rng.randint(0, 999999999):09d}',
+            'address': 'Bench Road',
+            'medical_history': ', '.join(rng.sample(CONDITIONS, 2)),
+            'assigned_hospital_id': rng.choice(hospital_ids)
+        })
+
+    def api_hospitals(client, rng, clinic_id):
+        return client.get('/api/hospitals')
+
+    def api_pros(client, rng, clinic_id):
+        return client.get('/api/pros')
+
+    def api_patients(client, rng, clinic_id):
+        return client.get('/api/patients')
+
+    def api_search(client, rng, clinic_id):
+        return client.get(f'/api/patients/search?q={rng.choice(FIRST_NAMES)[:4]}')
+
+    def api_recommend(client, rng, clinic_id):
+        return client.get(f"/api/recommend-hospitals?medical_history={','.join(rng.sample(CONDITIONS, 2))}")
+
+    def api_ambulance_requests(client, rng, clinic_id):
+        return client.get('/api/ambulance-requests')
+
+    def api_nearest_ambulances(client, rng, clinic_id):
+        city = rng.choice(CITIES)
+        return client.get(f'/api/ambulances/nearest?lat={city[1]}&lon={city[2]}&k=5')
+
+    def edit_hospital(client, rng, clinic_id):
+        total_beds = rng.randint(20000, 200000)
+        return client.post(f'/hospital/{rng.choice(hospital_ids)}/edit', data={
+            'name': 'Bench Hospital',
+            'location': 'Chennai, India',
+            'contact_number': '+91-9000000000',
+            'total_beds': str(total_beds),
+            'available_beds': str(total_beds // 2),
+            'icu_total': '50',
+            'icu_available': '10',
+            'specialties': ', '.join(rng.sample(SPECIALTIES, 3)),
+            'ambulance_services': 'on'
+        })
+
+    ok = (200, None, None)
+    return [
+        ('login', 'nursing_home', 1, login, (302, '/nursing-home/dashboard', 'success')),
+        ('dashboard', 'nursing_home', 1, dashboard, ok),
+        ('dashboard_filtered', 'nursing_home', 1, dashboard_filtered, ok),
+        ('add_patient', 'nursing_home', 1, add_patient, (302, '/patient/', 'success')),
+        ('api_hospitals', 'nursing_home', 1, api_hospitals, ok),
+        ('api_pros', 'nursing_home', 1, api_pros, ok),
+        # Streams every patient of every clinic, so it runs far fewer times
+        ('api_patients', 'nursing_home', 0.02, api_patients, ok),
+        ('api_patients_search', 'nursing_home', 1, api_search, ok),
+        ('api_recommend_hospitals', 'nursing_home', 1, api_recommend, ok),
+        ('api_ambulance_requests', 'nursing_home', 1, api_ambulance_requests, ok),
+        ('api_ambulances_nearest', 'nursing_home', 1, api_nearest_ambulances, ok),
+        # Redirects to the hospital list whether or not the save worked; the flash tells them apart
+        ('edit_hospital', 'admin', 1, edit_hospital, (302, '/hospitals', 'success')),
+    ]
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+def take_flashes(client):
+    """Pop the flashed messages a redirect left in the session; returns their categories"""
+    with client.session_transaction() as session:
+        return [category for category, _ in session.pop('_flashes', [])]
+
+def as_expected(response, flashes, expected):
+    status, location, category = expected
+    if response.status_code != status:
+        return False
+    if location is not None and not urlparse(response.headers.get('Location', '')).path.startswith(location):
+        return False
+    return category is None or category in flashes
+
+def run_scenario(caresync, scenario, clinic_ids, iterations, concurrency, warmup, seed):
+    name, role, weight, send, expected = scenario
+    iterations = max(1, int(iterations * weight))
+    warmup = min(warmup, iterations)
+    latencies = []
+    statuses = {}
+    errors = []
+    lock = threading.Lock()
+
+    def worker(number):
+        rng = random.Random(seed + number)
+        clinic_id = clinic_ids[number % len(clinic_ids)]
+        client = make_client(caresync, role, clinic_id)
+        count = iterations // concurrency + (number < iterations % concurrency)
+        for n in range(count + (warmup if number == 0 else 0)):
+            started = time.perf_counter()
+            response = send(client, rng, clinic_id)
+            response.get_data()
+            elapsed = time.perf_counter() - started
+            response.close()
+            # Redirects are not followed, so clear their flashes (untimed) before the cookie grows
+            flashes = take_flashes(client) if response.status_code == 302 else []
+            if number == 0 and n < warmup:
+                continue
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if not as_expected(response, flashes, expected):
+                    errors.append(response.status_code)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    to_ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'mean_ms': to_ms(sum(latencies) / len(latencies)),
+        'p50_ms': to_ms(percentile(latencies, 50)),
+        'p95_ms': to_ms(percentile(latencies, 95)),
+        'p99_ms': to_ms(percentile(latencies, 99)),
+        'max_ms': to_ms(latencies[-1])
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline, results, tolerance):
+    """Print per-route changes against a baseline; returns the routes that regressed"""
+    regressed = []
+    click.echo(f"\n{'route':<26}{'p50 base':>10}{'p50 now':>10}{'p99 base':>10}{'p99 now':>10}{'p95 chg':>9}")
+    for name, now in results['routes'].items():
+        base = baseline.get('routes', {}).get(name)
+        if not base:
+            click.echo(f"{name:<26}{'(new)':>10}")
+            continue
+        change = (now['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100 if base['p95_ms'] else 0
+        marker = '  REGRESSED' if change > tolerance else ''
+        if marker:
+            regressed.append(name)
+        click.echo(f"{name:<26}{base['p50_ms']:>10.2f}{now['p50_ms']:>10.2f}{base['p99_ms']:>10.2f}"
+                   f"{now['p99_ms']:>10.2f}{change:>+8.1f}%{marker}")
+    return regressed
+
+@click.command()
+@click.option('--hospitals', default=200, show_default=True, help='Synthetic hospitals.')
+@click.option('--clinics', default=50, show_default=True, help='Synthetic nursing homes.')
+@click.option('--patients', default=10000, show_default=True, help='Synthetic patients (up to 1,000,000).')
+@click.option('--pros', default=100, show_default=True, help='Synthetic PROs.')
+@click.option('--requests', 'iterations', default=200, show_default=True, help='Timed requests per route.')
+@click.option('--concurrency', default=1, show_default=True, help='Client threads per route.')
+@click.option('--warmup', default=5, show_default=True, help='Untimed requests before each route.')
+@click.option('--route', 'routes', multiple=True, help='Only run these routes (repeatable).')
+@click.option('--seed', default=1, show_default=True, help='Random seed for the dataset and requests.')
+@click.option('--batch-size', default=5000, show_default=True, help='Patients per insert_many.')
+@click.option('--mongo-uri', default=None, help='Benchmark against this MongoDB instead of mongomock.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results as JSON here.')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False),
+              help='Baseline JSON to compare against.')
+@click.option('--tolerance', default=10.0, show_default=True, help='Allowed p95 slowdown (%) before failing.')
+def main(hospitals, clinics, patients, pros, iterations, concurrency, warmup, routes, seed, batch_size,
+         mongo_uri, output, baseline_path, tolerance):
+    """Benchmark CareSync routes against a synthetic dataset"""
+    if patients > 1000000:
+        raise click.BadParameter('at most 1,000,000 patients', param_hint='--patients')
+    output = os.path.abspath(output) if output else None
+    baseline_path = os.path.abspath(baseline_path) if baseline_path else None
+    workdir = tempfile.mkdtemp(prefix='caresync-bench-')
+    try:
+        caresync = load_app(os.path.join(workdir, 'app'), mongo_uri)
+        # Startup configures logging from this; keep request logs out of the results
+        caresync.app.config['LOG_LEVEL'] = 'WARNING'
+
+        click.echo(f"Generating {hospitals} hospitals, {clinics} clinics, {patients} patients, {pros} PROs...")
+        started = time.perf_counter()
+        hospital_ids, clinic_ids = populate(caresync, hospitals, clinics, pros, patients, seed, batch_size)
+        setup_seconds = time.perf_counter() - started
+
+        scenarios = build_scenarios(hospital_ids, clinic_ids)
+        if routes:
+            unknown = set(routes) - {scenario[0] for scenario in scenarios}
+            if unknown:
+                raise click.BadParameter(f"unknown routes: {', '.join(sorted(unknown))}", param_hint='--route')
+            scenarios = [scenario for scenario in scenarios if scenario[0] in routes]
+
+        results = {
+            'generated_at': datetime.now().isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'mongo': 'mongodb' if mongo_uri else 'mongomock',
+            'dataset': {'hospitals': hospitals, 'clinics': clinics, 'patients': patients, 'pros': pros,
+                        'seed': seed, 'setup_seconds': round(setup_seconds, 2)},
+            'settings': {'requests': iterations, 'concurrency': concurrency, 'warmup': warmup},
+            'routes': {}
+        }
+        click.echo(f"{'route':<26}{'reqs':>7}{'errors':>8}{'rps':>10}{'p50':>9}{'p95':>9}{'p99':>9}  (ms)")
+        for scenario in scenarios:
+            stats = run_scenario(caresync, scenario, clinic_ids, iterations, concurrency, warmup, seed)
+            results['routes'][scenario[0]] = stats
+            click.echo(f"{scenario[0]:<26}{stats['requests']:>7}{stats['errors']:>8}{stats['throughput_rps']:>10.1f}"
+                       f"{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}")
+        caresync.dispatch_queue.stop()
+    finally:
+        os.chdir(PROJECT_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+            file.write('\n')
+        click.echo(f"Wrote {output}")
+    if baseline_path:
+        with open(baseline_path) as file:
+            regressed = compare(json.load(file), results, tolerance)
+        if regressed:
+            raise click.ClickException(f"p95 regressed by more than {tolerance}% on: {', '.join(regressed)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Concurrency check for the bed ledger.
+
+Hammers BedLedger.reserve/commit/release/expire_stale from several worker
+processes, each running several threads with its own connections, against a
+throwaway SQLite file. Reservations use TTLs short enough that holds lapse
+while other workers are committing them, and some threads play an admin
+re-saving the edit form with the counts it loaded a moment earlier. When the
+run ends, the ledger is checked against every reservation row and against
+what each worker saw:
+
+  * for every hospital and bed type, available + held + committed == total;
+  * a commit that reported success left the reservation committed (or
+    released, if that worker released it afterwards);
+  * a commit that reported failure never left the reservation committed;
+  * no operation ever returned a negative or over-capacity count.
+
+    python ledger_check.py --processes 4 --threads 8 --seconds 10
+"""
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_app(workdir):
+    """Import the app from a throwaway copy of the project"""
+    shutil.copytree(PROJECT_DIR, workdir, ignore=shutil.ignore_patterns(
+        '__pycache__', '*.db', '*.db-wal', '*.db-shm', '*.journal', '*.journal.old', '*.temp'))
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    import app as caresync
+    return caresync
+
+def bad_counts(counts):
+    return [(hospital_id, bed_type, total, available)
+            for hospital_id, beds in counts.items()
+            for bed_type, (total, available) in beds.items()
+            if not 0 <= available <= total]
+
+def admin_edit(ledger, hospital_id, rng, max_ttl):
+    """Load the edit form, wait, then save it unchanged, as an admin would"""
+    with ledger.pool.connection() as conn:
+        counts = ledger._counts(conn, [hospital_id])[hospital_id]
+    time.sleep(rng.uniform(0, max_ttl))
+    (total, available), (icu_total, icu_available) = counts['general'], counts['icu']
+    return ledger.set_capacity(hospital_id, total, available, icu_total, icu_available,
+                               loaded=(available, icu_available))
+
+def worker(caresync, db_path, hospital_ids, threads, seconds, max_ttl, seed, results):
+    """Run ``threads`` threads of random ledger operations; report what they observed"""
+    pool = caresync.SQLitePool(db_path, size=threads)
+    ledger = caresync.BedLedger(pool)
+    observed = {'committed': [], 'commit_failed': [], 'released_after_commit': [],
+                'bad_counts': [], 'operations': Counter()}
+    deadline = time.monotonic() + seconds
+
+    def run(thread_seed):
+        rng = random.Random(thread_seed)
+        while time.monotonic() < deadline:
+            hospital_id = rng.choice(hospital_ids)
+            if rng.random() < 0.02:
+                observed['bad_counts'].extend(bad_counts(admin_edit(ledger, hospital_id, rng, max_ttl)))
+                observed['operations']['admin_edit'] += 1
+                continue
+            bed_type = rng.choice(caresync.BedLedger.BED_TYPES)
+            try:
+                reservation_id, counts = ledger.reserve(hospital_id, 'check', bed_type,
+                                                        ttl_seconds=rng.uniform(0.001, max_ttl))
+            except caresync.CapacityError:
+                observed['operations']['full'] += 1
+                continue
+            observed['operations']['reserve'] += 1
+            observed['bad_counts'].extend(bad_counts(counts))
+            action = rng.random()
+            if action < 0.15:
+                counts = ledger.release(reservation_id)[1]
+                observed['operations']['release'] += 1
+            elif action < 0.3:
+                observed['operations']['abandon'] += 1
+                continue
+            else:
+                # Sometimes commit after the hold may already have lapsed
+                time.sleep(rng.uniform(0, max_ttl * 1.5))
+                committed, counts = ledger.commit(reservation_id)
+                observed['operations']['commit' if committed else 'commit_failed'] += 1
+                observed['committed' if committed else 'commit_failed'].append(reservation_id)
+                if committed and rng.random() < 0.3:
+                    counts = ledger.release(reservation_id)[1]
+                    observed['released_after_commit'].append(reservation_id)
+            observed['bad_counts'].extend(bad_counts(counts))
+            if rng.random() < 0.05:
+                observed['bad_counts'].extend(bad_counts(ledger.expire_stale()))
+                observed['operations']['expire_stale'] += 1
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(run, [seed * 1000 + n for n in range(threads)]))
+    observed['operations'] = dict(observed['operations'])
+    results.put(observed)
+
+def check(db_path, observed):
+    """Compare the final ledger with the reservations and with what the workers saw"""
+    problems = []
+    conn = sqlite3.connect(db_path)
+    statuses = dict(conn.execute("SELECT reservation_id, status FROM bed_reservations"))
+    outstanding = Counter()
+    for hospital_id, bed_type, count in conn.execute("""
+        SELECT hospital_id, bed_type, COUNT(*) FROM bed_reservations
+        WHERE status IN ('held', 'committed') GROUP BY hospital_id, bed_type
+    """):
+        outstanding[(hospital_id, bed_type)] = count
+    for hospital_id, bed_type, total, available in conn.execute(
+            "SELECT hospital_id, bed_type, total, available FROM bed_ledger"):
+        if available + outstanding[(hospital_id, bed_type)] != total:
+            problems.append(f"{hospital_id}/{bed_type}: {available} available + "
+                            f"{outstanding[(hospital_id, bed_type)]} held or committed != {total} total")
+    conn.close()
+
+    released = {r for seen in observed for r in seen['released_after_commit']}
+    for seen in observed:
+        for reservation_id in seen['committed']:
+            expected = 'released' if reservation_id in released else 'committed'
+            if statuses.get(reservation_id) != expected:
+                problems.append(f"{reservation_id}: commit succeeded but status is {statuses.get(reservation_id)}")
+        for reservation_id in seen['commit_failed']:
+            if statuses.get(reservation_id) == 'committed':
+                problems.append(f"{reservation_id}: commit failed but the reservation is committed")
+        for hospital_id, bed_type, total, available in seen['bad_counts']:
+            problems.append(f"{hospital_id}/{bed_type}: returned {available} available of {total}")
+    return problems
+
+@click.command()
+@click.option('--processes', default=4, show_default=True, help='Worker processes.')
+@click.option('--threads', default=8, show_default=True, help='Threads per worker process.')
+@click.option('--seconds', default=5.0, show_default=True, help='How long each worker runs.')
+@click.option('--hospitals', default=3, show_default=True, help='Hospitals to contend over.')
+@click.option('--beds', default=5, show_default=True, help='Beds of each type per hospital.')
+@click.option('--max-ttl', default=0.05, show_default=True, help='Longest reservation TTL, in seconds.')
+@click.option('--seed', default=1, show_default=True, help='Random seed.')
+def main(processes, threads, seconds, hospitals, beds, max_ttl, seed):
+    """Check the bed ledger for lost or double-booked beds under contention"""
+    workdir = tempfile.mkdtemp(prefix='caresync-ledger-')
+    try:
+        caresync = load_app(os.path.join(workdir, 'app'))
+        db_path = os.path.join(workdir, 'ledger.db')
+        setup = caresync.SQLitePool(db_path, size=1)
+        with setup.connection() as conn:
+            caresync._create_tables(conn)
+        hospital_ids = [f'CHK{n:03d}' for n in range(hospitals)]
+        ledger = caresync.BedLedger(setup)
+        for hospital_id in hospital_ids:
+            ledger.set_capacity(hospital_id, beds, beds, beds, beds)
+
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        workers = [context.Process(target=worker, args=(caresync, db_path, hospital_ids, threads, seconds,
+                                                        max_ttl, seed + n, results))
+                   for n in range(processes)]
+        for process in workers:
+            process.start()
+        observed = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+        if any(process.exitcode for process in workers):
+            raise click.ClickException("A worker process crashed")
+
+        totals = Counter()
+        for seen in observed:
+            totals.update(seen['operations'])
+        click.echo(', '.join(f'{name}: {count}' for name, count in sorted(totals.items())))
+        problems = check(db_path, observed)
+    finally:
+        os.chdir(PROJECT_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if problems:
+        for problem in problems[:50]:
+            click.echo(problem, err=True)
+        raise click.ClickException(f"{len(problems)} ledger inconsistencies found")
+    click.echo("Ledger consistent")
+
+if __name__ == '__main__':
+    main()